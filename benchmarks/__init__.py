@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+"""
+reproducible benchmark suite of the file server
+
+Generates synthetic trees (trees.py), starts start_server() in a child
+process (server.py), drives concurrent load against listing, download,
+upload and 404 scenarios (load.py), and reports p50/p99 latency, throughput
+and peak server RSS per scenario as JSON, so runs can be compared to catch
+regressions.
+
+usage, from the repo root:
+    python -m benchmarks --json results.json
+    python -m benchmarks --wide-entries 1000000 --work-dir /tmp/tfs-bench --scenarios listing-list
+
+The single-purpose benchmarks bench_file_transfer (sendfile vs chunked) and
+bench_folder_render (page rendering) use the same server, e.g.
+    python -m benchmarks.bench_folder_render --num-items 1000
+
+author: zhaoyafei0210@gmail.com
+github: https://github.com/walkoncross/tornado-file-server
+"""
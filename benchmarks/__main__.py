@@ -0,0 +1,341 @@
+# -*- coding: utf-8 -*-
+"""
+run the benchmark suite, see __init__.py
+
+Scenarios:
+    listing-list     random pages of the wide folder, list mode
+    listing-sorted   random pages of the wide folder, newest first
+    listing-preview  random pages of the media folder, preview mode
+    listing-deep     random folders of the deep tree
+    download-small   random small files (served from the file content cache once warm)
+    download-large   the large file, whole
+    download-range   random 64 KB ranges of the large file
+    upload-put       raw PUT uploads of --upload-size-kb KB
+    upload-post      multipart form uploads of --upload-size-kb KB
+    not-found        random missing paths, 404
+
+Results, one entry per scenario, are printed as a table and written as JSON
+with --json.
+
+author: zhaoyafei0210@gmail.com
+github: https://github.com/walkoncross/tornado-file-server
+"""
+
+import itertools
+import json
+import math
+import os
+import os.path as osp
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from urllib.parse import quote
+from urllib.request import urlopen
+
+import tornado
+
+from .load import BenchRequest, run_load
+from .server import BenchmarkServer
+from .trees import (
+    TreeSpec, prepare_tree, get_deep_folders, get_small_name,
+    WIDE_DIR, DEEP_DIR, MEDIA_DIR, SMALL_DIR, LARGE_FILE, UPLOADS_DIR
+)
+
+
+RANGE_SIZE = 64 * 1024
+MULTIPART_BOUNDARY = 'tfs-bench-boundary-7d0c1a'
+
+
+class Scenario(object):
+    """A named request generator and its share of the requests
+    """
+
+    def __init__(self, name, make_request, num_requests):
+        """__init__
+
+        Args:
+            name (str): scenario name
+            make_request (callable): see run_load()
+            num_requests (int): number of requests
+        """
+        self.name = name
+        self.make_request = make_request
+        self.num_requests = num_requests
+
+
+def make_multipart_body(filename, data):
+    return b''.join([
+        b'--' + MULTIPART_BOUNDARY.encode() + b'\r\n',
+        b'Content-Disposition: form-data; name="files"; filename="' + filename.encode() + b'"\r\n',
+        b'Content-Type: application/octet-stream\r\n\r\n',
+        data,
+        b'\r\n--' + MULTIPART_BOUNDARY.encode() + b'--\r\n',
+    ])
+
+
+def get_scenarios(spec, args):
+    """get_scenarios
+
+    Args:
+        spec (TreeSpec): sizes of the served trees
+        args (argparse.Namespace): command line args
+
+    Returns:
+        list: Scenario objects, in run order
+    """
+    wide_pages = max(1, int(math.ceil(spec.wide_entries / float(args.items_per_page))))
+    media_pages = max(1, int(math.ceil(spec.media_files / float(args.items_per_page))))
+    deep_uris = [
+        u'/{}/{}'.format(DEEP_DIR, quote(folder)) for folder in get_deep_folders(
+            spec.deep_depth, spec.deep_fanout)
+    ]
+    large_size = spec.large_file_mb * 1024 * 1024
+    upload_data = os.urandom(args.upload_size_kb * 1024)
+    # next() of a count is atomic, upload names never collide across threads
+    upload_counter = itertools.count()
+
+    def listing_list(rng):
+        return BenchRequest('GET', u'/{}/?view_mode=list&page_id={}'.format(
+            WIDE_DIR, rng.randint(1, wide_pages)))
+
+    def listing_sorted(rng):
+        return BenchRequest('GET', u'/{}/?view_mode=list&sort=mtime&order=desc&page_id={}'.format(
+            WIDE_DIR, rng.randint(1, wide_pages)))
+
+    def listing_preview(rng):
+        return BenchRequest('GET', u'/{}/?view_mode=preview&page_id={}'.format(
+            MEDIA_DIR, rng.randint(1, media_pages)))
+
+    def listing_deep(rng):
+        return BenchRequest('GET', rng.choice(deep_uris))
+
+    def download_small(rng):
+        return BenchRequest('GET', u'/{}/{}'.format(
+            SMALL_DIR, get_small_name(rng.randrange(spec.small_files))))
+
+    def download_large(rng):
+        return BenchRequest('GET', u'/' + LARGE_FILE)
+
+    def download_range(rng):
+        start = rng.randrange(max(1, large_size - RANGE_SIZE))
+        return BenchRequest('GET', u'/' + LARGE_FILE, headers={
+            'Range': 'bytes={}-{}'.format(start, start + RANGE_SIZE - 1)
+        }, expected_status=206)
+
+    def upload_put(rng):
+        return BenchRequest('PUT', u'/{}/put-{:07d}.bin'.format(UPLOADS_DIR, next(upload_counter)),
+                            body=upload_data, expected_status=201)
+
+    def upload_post(rng):
+        body = make_multipart_body(u'post-{:07d}.bin'.format(next(upload_counter)), upload_data)
+        return BenchRequest('POST', u'/{}/'.format(UPLOADS_DIR), body=body, headers={
+            'Content-Type': 'multipart/form-data; boundary=' + MULTIPART_BOUNDARY
+        })
+
+    def not_found(rng):
+        return BenchRequest('GET', u'/{}/missing-{:04d}.txt'.format(
+            WIDE_DIR, rng.randrange(1000)), expected_status=404)
+
+    num_requests = args.requests
+    return [
+        Scenario('listing-list', listing_list, num_requests),
+        Scenario('listing-sorted', listing_sorted, num_requests),
+        Scenario('listing-preview', listing_preview, num_requests),
+        Scenario('listing-deep', listing_deep, num_requests),
+        Scenario('download-small', download_small, num_requests),
+        Scenario('download-large', download_large, max(args.concurrency, num_requests // 100)),
+        Scenario('download-range', download_range, num_requests),
+        Scenario('upload-put', upload_put, max(args.concurrency, num_requests // 10)),
+        Scenario('upload-post', upload_post, max(args.concurrency, num_requests // 10)),
+        Scenario('not-found', not_found, num_requests),
+    ]
+
+
+def define_arg_parser():
+    """define_arg_parser
+
+    Returns:
+        ArgumentParser: arg parser
+    """
+    parser = ArgumentParser(prog='python -m benchmarks',
+                            description='Benchmark suite of the tornado file server.')
+    parser.add_argument('--scenarios', type=str, default='all',
+                        help="comma separated scenarios to run, see the module docstring. Default: all")
+    parser.add_argument('--requests', type=int, default=2000,
+                        help='requests per scenario (large downloads and uploads send fewer). '
+                             'Default: 2000')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='number of concurrent connections. Default: 8')
+    parser.add_argument('--warmup', type=int, default=50,
+                        help='requests sent before each scenario, not measured. Default: 50')
+    parser.add_argument('--port', type=int, default=18910,
+                        help='port of the server under test. Default: 18910')
+    parser.add_argument('--work-dir', type=str, default=None,
+                        help='folder of the generated trees, kept and reused by the next runs '
+                             'with the same tree sizes. Default: a temp folder, removed at the end')
+    parser.add_argument('--json', dest='json_path', default=None,
+                        help='write the results into this json file')
+
+    parser.add_argument('--wide-entries', type=int, default=100000,
+                        help='entries of the wide folder, up to 1M and more. Default: 100000')
+    parser.add_argument('--deep-depth', type=int, default=12,
+                        help='folder levels of the deep tree. Default: 12')
+    parser.add_argument('--media-files', type=int, default=2000,
+                        help='files of the mixed media folder. Default: 2000')
+    parser.add_argument('--small-files', type=int, default=1000,
+                        help='number of small files to download. Default: 1000')
+    parser.add_argument('--large-file-mb', type=int, default=64,
+                        help='size of the large file to download in MB. Default: 64')
+    parser.add_argument('--upload-size-kb', type=int, default=256,
+                        help='size of each upload in KB. Default: 256')
+
+    parser.add_argument('--items-per-page', type=int, default=50,
+                        help='items per folder page of the server. Default: 50')
+    parser.add_argument('--listing-mode', type=str, default='lazy', choices=['lazy', 'eager'],
+                        help="listing mode of the server. Default: 'lazy'")
+    parser.add_argument('--io-threads', type=int, default=16,
+                        help='io threads of the server. Default: 16')
+    parser.add_argument('--no-sendfile', dest='sendfile', action='store_false',
+                        help='serve files with chunked reads instead of os.sendfile()')
+
+    return parser
+
+
+def wait_until_indexed(port, timeout=600.0):
+    """wait until the search index is built, its walk would disturb the first scenarios
+
+    Args:
+        port (int): server port
+        timeout (float, optional): max seconds to wait. Defaults to 600.0.
+    """
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        with urlopen('http://localhost:{}/_stats'.format(port)) as response:
+            stats = json.loads(response.read())
+
+        search_stats = stats.get('search_index')
+        if search_stats is None or search_stats['ready']:
+            return
+
+        time.sleep(0.5)
+
+    raise RuntimeError(u'search index not built after {} seconds'.format(timeout))
+
+
+def get_server_stats(port):
+    with urlopen('http://localhost:{}/_stats'.format(port)) as response:
+        return json.loads(response.read())
+
+
+def format_value(value, fmt):
+    return u'-' if value is None else fmt.format(value)
+
+
+def print_results(results):
+    print(u'{:<16} {:>8} {:>7} {:>9} {:>9} {:>10} {:>10} {:>10}'.format(
+        'scenario', 'requests', 'errors', 'p50 ms', 'p99 ms', 'req/s', 'MB/s', 'peak RSS'))
+
+    for result in results:
+        mb_per_s = max(result['mb_received_per_s'] or 0, result['mb_sent_per_s'] or 0)
+        peak_rss = result['server_peak_rss']
+        print(u'{:<16} {:>8} {:>7} {:>9} {:>9} {:>10} {:>10} {:>10}'.format(
+            result['scenario'], result['requests'], result['errors'],
+            format_value(result['p50_ms'], '{:.2f}'),
+            format_value(result['p99_ms'], '{:.2f}'),
+            format_value(result['requests_per_s'], '{:.1f}'),
+            u'{:.1f}'.format(mb_per_s),
+            format_value(peak_rss / 1e6 if peak_rss is not None else None, '{:.0f} MB')))
+
+        if result['first_error']:
+            print(u'    first error: {}'.format(result['first_error']))
+
+
+def main():
+    args = define_arg_parser().parse_args()
+
+    spec = TreeSpec(
+        wide_entries=args.wide_entries,
+        deep_depth=args.deep_depth,
+        media_files=args.media_files,
+        small_files=args.small_files,
+        large_file_mb=args.large_file_mb,
+    )
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='tfs-bench-')
+    root_dir = osp.abspath(osp.join(work_dir, 'root'))
+
+    all_scenarios = get_scenarios(spec, args)
+    if args.scenarios != 'all':
+        names = args.scenarios.split(',')
+        unknown = set(names) - set(scenario.name for scenario in all_scenarios)
+        if unknown:
+            sys.exit(u'unknown scenarios: {}'.format(u', '.join(sorted(unknown))))
+        all_scenarios = [scenario for scenario in all_scenarios if scenario.name in names]
+
+    try:
+        time_start = time.time()
+        generated = prepare_tree(root_dir, spec)
+        print(u'{} trees in {}: {:.1f} s'.format(
+            u'generated' if generated else u'reused', root_dir, time.time() - time_start))
+
+        server = BenchmarkServer(
+            root_dir, args.port, osp.join(work_dir, 'server.log'),
+            items_per_page=args.items_per_page,
+            listing_mode=args.listing_mode,
+            io_threads=args.io_threads,
+            sendfile=args.sendfile,
+            thumbnail_processes=0,
+        )
+
+        results = []
+        with server:
+            wait_until_indexed(args.port)
+
+            for scenario in all_scenarios:
+                if args.warmup > 0 and not scenario.name.startswith('upload'):
+                    run_load(args.port, scenario.make_request, args.warmup,
+                             args.concurrency, seed=1)
+
+                server.reset_peak_rss()
+                cpu_start = server.get_cpu_seconds()
+
+                result = run_load(args.port, scenario.make_request, scenario.num_requests,
+                                  args.concurrency)
+
+                cpu_end = server.get_cpu_seconds()
+                result['scenario'] = scenario.name
+                result['server_peak_rss'] = server.get_peak_rss()
+                result['server_cpu_seconds'] = (
+                    cpu_end - cpu_start if cpu_start is not None and cpu_end is not None else None)
+                results.append(result)
+
+            server_stats = get_server_stats(args.port)
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        else:
+            # uploads are not part of the reusable trees
+            shutil.rmtree(osp.join(root_dir, UPLOADS_DIR), ignore_errors=True)
+
+    print_results(results)
+
+    if args.json_path:
+        with open(args.json_path, 'w') as fp:
+            json.dump({
+                'timestamp': time.time(),
+                'python': platform.python_version(),
+                'tornado': tornado.version,
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count(),
+                'args': vars(args),
+                'tree': spec.to_dict(),
+                'results': results,
+                'server_stats': server_stats,
+            }, fp, indent=2)
+
+
+if __name__ == '__main__':
+    main()
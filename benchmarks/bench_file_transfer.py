@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+throughput benchmark of large file downloads: os.sendfile() vs chunked reads
+
+Starts the server twice on a temp folder holding one large file, with and
+without sendfile, downloads the file over several concurrent
+connections, and reports throughput and server CPU time for both paths.
+
+usage:
+    python -m benchmarks.bench_file_transfer --size-mb 512 --concurrency 4 --requests 16
+
+author: zhaoyafei0210@gmail.com
+github: https://github.com/walkoncross/tornado-file-server
+"""
+
+import http.client
+import json
+import os
+import os.path as osp
+import shutil
+import tempfile
+import threading
+import time
+from argparse import ArgumentParser
+
+from .server import BenchmarkServer
+
+
+def define_arg_parser():
+    """define_arg_parser
+
+    Returns:
+        ArgumentParser: arg parser
+    """
+    parser = ArgumentParser(description='Benchmark large file downloads, sendfile vs chunked.')
+    parser.add_argument('--size-mb', type=int, default=512,
+                        help='size of the test file in MB. Default: 512')
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help='number of concurrent connections. Default: 4')
+    parser.add_argument('--requests', type=int, default=16,
+                        help='total number of downloads per mode. Default: 16')
+    parser.add_argument('--port', type=int, default=18900,
+                        help='port of the server under test. Default: 18900')
+    parser.add_argument('--json', dest='json_path', default=None,
+                        help='also write the results into this json file')
+
+    return parser
+
+
+def get_process_cpu_seconds(pid):
+    """get_process_cpu_seconds, Linux only
+
+    Args:
+        pid (int): process id
+
+    Returns:
+        float: user + system cpu time of the process, None if unknown
+    """
+    try:
+        with open('/proc/{}/stat'.format(pid)) as fp:
+            fields = fp.read().rsplit(')', 1)[1].split()
+    except OSError:
+        return None
+
+    # utime and stime are fields 14 and 15 of /proc/PID/stat
+    return (int(fields[11]) + int(fields[12])) / float(os.sysconf('SC_CLK_TCK'))
+
+
+def download(port, uri, num_requests, results, lock):
+    """download uri num_requests times over one keep-alive connection
+
+    Args:
+        port (int): server port
+        uri (str): uri of the file
+        num_requests (int): number of downloads
+        results (list): total bytes received are appended to it
+        lock (threading.Lock): lock of results
+    """
+    conn = http.client.HTTPConnection('localhost', port)
+    buf = bytearray(1024 * 1024)
+    view = memoryview(buf)
+    total_bytes = 0
+
+    for _ in range(num_requests):
+        conn.request('GET', uri)
+        response = conn.getresponse()
+        while True:
+            n = response.readinto(view)
+            if not n:
+                break
+            total_bytes += n
+        response.close()
+
+    conn.close()
+
+    with lock:
+        results.append(total_bytes)
+
+
+def run_mode(root_dir, file_name, args, sendfile):
+    """benchmark one transfer mode
+
+    Args:
+        root_dir (str): folder to serve
+        file_name (str): name of the test file
+        args (argparse.Namespace): command line args
+        sendfile (bool): use os.sendfile() or not
+
+    Returns:
+        dict: results
+    """
+    server = BenchmarkServer(root_dir, args.port, osp.join(root_dir, '..', 'bench.log'),
+                             sendfile=sendfile, thumbnail_processes=0)
+    with server:
+        pid = server.process.pid
+
+        # warm up the page cache, so both modes read from memory
+        download(args.port, '/' + file_name, 1, [], threading.Lock())
+
+        results = []
+        lock = threading.Lock()
+        per_thread = [args.requests // args.concurrency] * args.concurrency
+        for ii in range(args.requests % args.concurrency):
+            per_thread[ii] += 1
+
+        cpu_start = get_process_cpu_seconds(pid)
+        time_start = time.time()
+
+        threads = [
+            threading.Thread(target=download,
+                             args=(args.port, '/' + file_name, n, results, lock))
+            for n in per_thread if n > 0
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        elapsed = time.time() - time_start
+        cpu_end = get_process_cpu_seconds(pid)
+
+    total_bytes = sum(results)
+    expected_bytes = args.requests * args.size_mb * 1024 * 1024
+    if total_bytes != expected_bytes:
+        raise RuntimeError(u'received {} bytes, expected {}'.format(total_bytes, expected_bytes))
+
+    server_cpu = None
+    if cpu_start is not None and cpu_end is not None:
+        server_cpu = cpu_end - cpu_start
+
+    return {
+        'mode': 'sendfile' if sendfile else 'chunked',
+        'bytes': total_bytes,
+        'seconds': elapsed,
+        'throughput_gbit_s': total_bytes * 8 / elapsed / 1e9,
+        'server_cpu_seconds': server_cpu,
+        'server_cpu_per_gb': server_cpu / (total_bytes / 1e9) if server_cpu is not None else None,
+    }
+
+
+def main():
+    args = define_arg_parser().parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='tfs-bench-')
+    root_dir = osp.join(work_dir, 'root')
+    os.makedirs(root_dir)
+
+    file_name = 'big.bin'
+    try:
+        with open(osp.join(root_dir, file_name), 'wb') as fp:
+            block = os.urandom(1024 * 1024)
+            for _ in range(args.size_mb):
+                fp.write(block)
+
+        all_results = [
+            run_mode(root_dir, file_name, args, sendfile=True),
+            run_mode(root_dir, file_name, args, sendfile=False),
+        ]
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(u'{:<10} {:>10} {:>12} {:>16}'.format(
+        'mode', 'seconds', 'Gbit/s', 'server cpu s/GB'))
+    for result in all_results:
+        cpu_per_gb = result['server_cpu_per_gb']
+        print(u'{:<10} {:>10.2f} {:>12.2f} {:>16}'.format(
+            result['mode'], result['seconds'], result['throughput_gbit_s'],
+            '-' if cpu_per_gb is None else '{:.3f}'.format(cpu_per_gb)))
+
+    if args.json_path:
+        with open(args.json_path, 'w') as fp:
+            json.dump(all_results, fp, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+latency benchmark of folder page rendering
+
+Starts the server on a temp folder holding --num-items files (images, audio,
+video and others, so all the preview mode item kinds are rendered), requests
+the page showing all of them in list and preview mode, and reports the
+latency of each mode. The folder listing is cached after the first request,
+so the timings are dominated by page rendering.
+
+usage:
+    python -m benchmarks.bench_folder_render --num-items 1000 --requests 200
+
+author: zhaoyafei0210@gmail.com
+github: https://github.com/walkoncross/tornado-file-server
+"""
+
+import http.client
+import json
+import os
+import os.path as osp
+import shutil
+import tempfile
+import time
+from argparse import ArgumentParser
+
+from .server import BenchmarkServer
+
+
+item_extensions = ['.jpg', '.png', '.mp3', '.mp4', '.txt', '.json', '.py', '.csv']
+
+
+def define_arg_parser():
+    """define_arg_parser
+
+    Returns:
+        ArgumentParser: arg parser
+    """
+    parser = ArgumentParser(description='Benchmark the rendering of folder pages.')
+    parser.add_argument('--num-items', type=int, default=1000,
+                        help='number of files in the folder, all shown on one page. Default: 1000')
+    parser.add_argument('--requests', type=int, default=200,
+                        help='number of requests per view mode. Default: 200')
+    parser.add_argument('--port', type=int, default=18901,
+                        help='port of the server under test. Default: 18901')
+    parser.add_argument('--json', dest='json_path', default=None,
+                        help='also write the results into this json file')
+
+    return parser
+
+
+def get_percentile(sorted_values, percentile):
+    idx = min(len(sorted_values) - 1, int(round(percentile / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+def run_view_mode(port, view_mode, num_requests):
+    """time num_requests page requests over one keep-alive connection
+
+    Args:
+        port (int): server port
+        view_mode (str): 'list' or 'preview'
+        num_requests (int): number of requests
+
+    Returns:
+        dict: results
+    """
+    uri = '/?view_mode={}'.format(view_mode)
+    conn = http.client.HTTPConnection('localhost', port)
+
+    # the first request scans and stats the folder
+    conn.request('GET', uri)
+    body = conn.getresponse().read()
+
+    latencies = []
+    for _ in range(num_requests):
+        time_start = time.perf_counter()
+        conn.request('GET', uri)
+        response = conn.getresponse()
+        response.read()
+        latencies.append(time.perf_counter() - time_start)
+
+    conn.close()
+    latencies.sort()
+
+    return {
+        'view_mode': view_mode,
+        'page_bytes': len(body),
+        'requests': num_requests,
+        'p50_ms': get_percentile(latencies, 50) * 1000,
+        'p99_ms': get_percentile(latencies, 99) * 1000,
+        'mean_ms': sum(latencies) / len(latencies) * 1000,
+    }
+
+
+def main():
+    args = define_arg_parser().parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='tfs-bench-')
+    root_dir = osp.join(work_dir, 'root')
+    os.makedirs(root_dir)
+
+    for ii in range(args.num_items):
+        ext = item_extensions[ii % len(item_extensions)]
+        with open(osp.join(root_dir, u'item & <{:05d}>{}'.format(ii, ext)), 'w') as fp:
+            fp.write('x' * ii)
+
+    server = BenchmarkServer(root_dir, args.port, osp.join(work_dir, 'bench.log'),
+                             items_per_page=args.num_items, thumbnail_processes=0,
+                             compression=False)
+    try:
+        with server:
+            all_results = [
+                run_view_mode(args.port, 'list', args.requests),
+                run_view_mode(args.port, 'preview', args.requests),
+            ]
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(u'{:<10} {:>12} {:>10} {:>10} {:>10}'.format(
+        'mode', 'page bytes', 'p50 ms', 'p99 ms', 'mean ms'))
+    for result in all_results:
+        print(u'{:<10} {:>12} {:>10.2f} {:>10.2f} {:>10.2f}'.format(
+            result['view_mode'], result['page_bytes'],
+            result['p50_ms'], result['p99_ms'], result['mean_ms']))
+
+    if args.json_path:
+        with open(args.json_path, 'w') as fp:
+            json.dump(all_results, fp, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+concurrent load generator of the benchmark suite
+
+A scenario is a function returning the next request to send; run_load()
+sends num_requests of them from `concurrency` threads, each over its own
+keep-alive connection, and measures the latency of each request (until its
+whole response body is read) and the overall throughput.
+
+author: zhaoyafei0210@gmail.com
+github: https://github.com/walkoncross/tornado-file-server
+"""
+
+import http.client
+import random
+import threading
+import time
+
+
+READ_BUFFER_SIZE = 1024 * 1024
+
+
+class BenchRequest(object):
+    """One request of a scenario
+    """
+
+    __slots__ = ('method', 'uri', 'body', 'headers', 'expected_status')
+
+    def __init__(self, method, uri, body=None, headers=None, expected_status=200):
+        """__init__
+
+        Args:
+            method (str): http method
+            uri (str): request uri, quoted
+            body (bytes, optional): request body. Defaults to None.
+            headers (dict, optional): request headers. Defaults to None.
+            expected_status (int, optional): status of a successful response. Defaults to 200.
+        """
+        self.method = method
+        self.uri = uri
+        self.body = body
+        self.headers = headers or {}
+        self.expected_status = expected_status
+
+
+def get_percentile(sorted_values, percentile):
+    """get_percentile, nearest rank
+
+    Args:
+        sorted_values (list): sorted values, not empty
+        percentile (float): 0 to 100
+
+    Returns:
+        float: the percentile
+    """
+    idx = min(len(sorted_values) - 1, int(round(percentile / 100.0 * (len(sorted_values) - 1))))
+
+    return sorted_values[idx]
+
+
+class _Worker(threading.Thread):
+
+    def __init__(self, port, make_request, num_requests, seed):
+        super(_Worker, self).__init__(daemon=True)
+        self.port = port
+        self.make_request = make_request
+        self.num_requests = num_requests
+        self.rng = random.Random(seed)
+
+        self.latencies = []
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.errors = 0
+        self.first_error = None
+
+    def run(self):
+        conn = http.client.HTTPConnection('localhost', self.port, timeout=60)
+        view = memoryview(bytearray(READ_BUFFER_SIZE))
+
+        for _ in range(self.num_requests):
+            request = self.make_request(self.rng)
+
+            time_start = time.perf_counter()
+            try:
+                conn.request(request.method, request.uri, request.body, request.headers)
+                response = conn.getresponse()
+                while True:
+                    n = response.readinto(view)
+                    if not n:
+                        break
+                    self.bytes_received += n
+                response.close()
+            except (OSError, http.client.HTTPException) as e:
+                self.errors += 1
+                self.first_error = self.first_error or u'{} {}: {!r}'.format(
+                    request.method, request.uri, e)
+                conn.close()
+                continue
+
+            self.latencies.append(time.perf_counter() - time_start)
+            if request.body is not None:
+                self.bytes_sent += len(request.body)
+
+            if response.status != request.expected_status:
+                self.errors += 1
+                self.first_error = self.first_error or u'{} {}: HTTP {}'.format(
+                    request.method, request.uri, response.status)
+
+            if response.will_close:
+                conn.close()
+
+        conn.close()
+
+
+def run_load(port, make_request, num_requests, concurrency, seed=0):
+    """send num_requests requests from concurrency connections
+
+    Args:
+        port (int): server port
+        make_request (callable): make_request(rng) returns the next BenchRequest,
+            rng is a random.Random of the calling thread
+        num_requests (int): total number of requests
+        concurrency (int): number of concurrent connections
+        seed (int, optional): seed of the random generators of the threads. Defaults to 0.
+
+    Returns:
+        dict: results, latencies in ms, throughputs per second
+    """
+    concurrency = max(1, min(concurrency, num_requests))
+    workers = [
+        _Worker(port, make_request,
+                num_requests // concurrency + (1 if ii < num_requests % concurrency else 0),
+                seed * 1000 + ii)
+        for ii in range(concurrency)
+    ]
+
+    time_start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - time_start
+
+    latencies = sorted(latency for worker in workers for latency in worker.latencies)
+    bytes_received = sum(worker.bytes_received for worker in workers)
+    bytes_sent = sum(worker.bytes_sent for worker in workers)
+    errors = sum(worker.errors for worker in workers)
+    first_errors = [worker.first_error for worker in workers if worker.first_error]
+
+    results = {
+        'requests': num_requests,
+        'concurrency': concurrency,
+        'errors': errors,
+        'first_error': first_errors[0] if first_errors else None,
+        'seconds': elapsed,
+        'requests_per_s': len(latencies) / elapsed if elapsed > 0 else None,
+        'mb_received_per_s': bytes_received / 1e6 / elapsed if elapsed > 0 else None,
+        'mb_sent_per_s': bytes_sent / 1e6 / elapsed if elapsed > 0 else None,
+        'p50_ms': None,
+        'p99_ms': None,
+        'max_ms': None,
+    }
+
+    if latencies:
+        results['p50_ms'] = get_percentile(latencies, 50) * 1000
+        results['p99_ms'] = get_percentile(latencies, 99) * 1000
+        results['max_ms'] = latencies[-1] * 1000
+
+    return results
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+the server under test, start_server() in a child process
+
+The server runs in its own process, started with the start_server() api
+rather than the command line, so the load generator threads don't compete
+with it for the GIL, and its CPU time and peak RSS can be measured alone
+(Linux only, from /proc).
+
+author: zhaoyafei0210@gmail.com
+github: https://github.com/walkoncross/tornado-file-server
+"""
+
+import logging
+import multiprocessing
+import os
+import socket
+import time
+
+
+def wait_for_port(port, timeout=10.0):
+    """wait until a server accepts connections on a local port
+
+    Args:
+        port (int): port
+        timeout (float, optional): max seconds to wait. Defaults to 10.0.
+    """
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('localhost', port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+
+    raise RuntimeError(u'server did not start on port {}'.format(port))
+
+
+def _serve(root_dir, port, log_path, server_kwargs):
+    # same setup as serving.py, per-request logging is part of the cost
+    logging.basicConfig(filename=log_path, encoding='utf-8', level=logging.INFO)
+
+    from tornado_file_server.tornado_file_server import generate_404_html, start_server
+
+    generate_404_html(root_dir)
+    start_server(root_dir, port=port, **server_kwargs)
+
+
+class BenchmarkServer(object):
+    """start_server() running in a child process
+    """
+
+    def __init__(self, root_dir, port, log_path, **server_kwargs):
+        """__init__
+
+        Args:
+            root_dir (str): root dir to serve
+            port (int): port to listen on
+            log_path (str): log file of the server
+            server_kwargs: other start_server() arguments
+        """
+        self.root_dir = root_dir
+        self.port = port
+        self.log_path = log_path
+        self.server_kwargs = server_kwargs
+        self.process = None
+
+    def start(self, timeout=60.0):
+        """start the server and wait until it accepts connections
+
+        Args:
+            timeout (float, optional): max seconds to wait. Defaults to 60.0.
+        """
+        # spawn, the child must not inherit threads or state of the load generator
+        context = multiprocessing.get_context('spawn')
+        self.process = context.Process(
+            target=_serve,
+            args=(self.root_dir, self.port, self.log_path, self.server_kwargs),
+            name='tfs-bench-server'
+        )
+        self.process.start()
+
+        try:
+            wait_for_port(self.port, timeout)
+        except RuntimeError:
+            self.stop()
+            raise
+
+    def stop(self, timeout=10.0):
+        """stop the server with SIGTERM, as a service manager would
+
+        Args:
+            timeout (float, optional): seconds before it's killed. Defaults to 10.0.
+        """
+        if self.process is None:
+            return
+
+        self.process.terminate()
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+
+        self.process = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _read_status_kb(self, field):
+        try:
+            with open('/proc/{}/status'.format(self.process.pid)) as fp:
+                for line in fp:
+                    if line.startswith(field + ':'):
+                        return int(line.split()[1])
+        except (OSError, ValueError):
+            pass
+
+        return None
+
+    def get_peak_rss(self):
+        """get_peak_rss, Linux only
+
+        Returns:
+            int: peak resident set size in bytes since the start or the last
+                reset_peak_rss(), None if unknown
+        """
+        kb = self._read_status_kb('VmHWM')
+
+        return kb * 1024 if kb is not None else None
+
+    def get_rss(self):
+        """get_rss, Linux only
+
+        Returns:
+            int: current resident set size in bytes, None if unknown
+        """
+        kb = self._read_status_kb('VmRSS')
+
+        return kb * 1024 if kb is not None else None
+
+    def reset_peak_rss(self):
+        """reset the peak RSS to the current RSS, so it can be measured per
+        scenario, Linux only
+
+        Returns:
+            bool: whether the peak was reset
+        """
+        try:
+            with open('/proc/{}/clear_refs'.format(self.process.pid), 'w') as fp:
+                fp.write('5')
+        except OSError:
+            return False
+
+        return True
+
+    def get_cpu_seconds(self):
+        """get_cpu_seconds, Linux only
+
+        Returns:
+            float: user + system cpu time of the server, None if unknown
+        """
+        try:
+            with open('/proc/{}/stat'.format(self.process.pid)) as fp:
+                fields = fp.read().rsplit(')', 1)[1].split()
+        except OSError:
+            return None
+
+        # utime and stime are fields 14 and 15 of /proc/PID/stat
+        return (int(fields[11]) + int(fields[12])) / float(os.sysconf('SC_CLK_TCK'))
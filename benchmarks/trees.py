@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+"""
+synthetic trees for the benchmark suite
+
+All the trees of a run live below one root dir, described by a TreeSpec. A
+tree.json file written after generation records the spec, so a work dir can
+be reused across runs (generating a 1M-entry folder takes a while) and is
+regenerated when the spec changes. File contents come from a seeded random
+generator: the same spec always gives the same tree.
+
+layout:
+    wide/      wide_entries entries, 1% of them empty folders, the rest small files
+    deep/      deep_depth levels of deep_fanout folders, deep_files_per_folder files each
+    media/     media_files images, audio, video and other files
+    small/     small_files files of small_file_size bytes
+    large.bin  a large_file_mb MB file
+    uploads/   emptied before each run, target of the upload scenarios
+
+author: zhaoyafei0210@gmail.com
+github: https://github.com/walkoncross/tornado-file-server
+"""
+
+import json
+import os
+import os.path as osp
+import random
+import shutil
+
+
+TREE_INFO_FILE = 'tree.json'
+WIDE_DIR = 'wide'
+DEEP_DIR = 'deep'
+MEDIA_DIR = 'media'
+SMALL_DIR = 'small'
+LARGE_FILE = 'large.bin'
+UPLOADS_DIR = 'uploads'
+
+media_extensions = ['.jpg', '.png', '.gif', '.mp3', '.wav', '.mp4', '.webm', '.txt', '.json', '.pdf']
+
+
+class TreeSpec(object):
+    """Sizes of the synthetic trees
+    """
+
+    def __init__(
+        self,
+        wide_entries=100000,
+        deep_depth=12,
+        deep_fanout=3,
+        deep_files_per_folder=4,
+        media_files=2000,
+        small_files=1000,
+        small_file_size=4096,
+        large_file_mb=64,
+        seed=0,
+    ):
+        """__init__
+
+        Args:
+            wide_entries (int, optional): number of entries of the wide folder. Defaults to 100000.
+            deep_depth (int, optional): number of folder levels of the deep tree. Defaults to 12.
+            deep_fanout (int, optional): sub folders per folder of the deep tree, only
+                along one branch per level, so the tree stays small. Defaults to 3.
+            deep_files_per_folder (int, optional): files per folder of the deep tree. Defaults to 4.
+            media_files (int, optional): number of files of the media folder. Defaults to 2000.
+            small_files (int, optional): number of small files. Defaults to 1000.
+            small_file_size (int, optional): size in bytes of the small files. Defaults to 4096.
+            large_file_mb (int, optional): size in MB of the large file. Defaults to 64.
+            seed (int, optional): seed of the generated contents. Defaults to 0.
+        """
+        self.wide_entries = wide_entries
+        self.deep_depth = deep_depth
+        self.deep_fanout = deep_fanout
+        self.deep_files_per_folder = deep_files_per_folder
+        self.media_files = media_files
+        self.small_files = small_files
+        self.small_file_size = small_file_size
+        self.large_file_mb = large_file_mb
+        self.seed = seed
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+
+def random_bytes(rng, size):
+    """random_bytes, Random.randbytes() needs python 3.9
+
+    Args:
+        rng (random.Random): random generator
+        size (int): number of bytes
+
+    Returns:
+        bytes: size random bytes
+    """
+    if size <= 0:
+        return b''
+
+    return rng.getrandbits(size * 8).to_bytes(size, 'little')
+
+
+def get_wide_name(idx):
+    if idx % 100 == 99:
+        return u'folder-{:07d}'.format(idx)
+
+    return u'file-{:07d}.txt'.format(idx)
+
+
+def make_wide_tree(dir_path, num_entries):
+    """one folder with num_entries entries: empty folders and 16-byte files
+
+    Args:
+        dir_path (str): folder to create
+        num_entries (int): number of entries
+    """
+    os.makedirs(dir_path)
+
+    for idx in range(num_entries):
+        path = osp.join(dir_path, get_wide_name(idx))
+        if idx % 100 == 99:
+            os.mkdir(path)
+        else:
+            # os.open/os.write, a million open() file objects are slow
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o644)
+            os.write(fd, b'%016d' % idx)
+            os.close(fd)
+
+
+def get_deep_folders(depth, fanout):
+    """get the folders of the deep tree
+
+    At each level, the first folder has fanout sub folders, the others none.
+
+    Args:
+        depth (int): number of levels
+        fanout (int): sub folders of the first folder of each level
+
+    Returns:
+        list: relative folder paths, with '/' separators, from the top one ('')
+    """
+    folders = [u'']
+    parent = u''
+    for level in range(depth):
+        for ii in range(fanout):
+            folders.append(parent + u'level{:02d}-{}/'.format(level, ii))
+        parent = parent + u'level{:02d}-0/'.format(level)
+
+    return folders
+
+
+def make_deep_tree(dir_path, depth, fanout, files_per_folder, rng):
+    """make_deep_tree
+
+    Args:
+        dir_path (str): folder to create
+        depth (int): see get_deep_folders()
+        fanout (int): see get_deep_folders()
+        files_per_folder (int): files per folder
+        rng (random.Random): random generator of the file contents
+    """
+    for folder in get_deep_folders(depth, fanout):
+        folder_path = osp.join(dir_path, folder)
+        os.makedirs(folder_path, exist_ok=True)
+        for ii in range(files_per_folder):
+            with open(osp.join(folder_path, u'file-{}.txt'.format(ii)), 'wb') as fp:
+                fp.write(random_bytes(rng, rng.randint(0, 8192)))
+
+
+def get_media_name(idx):
+    return u'media-{:06d}{}'.format(idx, media_extensions[idx % len(media_extensions)])
+
+
+def make_media_tree(dir_path, num_files, rng):
+    """make_media_tree, contents are random bytes: pages only look at the names
+
+    Args:
+        dir_path (str): folder to create
+        num_files (int): number of files
+        rng (random.Random): random generator of the file contents
+    """
+    os.makedirs(dir_path)
+
+    for idx in range(num_files):
+        with open(osp.join(dir_path, get_media_name(idx)), 'wb') as fp:
+            fp.write(random_bytes(rng, rng.randint(1024, 64 * 1024)))
+
+
+def get_small_name(idx):
+    return u'small-{:05d}.bin'.format(idx)
+
+
+def make_small_files(dir_path, num_files, file_size, rng):
+    os.makedirs(dir_path)
+
+    for idx in range(num_files):
+        with open(osp.join(dir_path, get_small_name(idx)), 'wb') as fp:
+            fp.write(random_bytes(rng, file_size))
+
+
+def make_large_file(file_path, size_mb, rng):
+    block = random_bytes(rng, 1024 * 1024)
+    with open(file_path, 'wb') as fp:
+        for _ in range(size_mb):
+            fp.write(block)
+
+
+def prepare_tree(root_dir, spec):
+    """generate the trees of spec under root_dir, unless they are already there
+
+    Args:
+        root_dir (str): root dir of the trees
+        spec (TreeSpec): sizes of the trees
+
+    Returns:
+        bool: whether the trees were generated (False if reused)
+    """
+    info_path = osp.join(root_dir, TREE_INFO_FILE)
+    uploads_dir = osp.join(root_dir, UPLOADS_DIR)
+
+    try:
+        with open(info_path) as fp:
+            reusable = json.load(fp) == spec.to_dict()
+    except (OSError, ValueError):
+        reusable = False
+
+    if reusable:
+        shutil.rmtree(uploads_dir, ignore_errors=True)
+        os.makedirs(uploads_dir)
+        return False
+
+    shutil.rmtree(root_dir, ignore_errors=True)
+    os.makedirs(root_dir)
+
+    rng = random.Random(spec.seed)
+    make_wide_tree(osp.join(root_dir, WIDE_DIR), spec.wide_entries)
+    make_deep_tree(osp.join(root_dir, DEEP_DIR), spec.deep_depth, spec.deep_fanout,
+                   spec.deep_files_per_folder, rng)
+    make_media_tree(osp.join(root_dir, MEDIA_DIR), spec.media_files, rng)
+    make_small_files(osp.join(root_dir, SMALL_DIR), spec.small_files, spec.small_file_size, rng)
+    make_large_file(osp.join(root_dir, LARGE_FILE), spec.large_file_mb, rng)
+    os.makedirs(uploads_dir)
+
+    # last, an interrupted generation is not reused
+    with open(info_path, 'w') as fp:
+        json.dump(spec.to_dict(), fp)
+
+    return True
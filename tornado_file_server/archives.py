@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+"""
+zip/tar archives of whole folders, generated on the fly
+
+Archives are produced by generators yielding chunks of at most about
+ARCHIVE_CHUNK_SIZE bytes, meant to be advanced in the io thread pool one
+chunk at a time, each chunk being flushed to the client before the next one
+is read: memory stays bounded and slow clients throttle the file reads.
+Nothing is written to disk.
+
+zip archives are streamed with data descriptors (sizes after the data), stored
+or deflated, with ZIP64 extensions for files larger than 4GB and trees of
+more than 65535 entries. Their size is unknown until the end.
+
+tar archives (POSIX pax format) are laid out from the stats of the tree before
+the first byte is sent, so their total size is known and any byte range can be
+generated again: a download can be resumed with a Range request, as long as
+the tree is unchanged (same ETag). A file that changes size in the meantime is
+truncated or padded with zeros to keep the layout.
+
+Folder symlinks are not followed, file symlinks are archived as the files
+they point to.
+
+author: zhaoyafei0210@gmail.com
+github: https://github.com/walkoncross/tornado-file-server
+"""
+
+import bisect
+import hashlib
+import logging
+import os
+import os.path as osp
+import stat
+import tarfile
+import time
+import zipfile
+
+from .chunked_uploads import is_session_file
+
+
+ARCHIVE_ZIP = 'zip'
+ARCHIVE_ZIP_DEFLATE = 'zip-deflate'
+ARCHIVE_TAR = 'tar'
+
+archive_format_list = [ARCHIVE_ZIP, ARCHIVE_ZIP_DEFLATE, ARCHIVE_TAR]
+
+archive_content_types = {
+    ARCHIVE_ZIP: 'application/zip',
+    ARCHIVE_ZIP_DEFLATE: 'application/zip',
+    ARCHIVE_TAR: 'application/x-tar',
+}
+
+archive_extensions = {
+    ARCHIVE_ZIP: '.zip',
+    ARCHIVE_ZIP_DEFLATE: '.zip',
+    ARCHIVE_TAR: '.tar',
+}
+
+ARCHIVE_CHUNK_SIZE = 1024 * 1024
+
+# earliest date a zip entry can hold
+MIN_ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+
+def walk_tree(full_local_path, base_name):
+    """walk a folder tree, sorted, a folder before its files and its sub folders
+
+    Args:
+        full_local_path (str): full local path of the folder
+        base_name (str): name of the folder in the archive
+
+    Yields:
+        tuple: (arcname, full_path, st), st is the stat of a folder or a regular file,
+            the files of chunked uploads are skipped
+    """
+    try:
+        st = os.stat(full_local_path)
+    except OSError as e:
+        logging.info(u'Skip {} in archive: {}'.format(full_local_path, e))
+        return
+
+    # iterative, deep trees would hit the recursion limit
+    pending_dirs = [(base_name, full_local_path, st)]
+    while pending_dirs:
+        arcname, dir_path, dir_stat = pending_dirs.pop()
+        yield arcname, dir_path, dir_stat
+
+        try:
+            with os.scandir(dir_path) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except OSError as e:
+            logging.info(u'Skip the contents of {} in archive: {}'.format(dir_path, e))
+            continue
+
+        sub_dirs = []
+        for entry in entries:
+            if is_session_file(entry.name):
+                continue
+
+            entry_arcname = arcname + '/' + entry.name
+            try:
+                entry_stat = entry.stat()
+                is_dir = entry.is_dir(follow_symlinks=False)
+            except OSError as e:
+                logging.info(u'Skip {} in archive: {}'.format(entry.path, e))
+                continue
+
+            if is_dir:
+                sub_dirs.append((entry_arcname, entry.path, entry_stat))
+            elif stat.S_ISREG(entry_stat.st_mode):
+                yield entry_arcname, entry.path, entry_stat
+
+        pending_dirs.extend(reversed(sub_dirs))
+
+
+def get_archive_name(full_local_path, archive_format):
+    """get_archive_name
+
+    Args:
+        full_local_path (str): full local path of the folder
+        archive_format (str): one of archive_format_list
+
+    Returns:
+        str: file name of the archive
+    """
+    base_name = osp.basename(full_local_path.rstrip(os.sep)) or 'root'
+
+    return base_name + archive_extensions[archive_format]
+
+
+def iter_file_chunks(full_path, start, size):
+    """read size bytes of a file from start, padding with zeros if it's shorter
+
+    Args:
+        full_path (str): full local path of the file
+        start (int): first byte
+        size (int): number of bytes
+
+    Yields:
+        bytes: chunks of at most ARCHIVE_CHUNK_SIZE bytes
+    """
+    try:
+        fp = open(full_path, 'rb')
+    except OSError as e:
+        logging.warning(u'Cannot read {} for archive, zero-filled: {}'.format(full_path, e))
+        fp = None
+
+    try:
+        if fp is not None:
+            fp.seek(start)
+        while size > 0:
+            chunk = b''
+            if fp is not None:
+                chunk = fp.read(min(size, ARCHIVE_CHUNK_SIZE))
+            if not chunk:
+                chunk = bytes(min(size, ARCHIVE_CHUNK_SIZE))
+            size -= len(chunk)
+            yield chunk
+    finally:
+        if fp is not None:
+            fp.close()
+
+
+class _ChunkSink(object):
+    """Write-only, unseekable file object collecting what ZipFile writes
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def iter_zip(full_local_path, base_name, deflate=False):
+    """generate a zip archive of a folder tree
+
+    Args:
+        full_local_path (str): full local path of the folder
+        base_name (str): name of the folder in the archive
+        deflate (bool, optional): deflate the files, or store them. Defaults to False.
+
+    Yields:
+        bytes: chunks of the archive
+    """
+    compress_type = zipfile.ZIP_DEFLATED if deflate else zipfile.ZIP_STORED
+    sink = _ChunkSink()
+
+    # ZipFile falls back to data descriptors as the sink can't seek
+    with zipfile.ZipFile(sink, 'w', compress_type, allowZip64=True) as zf:
+        for arcname, full_path, st in walk_tree(full_local_path, base_name):
+            date_time = max(time.localtime(st.st_mtime)[:6], MIN_ZIP_DATE_TIME)
+            is_dir = stat.S_ISDIR(st.st_mode)
+
+            zinfo = zipfile.ZipInfo(arcname + '/' if is_dir else arcname, date_time)
+            zinfo.external_attr = (st.st_mode & 0xFFFF) << 16
+
+            if is_dir:
+                zinfo.external_attr |= 0x10  # MS-DOS directory flag
+                zf.writestr(zinfo, b'')
+            else:
+                zinfo.compress_type = compress_type
+                # ZipFile decides on ZIP64 from the expected size
+                zinfo.file_size = st.st_size
+                with zf.open(zinfo, 'w') as dst:
+                    for chunk in iter_file_chunks(full_path, 0, st.st_size):
+                        dst.write(chunk)
+                        data = sink.pop()
+                        if data:
+                            yield data
+
+            data = sink.pop()
+            if data:
+                yield data
+
+    # central directory
+    data = sink.pop()
+    if data:
+        yield data
+
+
+class TarArchive(object):
+    """Layout of a tar archive of a folder tree, see build_tar_archive()
+    """
+
+    def __init__(self, members, data_end):
+        """__init__
+
+        Args:
+            members (list): (offset, header_size, full_path, tarinfo) of the members
+            data_end (int): end of the last member, where the end-of-archive blocks start
+        """
+        self.members = members
+        self._offsets = [member[0] for member in members]
+        self.data_end = data_end
+
+        # two zero blocks, padded to a whole record, as tarfile does
+        size = data_end + 2 * tarfile.BLOCKSIZE
+        self.size = size + (-size % tarfile.RECORDSIZE)
+
+        sha1 = hashlib.sha1()
+        for _, _, _, tarinfo in members:
+            sha1.update(self.get_header(tarinfo))
+        self.etag = u'"tar-{}"'.format(sha1.hexdigest())
+
+    @staticmethod
+    def get_header(tarinfo):
+        return tarinfo.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape')
+
+    def iter_range(self, start=0, end=None):
+        """generate a byte range of the archive
+
+        Args:
+            start (int, optional): first byte. Defaults to 0.
+            end (int, optional): last byte (excluded), None for the end of the archive.
+                Defaults to None.
+
+        Yields:
+            bytes: chunks of the archive
+        """
+        if end is None or end > self.size:
+            end = self.size
+
+        idx = max(bisect.bisect_right(self._offsets, start) - 1, 0)
+        for offset, header_size, full_path, tarinfo in self.members[idx:]:
+            if offset >= end:
+                return
+
+            data_start = offset + header_size
+            data_end = data_start + tarinfo.size
+            member_end = data_end + (-tarinfo.size % tarfile.BLOCKSIZE)
+            if member_end <= start:
+                continue
+
+            if start < data_start:
+                header = self.get_header(tarinfo)
+                yield header[start - offset:min(end, data_start) - offset]
+                start = data_start
+
+            if start < data_end and start < end:
+                size = min(end, data_end) - start
+                for chunk in iter_file_chunks(full_path, start - data_start, size):
+                    yield chunk
+                start += size
+
+            if start < member_end and start < end:
+                yield bytes(min(end, member_end) - start)
+                start = min(end, member_end)
+
+        while start < end:
+            size = min(end - start, ARCHIVE_CHUNK_SIZE)
+            yield bytes(size)
+            start += size
+
+
+def build_tar_archive(full_local_path, base_name):
+    """stat a folder tree and lay out its tar archive, blocking
+
+    Args:
+        full_local_path (str): full local path of the folder
+        base_name (str): name of the folder in the archive
+
+    Returns:
+        TarArchive: the archive layout
+    """
+    members = []
+    offset = 0
+
+    for arcname, full_path, st in walk_tree(full_local_path, base_name):
+        tarinfo = tarfile.TarInfo(arcname)
+        tarinfo.mode = st.st_mode & 0o7777
+        tarinfo.uid = st.st_uid
+        tarinfo.gid = st.st_gid
+        # a float mtime would add a pax record
+        tarinfo.mtime = int(st.st_mtime)
+
+        if stat.S_ISDIR(st.st_mode):
+            tarinfo.type = tarfile.DIRTYPE
+        else:
+            tarinfo.type = tarfile.REGTYPE
+            tarinfo.size = st.st_size
+
+        header_size = len(TarArchive.get_header(tarinfo))
+        members.append((offset, header_size, full_path, tarinfo))
+        offset += header_size + tarinfo.size + (-tarinfo.size % tarfile.BLOCKSIZE)
+
+    return TarArchive(members, offset)
@@ -0,0 +1,590 @@
+# -*- coding: utf-8 -*-
+"""
+resumable, parallel chunked uploads
+
+Protocol, on the url of the target folder:
+    POST   /folder/?upload=create               body: {"filename": ..., "size": ..., "chunk_size": ...}
+    PUT    /folder/?upload_id=ID&chunk=N        body: bytes of chunk N
+    GET    /folder/?upload_id=ID                status, incl. the list of received chunks
+    POST   /folder/?upload_id=ID&action=finalize
+    DELETE /folder/?upload_id=ID                abort
+
+The file is preallocated as a hidden ".tfs-upload-ID.part" file in the target
+folder, and every chunk is written in place with pwrite() at its offset, so
+chunks can arrive in any order and in parallel, and nothing is copied when
+the upload is finalized (the part file is just renamed). The session state is
+kept next to it in ".tfs-upload-ID.json", so an upload can be resumed after
+a disconnect or a server restart.
+
+Every received chunk is recorded as an empty marker file in the
+".tfs-upload-ID.chunks" folder rather than in the state file, and the list of
+received chunks is always read back from the disk: with --workers, chunks of
+one upload are received by different processes, which only share the files.
+
+The ".tfs-upload-*" files are not shown in listings, search results, folder
+sizes and archives. Sessions which received no chunk for max_age seconds are
+abandoned and removed: the ones known to a server process periodically, the
+others when they are looked up, or when a new upload starts in their folder.
+
+All methods doing file I/O are blocking and meant to be run in the io
+thread pool.
+
+author: zhaoyafei0210@gmail.com
+github: https://github.com/walkoncross/tornado-file-server
+"""
+
+import json
+import logging
+import os
+import os.path as osp
+import re
+import threading
+import time
+import uuid
+
+import tornado.ioloop
+
+from .io_executor import run_in_io_executor
+from .uploads import move_to_unique_filename
+
+
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+MIN_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 256 * 1024 * 1024
+DEFAULT_MAX_AGE = 24 * 3600
+EXPIRE_INTERVAL = 3600
+
+SESSION_FILE_PREFIX = '.tfs-upload-'
+
+_upload_id_re = re.compile(r'^[0-9a-f]{32}$')
+_state_file_re = re.compile(r'^\.tfs-upload-([0-9a-f]{32})\.json$')
+
+
+class ChunkedUploadError(ValueError):
+    """Invalid chunked upload request
+    """
+    pass
+
+
+def is_session_file(name):
+    """is_session_file
+
+    Args:
+        name (str): file name
+
+    Returns:
+        bool: whether it is a part, state or chunks file of a chunked upload
+    """
+    return name.startswith(SESSION_FILE_PREFIX)
+
+
+def pwrite_all(fd, data, offset):
+    """write all of data at offset, without moving the file position
+
+    Args:
+        fd (int): file descriptor
+        data (bytes): data to write
+        offset (int): file offset
+    """
+    view = memoryview(data)
+    while view:
+        if hasattr(os, 'pwrite'):
+            n = os.pwrite(fd, view, offset)
+        else:
+            # each chunk request has its own fd, so seek + write is safe here
+            os.lseek(fd, offset, os.SEEK_SET)
+            n = os.write(fd, view)
+        view = view[n:]
+        offset += n
+
+
+class ChunkedUpload(object):
+    """State of one chunked upload session
+    """
+
+    def __init__(self, upload_id, save_dir, filename, size, chunk_size, created=None):
+        """__init__
+
+        Args:
+            upload_id (str): session id, 32 hex digits
+            save_dir (str): local folder to save into
+            filename (str): file name sent by the client
+            size (int): total file size in bytes
+            chunk_size (int): size of every chunk except the last one
+            created (float, optional): creation time. Defaults to None (now).
+        """
+        self.upload_id = upload_id
+        self.save_dir = save_dir
+        self.filename = osp.basename(filename)
+        self.size = size
+        self.chunk_size = chunk_size
+        self.created = created or time.time()
+        self.save_filename = None
+
+        self._lock = threading.Lock()
+
+    @property
+    def num_chunks(self):
+        return max(1, (self.size + self.chunk_size - 1) // self.chunk_size)
+
+    @property
+    def part_path(self):
+        return osp.join(self.save_dir, '.tfs-upload-{}.part'.format(self.upload_id))
+
+    @property
+    def state_path(self):
+        return osp.join(self.save_dir, '.tfs-upload-{}.json'.format(self.upload_id))
+
+    @property
+    def chunks_path(self):
+        return osp.join(self.save_dir, '.tfs-upload-{}.chunks'.format(self.upload_id))
+
+    @property
+    def received(self):
+        """indices of the received chunks, read from the marker files
+
+        Returns:
+            set: chunk indices
+        """
+        try:
+            names = os.listdir(self.chunks_path)
+        except OSError:
+            return set()
+
+        return set(int(name) for name in names if name.isdigit())
+
+    def get_last_activity(self):
+        """get_last_activity
+
+        Returns:
+            float: time the session was created or received its last chunk
+        """
+        try:
+            # a marker file is created in it for every chunk
+            return max(self.created, os.stat(self.chunks_path).st_mtime)
+        except OSError:
+            return self.created
+
+    def is_abandoned(self, max_age, now=None):
+        """is_abandoned
+
+        Args:
+            max_age (float): seconds without any chunk
+            now (float, optional): current time. Defaults to None (time.time()).
+
+        Returns:
+            bool: whether the session received no chunk for max_age seconds
+        """
+        return (now or time.time()) - self.get_last_activity() > max_age
+
+    @classmethod
+    def create(cls, save_dir, filename, size, chunk_size=DEFAULT_CHUNK_SIZE):
+        """create a session and preallocate its part file
+
+        Args:
+            save_dir (str): local folder to save into
+            filename (str): file name sent by the client
+            size (int): total file size in bytes
+            chunk_size (int, optional): chunk size in bytes. Defaults to DEFAULT_CHUNK_SIZE.
+
+        Raises:
+            ChunkedUploadError: if the arguments are invalid
+            OSError: if the files of the session can't be created, nothing is
+                left behind then
+
+        Returns:
+            ChunkedUpload: new session
+        """
+        if not filename or not osp.basename(filename):
+            raise ChunkedUploadError(u'No file name')
+        if size < 0:
+            raise ChunkedUploadError(u'Invalid size: {}'.format(size))
+        if not MIN_CHUNK_SIZE <= chunk_size <= MAX_CHUNK_SIZE:
+            raise ChunkedUploadError(u'chunk_size must be in [{}, {}]'.format(
+                MIN_CHUNK_SIZE, MAX_CHUNK_SIZE))
+
+        upload = cls(uuid.uuid4().hex, save_dir, filename, size, chunk_size)
+
+        try:
+            os.mkdir(upload.chunks_path)
+            fd = os.open(upload.part_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+            try:
+                # sparse file on most filesystems, chunks fill it in place
+                os.ftruncate(fd, size)
+            finally:
+                os.close(fd)
+
+            upload.save_state()
+        except OSError:
+            # e.g. no space left for the part file
+            upload.abort()
+            raise
+
+        return upload
+
+    @classmethod
+    def load(cls, save_dir, upload_id):
+        """load a session from its state file
+
+        Args:
+            save_dir (str): local folder of the upload
+            upload_id (str): session id
+
+        Returns:
+            ChunkedUpload: the session, None if there is no such session
+        """
+        if not _upload_id_re.match(upload_id):
+            return None
+
+        state_path = osp.join(save_dir, '.tfs-upload-{}.json'.format(upload_id))
+        try:
+            with open(state_path, 'r') as fp:
+                state = json.load(fp)
+        except (OSError, ValueError):
+            return None
+
+        return cls(upload_id, save_dir, state['filename'], state['size'],
+                   state['chunk_size'], state['created'])
+
+    def exists(self):
+        """exists
+
+        Returns:
+            bool: False once finalized or aborted, by any process
+        """
+        return osp.exists(self.state_path)
+
+    def save_state(self):
+        """write the state file atomically, once when the session is created
+        """
+        state = {
+            'filename': self.filename,
+            'size': self.size,
+            'chunk_size': self.chunk_size,
+            'created': self.created,
+        }
+
+        temp_path = '{}.{}.tmp'.format(self.state_path, uuid.uuid4().hex[:8])
+        try:
+            with open(temp_path, 'w') as fp:
+                json.dump(state, fp)
+            os.replace(temp_path, self.state_path)
+        except OSError:
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+            raise
+
+    def get_chunk_range(self, index):
+        """get_chunk_range
+
+        Args:
+            index (int): chunk index
+
+        Returns:
+            tuple: (offset, length) of the chunk
+        """
+        if not 0 <= index < self.num_chunks:
+            raise ChunkedUploadError(u'Invalid chunk index: {}'.format(index))
+
+        offset = index * self.chunk_size
+        return offset, min(self.chunk_size, self.size - offset)
+
+    def mark_received(self, index):
+        """create the marker file of a chunk
+
+        Args:
+            index (int): index of a chunk which is completely written
+        """
+        try:
+            fd = os.open(osp.join(self.chunks_path, str(index)), os.O_WRONLY | os.O_CREAT, 0o666)
+        except FileNotFoundError:
+            raise ChunkedUploadError(u'Upload {} was finalized or aborted'.format(self.upload_id))
+        os.close(fd)
+
+    def get_missing_chunks(self):
+        """get_missing_chunks
+
+        Returns:
+            list: indices of chunks not received yet
+        """
+        received = self.received
+
+        return [ii for ii in range(self.num_chunks) if ii not in received]
+
+    def finalize(self):
+        """rename the part file to its final name once all chunks are received
+
+        Returns:
+            str: full local path the file is saved into
+        """
+        with self._lock:
+            missing = self.get_missing_chunks()
+            if missing:
+                raise ChunkedUploadError(
+                    u'{} chunks are missing, e.g. {}'.format(len(missing), missing[:10]))
+
+            # only one process finalizes it: the one which takes the state file
+            claimed_path = '{}.{}.done'.format(self.state_path, uuid.uuid4().hex[:8])
+            try:
+                os.rename(self.state_path, claimed_path)
+            except FileNotFoundError:
+                raise ChunkedUploadError(
+                    u'Upload {} was finalized or aborted'.format(self.upload_id))
+
+            try:
+                self.save_filename = move_to_unique_filename(
+                    self.part_path, self.save_dir, self.filename)
+            except OSError:
+                os.rename(claimed_path, self.state_path)
+                raise
+
+            os.unlink(claimed_path)
+            self._remove_chunk_markers()
+
+            return self.save_filename
+
+    def abort(self):
+        """remove the part and state files
+        """
+        with self._lock:
+            for path in (self.part_path, self.state_path):
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+            self._remove_chunk_markers()
+
+    def _remove_chunk_markers(self):
+        try:
+            names = os.listdir(self.chunks_path)
+        except OSError:
+            return
+
+        for name in names:
+            try:
+                os.unlink(osp.join(self.chunks_path, name))
+            except OSError:
+                pass
+        try:
+            os.rmdir(self.chunks_path)
+        except OSError:
+            pass
+
+    def to_dict(self):
+        """to_dict
+
+        Returns:
+            dict: session status for the client
+        """
+        return {
+            'upload_id': self.upload_id,
+            'filename': self.filename,
+            'size': self.size,
+            'chunk_size': self.chunk_size,
+            'num_chunks': self.num_chunks,
+            'received': sorted(self.received),
+        }
+
+
+class ChunkWriter(object):
+    """Write the body of one chunk request at its offset in the part file,
+    same interface as UploadFileWriter
+    """
+
+    def __init__(self, upload, index):
+        """__init__
+
+        Args:
+            upload (ChunkedUpload): the upload session
+            index (int): chunk index
+        """
+        self.upload = upload
+        self.index = index
+        self.offset, self.length = upload.get_chunk_range(index)
+        self.bytes_written = 0
+        self._fd = None
+
+    def open(self):
+        self._fd = os.open(self.upload.part_path, os.O_WRONLY)
+
+    def write(self, data):
+        if self.bytes_written + len(data) > self.length:
+            raise ChunkedUploadError(u'Chunk {} is larger than {} bytes'.format(
+                self.index, self.length))
+
+        pwrite_all(self._fd, data, self.offset + self.bytes_written)
+        self.bytes_written += len(data)
+
+    def commit(self):
+        self._close()
+
+        if self.bytes_written != self.length:
+            raise ChunkedUploadError(u'Chunk {}: got {} bytes, expected {}'.format(
+                self.index, self.bytes_written, self.length))
+
+        self.upload.mark_received(self.index)
+
+    def abort(self):
+        self._close()
+
+    def _close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class ChunkedUploadStore(object):
+    """In-memory index of the active chunked uploads, backed by their state files
+
+    Only the immutable description of a session is cached, whether it still
+    exists and which chunks were received are checked on the files, which
+    other server processes may change.
+    """
+
+    def __init__(self, max_age=DEFAULT_MAX_AGE):
+        """__init__
+
+        Args:
+            max_age (float, optional): seconds without any chunk after which a
+                session is abandoned and removed. Defaults to DEFAULT_MAX_AGE.
+        """
+        self.max_age = max_age
+
+        self._lock = threading.Lock()
+        self._uploads = {}
+        # save_dir -> time of the last expire_dir()
+        self._expired_dirs = {}
+        self._periodic_callback = None
+
+    def configure(self, max_age=None):
+        """configure
+
+        Args:
+            max_age (float, optional): new max age of abandoned sessions in seconds
+        """
+        if max_age is not None:
+            self.max_age = max_age
+
+    def start(self):
+        """remove the abandoned sessions known to this process every
+        EXPIRE_INTERVAL seconds, on the IOLoop of the current thread
+        """
+        self._periodic_callback = tornado.ioloop.PeriodicCallback(
+            self._expire, EXPIRE_INTERVAL * 1000)
+        self._periodic_callback.start()
+
+    async def _expire(self):
+        await run_in_io_executor(self.expire)
+
+    def create(self, save_dir, filename, size, chunk_size=DEFAULT_CHUNK_SIZE):
+        """create a new upload session, see ChunkedUpload.create()
+
+        Returns:
+            ChunkedUpload: new session
+        """
+        # the sessions of previous server processes in this folder are
+        # only known from their files
+        self.expire_dir(save_dir)
+
+        upload = ChunkedUpload.create(save_dir, filename, size, chunk_size)
+
+        with self._lock:
+            self._uploads[upload.upload_id] = upload
+
+        return upload
+
+    def get(self, save_dir, upload_id):
+        """get an upload session, loading it from its state file if needed
+
+        Args:
+            save_dir (str): local folder of the upload
+            upload_id (str): session id
+
+        Returns:
+            ChunkedUpload: the session, None if there is no such session in save_dir
+        """
+        with self._lock:
+            upload = self._uploads.get(upload_id)
+
+        if upload is not None:
+            if upload.save_dir != save_dir:
+                return None
+            if upload.exists():
+                return upload
+
+            # finalized or aborted by another process
+            self.remove(upload_id)
+            return None
+
+        upload = ChunkedUpload.load(save_dir, upload_id)
+        if upload is not None:
+            if upload.is_abandoned(self.max_age):
+                self._remove_abandoned(upload)
+                return None
+
+            with self._lock:
+                upload = self._uploads.setdefault(upload_id, upload)
+
+        return upload
+
+    def remove(self, upload_id):
+        """forget a finalized or aborted session
+
+        Args:
+            upload_id (str): session id
+        """
+        with self._lock:
+            self._uploads.pop(upload_id, None)
+
+    def expire(self):
+        """remove the abandoned sessions known to this process, blocking
+        """
+        with self._lock:
+            uploads = list(self._uploads.values())
+
+        now = time.time()
+        with self._lock:
+            for save_dir, expired_at in list(self._expired_dirs.items()):
+                if now - expired_at >= EXPIRE_INTERVAL:
+                    del self._expired_dirs[save_dir]
+
+        for upload in uploads:
+            if not upload.exists():
+                self.remove(upload.upload_id)
+            elif upload.is_abandoned(self.max_age, now):
+                self._remove_abandoned(upload)
+
+    def expire_dir(self, save_dir):
+        """remove the abandoned sessions of a folder, blocking. The folder is
+        scanned at most once every EXPIRE_INTERVAL seconds.
+
+        Args:
+            save_dir (str): local folder of the uploads
+        """
+        now = time.time()
+        with self._lock:
+            if now - self._expired_dirs.get(save_dir, 0) < EXPIRE_INTERVAL:
+                return
+            self._expired_dirs[save_dir] = now
+
+        try:
+            with os.scandir(save_dir) as it:
+                upload_ids = [match.group(1) for match in
+                              (_state_file_re.match(entry.name) for entry in it) if match]
+        except OSError:
+            return
+
+        for upload_id in upload_ids:
+            upload = ChunkedUpload.load(save_dir, upload_id)
+            if upload is not None and upload.is_abandoned(self.max_age, now):
+                self._remove_abandoned(upload)
+
+    def _remove_abandoned(self, upload):
+        upload.abort()
+        self.remove(upload.upload_id)
+        logging.info(u'Chunked upload {} abandoned, removed'.format(upload.upload_id))
+
+
+chunked_upload_store = ChunkedUploadStore()
@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+"""
+gzip/brotli compression of folder pages and text files
+
+The encoding is negotiated from the Accept-Encoding header: brotli when the
+brotli module is installed and the client accepts it, gzip otherwise.
+Compressed variants of files are kept in an LRU cache bounded by total
+size and keyed on (path, inode, size, mtime, encoding), so a hot text file
+is compressed once, and a changed file is compressed again.
+
+All compression functions are blocking and meant to be run in the io
+thread pool.
+
+author: zhaoyafei0210@gmail.com
+github: https://github.com/walkoncross/tornado-file-server
+"""
+
+import gzip
+import os
+import stat
+import threading
+from collections import OrderedDict
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+ENCODING_BROTLI = 'br'
+ENCODING_GZIP = 'gzip'
+
+# file extension of precompressed sidecar files, e.g. "data.csv.gz"
+sidecar_extensions = {
+    ENCODING_BROTLI: '.br',
+    ENCODING_GZIP: '.gz',
+}
+
+# levels for pages rendered per request, and for cached file variants
+DYNAMIC_GZIP_LEVEL = 6
+DYNAMIC_BROTLI_QUALITY = 5
+CACHED_GZIP_LEVEL = 9
+CACHED_BROTLI_QUALITY = 9
+
+MIN_COMPRESS_SIZE = 1024
+
+compressible_mime_types = set([
+    'application/json',
+    'application/javascript',
+    'application/x-javascript',
+    'application/xml',
+    'application/x-yaml',
+    'application/yaml',
+    'application/x-sh',
+    'application/x-python',
+    'application/sql',
+    'application/csv',
+    'application/x-ndjson',
+    'image/svg+xml',
+])
+
+
+def get_supported_encodings():
+    """get_supported_encodings
+
+    Returns:
+        list: supported content encodings, by order of preference
+    """
+    if brotli is not None:
+        return [ENCODING_BROTLI, ENCODING_GZIP]
+
+    return [ENCODING_GZIP]
+
+
+def choose_encoding(accept_encoding):
+    """choose a content encoding from an Accept-Encoding header
+
+    Args:
+        accept_encoding (str): Accept-Encoding header, may be None
+
+    Returns:
+        str: ENCODING_BROTLI, ENCODING_GZIP or None for no compression
+    """
+    if not accept_encoding:
+        return None
+
+    accepted = {}
+    for coding in accept_encoding.split(','):
+        parts = coding.strip().split(';')
+        name = parts[0].strip().lower()
+        qvalue = 1.0
+        for param in parts[1:]:
+            key, _, value = param.strip().partition('=')
+            if key.strip() == 'q':
+                try:
+                    qvalue = float(value)
+                except ValueError:
+                    qvalue = 0.0
+        accepted[name] = qvalue
+
+    for encoding in get_supported_encodings():
+        if accepted.get(encoding, accepted.get('*', 0.0)) > 0:
+            return encoding
+
+    return None
+
+
+def is_compressible(content_type, size=None):
+    """is_compressible
+
+    Args:
+        content_type (str): mime type, parameters like charset are ignored
+        size (int, optional): content size. Defaults to None.
+
+    Returns:
+        bool: whether compressing such content is worth it
+    """
+    if size is not None and size < MIN_COMPRESS_SIZE:
+        return False
+
+    if not content_type:
+        return False
+
+    mime_type = content_type.split(';')[0].strip().lower()
+
+    return (mime_type.startswith('text/') or
+            mime_type in compressible_mime_types or
+            mime_type.endswith('+json') or
+            mime_type.endswith('+xml'))
+
+
+def compress(data, encoding, cached=False):
+    """compress
+
+    Args:
+        data (bytes): data to compress
+        encoding (str): ENCODING_BROTLI or ENCODING_GZIP
+        cached (bool, optional): whether the result is cached, which is worth
+            a slower, better compression. Defaults to False.
+
+    Returns:
+        bytes: compressed data
+    """
+    if encoding == ENCODING_BROTLI:
+        quality = CACHED_BROTLI_QUALITY if cached else DYNAMIC_BROTLI_QUALITY
+        return brotli.compress(data, quality=quality)
+
+    if encoding == ENCODING_GZIP:
+        level = CACHED_GZIP_LEVEL if cached else DYNAMIC_GZIP_LEVEL
+        return gzip.compress(data, compresslevel=level, mtime=0)
+
+    raise ValueError(u'Unsupported content encoding: {}'.format(encoding))
+
+
+def stat_sidecar(full_local_path, st, encoding):
+    """stat the precompressed sidecar file of a file, blocking
+
+    Args:
+        full_local_path (str): full local path of the file
+        st (os.stat_result): stat of the file
+        encoding (str): ENCODING_BROTLI or ENCODING_GZIP
+
+    Returns:
+        os.stat_result: stat of the sidecar file, None if there is no sidecar
+            file or it is older than the file
+    """
+    try:
+        sidecar_stat = os.stat(full_local_path + sidecar_extensions[encoding])
+    except OSError:
+        return None
+
+    if not stat.S_ISREG(sidecar_stat.st_mode) or sidecar_stat.st_mtime_ns < st.st_mtime_ns:
+        return None
+
+    return sidecar_stat
+
+
+class CompressedContentCache(object):
+    """LRU cache of compressed file contents, bounded by total size
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, max_file_size=8 * 1024 * 1024):
+        """__init__
+
+        Args:
+            max_bytes (int, optional): max total size of the cached variants.
+                Defaults to 64MB.
+            max_file_size (int, optional): files larger than this are not compressed.
+                Defaults to 8MB.
+        """
+        self._lock = threading.Lock()
+        self._variants = OrderedDict()
+        self._nbytes = 0
+
+        self.max_bytes = max_bytes
+        self.max_file_size = max_file_size
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def configure(self, max_bytes=None, max_file_size=None):
+        """configure
+
+        Args:
+            max_bytes (int, optional): see __init__. Defaults to None (unchanged).
+            max_file_size (int, optional): see __init__. Defaults to None (unchanged).
+        """
+        with self._lock:
+            if max_bytes is not None:
+                self.max_bytes = max_bytes
+            if max_file_size is not None:
+                self.max_file_size = max_file_size
+            self._evict()
+
+    def get_compressed(self, full_local_path, st, encoding):
+        """get the compressed content of a file, compressing it on a miss, blocking
+
+        Args:
+            full_local_path (str): full local path of the file
+            st (os.stat_result): stat of the file
+            encoding (str): ENCODING_BROTLI or ENCODING_GZIP
+
+        Returns:
+            bytes: compressed content, None if the file is too large to be compressed
+        """
+        if st.st_size > self.max_file_size:
+            return None
+
+        key = (full_local_path, st.st_ino, st.st_size, st.st_mtime_ns, encoding)
+
+        with self._lock:
+            data = self._variants.get(key)
+            if data is not None:
+                self._variants.move_to_end(key)
+                self.hits += 1
+                return data
+            self.misses += 1
+
+        with open(full_local_path, 'rb') as fp:
+            content = fp.read(st.st_size + 1)
+
+        if len(content) != st.st_size:
+            # the file changed since it was stat'ed, don't cache under a stale key
+            return compress(content, encoding)
+
+        data = compress(content, encoding, cached=True)
+
+        with self._lock:
+            if key not in self._variants and len(data) <= self.max_bytes:
+                self._variants[key] = data
+                self._nbytes += len(data)
+                self._evict()
+
+        return data
+
+    def clear(self):
+        with self._lock:
+            self._variants.clear()
+            self._nbytes = 0
+
+    def stats(self):
+        """stats
+
+        Returns:
+            dict: cache statistics
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._variants),
+                'bytes': self._nbytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': float(self.hits) / lookups if lookups else 0.0,
+            }
+
+    def _evict(self):
+        while self._variants and self._nbytes > self.max_bytes:
+            _, data = self._variants.popitem(last=False)
+            self._nbytes -= len(data)
+            self.evictions += 1
+
+
+compressed_content_cache = CompressedContentCache()
@@ -0,0 +1,691 @@
+# -*- coding: utf-8 -*-
+"""
+process-wide cache of directory listings
+
+Tornado creates a new RequestHandler for every request, so anything cached on
+a FolderHandler instance is lost as soon as the request finishes. Listings are
+kept here instead, keyed by the resolved local path of the directory and
+validated against the directory's (st_ino, st_mtime_ns).
+
+When a filesystem watcher is set (see fs_watcher.py), listings of watched
+folders are invalidated by the watcher instead, and served without any stat().
+The folder's stat does not change when a file is rewritten in place, so the
+type/size/mtime of the items of unwatched folders are stat-ed again when they
+are older than item_max_age.
+
+Items are scanned in name order. The other sort orders (see dir_scanner.sort_list)
+are computed on the first request for them, which stats all the items of a
+lazy listing, and then kept with the listing, i.e. once per generation.
+Descending orders are read backwards from the ascending ones.
+
+author: zhaoyafei0210@gmail.com
+github: https://github.com/walkoncross/tornado-file-server
+"""
+
+import bisect
+import hashlib
+import os
+import os.path as osp
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from .dir_scanner import (
+    DirItem, stat_dir_item, stat_dir_items, get_name_sort_key, get_item_sort_key,
+    SORT_NAME, SORT_DESC
+)
+from .fs_watcher import CHANGE_ENTRY, CHANGE_DIR, CHANGE_TREE, CHANGE_ALL
+from .metrics import timed_stat
+
+
+DEFAULT_MAX_ENTRIES = 256
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_ITEM_MAX_AGE = 2.0
+
+
+class DirListing(object):
+    """Snapshot of the contents of one directory
+    """
+
+    def __init__(self, local_path, dir_stat, items):
+        """__init__
+
+        Args:
+            local_path (str): full local path of the directory
+            dir_stat (os.stat_result): stat of the directory at scan time
+            items (list): sorted list of DirItem
+        """
+        self.local_path = local_path
+        self.ino = dir_stat.st_ino
+        self.mtime_ns = dir_stat.st_mtime_ns
+        self.items = items
+        self.sub_folder_cnt = sum(1 for item in items if item.is_dir)
+        self.nbytes = self.estimate_nbytes()
+
+        # unique id of this snapshot, a rescan makes a new generation. Random,
+        # so that ids of different server processes never collide.
+        self.generation = uuid.uuid4().hex[:16]
+
+        self._name_index = None
+        self._sort_keys = None
+        self._names_digest = None
+        # sort -> (items in ascending order, their sort keys), see get_order()
+        self._sorted_items = {}
+        self._sort_lock = threading.Lock()
+
+        # seconds before the stat of an item is checked again, None when a
+        # watcher reports the changes of the folder, set by DirListingCache.put()
+        self.item_max_age = None
+
+    def __len__(self):
+        return len(self.items)
+
+    def estimate_nbytes(self):
+        """estimate_nbytes
+
+        Returns:
+            int: approximate memory footprint of this listing in bytes
+        """
+        nbytes = sys.getsizeof(self.items)
+        for item in self.items:
+            nbytes += item.nbytes()
+
+        return nbytes
+
+    def stat_items(self, start_idx, end_idx):
+        """make sure items[start_idx:end_idx] have an up to date type/size/mtime
+
+        Args:
+            start_idx (int): first item index
+            end_idx (int): last item index (excluded)
+
+        Returns:
+            list: the stat-ed items, render these: the ones in the listing can be
+                replaced by other threads in the meantime, see replace_item()
+        """
+        items = self.items[start_idx:end_idx]
+        stat_dir_items(self.local_path, items)
+
+        return self.revalidate_items(items)
+
+    def revalidate_items(self, items):
+        """stat again the stat-ed items older than item_max_age, and swap in
+        new items for the ones which changed
+
+        Args:
+            items (list): stat-ed items of this listing
+
+        Returns:
+            list: items, with the changed ones replaced
+        """
+        max_age = self.item_max_age
+        if max_age is None:
+            return items
+
+        now = time.monotonic()
+        stale = [ii for ii, item in enumerate(items) if now - item.stat_time > max_age]
+        if not stale:
+            return items
+
+        items = list(items)
+        for ii in stale:
+            item = items[ii]
+            new_item = DirItem(item.name, item.is_dir, item.is_file)
+            stat_dir_item(self.local_path, new_item, now)
+            if new_item.has_same_stat(item):
+                item.stat_time = now
+            else:
+                self.replace_item(item.name, new_item)
+                items[ii] = new_item
+
+        return items
+
+    def replace_item(self, name, new_item=None):
+        """swap in a new item for an entry whose metadata changed. Items are
+        never modified in place, so that threads rendering them are not
+        affected: they keep the old one.
+
+        Args:
+            name (str): entry name
+            new_item (DirItem, optional): stat-ed item. Defaults to None, a new
+                item which is stat-ed again when it is shown.
+
+        Returns:
+            bool: False if there is no such entry
+        """
+        with self._sort_lock:
+            keys = self.get_name_sort_keys()
+            idx = bisect.bisect_left(keys, get_name_sort_key(name))
+            if idx == len(keys) or self.items[idx].name != name:
+                return False
+
+            if new_item is None:
+                item = self.items[idx]
+                new_item = DirItem(name, item.is_dir, item.is_file)
+
+            self.items[idx] = new_item
+            if self._name_index is not None:
+                self._name_index[name] = new_item
+            # sizes/mtimes changed, sort again on the next request
+            self._sorted_items = {}
+
+        return True
+
+    def get_stat_entries(self):
+        """get_stat_entries
+
+        Returns:
+            list: the stat-ed items, see PollingWatcher
+        """
+        return [item for item in self.items if item.is_stat_done]
+
+    def find_item(self, name):
+        """find_item
+
+        Args:
+            name (str): entry name
+
+        Returns:
+            DirItem: the item, None if there is no such entry
+        """
+        if self._name_index is None:
+            self._name_index = dict((item.name, item) for item in self.items)
+
+        return self._name_index.get(name)
+
+    def find_position_after(self, name):
+        """find where a listing which ended with `name` continues in this one
+
+        Args:
+            name (str): entry name, which may not be in this listing
+
+        Returns:
+            int: index of the first item sorted after name
+        """
+        return bisect.bisect_right(self.get_name_sort_keys(), get_name_sort_key(name))
+
+    def get_name_sort_keys(self):
+        """get_name_sort_keys
+
+        Returns:
+            list: get_name_sort_key() of the items, in listing order
+        """
+        if self._sort_keys is None:
+            self._sort_keys = [get_name_sort_key(item.name) for item in self.items]
+
+        return self._sort_keys
+
+    def get_names_digest(self):
+        """get_names_digest
+
+        Returns:
+            bytes: sha1 digest of the entry names, the same in every server process
+        """
+        if self._names_digest is None:
+            sha1 = hashlib.sha1()
+            for item in self.items:
+                sha1.update(item.name.encode('utf-8', 'surrogateescape'))
+                sha1.update(b'\0')
+            self._names_digest = sha1.digest()
+
+        return self._names_digest
+
+    def get_order(self, sort=SORT_NAME, order=None):
+        """get the items in a sort order, sorting them on the first call,
+        blocking: runs in the io thread pool
+
+        Args:
+            sort (str, optional): one of dir_scanner.sort_list. Defaults to SORT_NAME.
+            order (str, optional): one of dir_scanner.sort_order_list. Defaults to None,
+                i.e. ascending.
+
+        Returns:
+            ListingOrder: the sorted items
+        """
+        if sort == SORT_NAME:
+            return ListingOrder(self, sort, self.items, None, order == SORT_DESC)
+
+        sorted_order = self._sorted_items.get(sort)
+        if sorted_order is None:
+            # one sort per generation, even with concurrent first requests
+            with self._sort_lock:
+                sorted_order = self._sorted_items.get(sort)
+                if sorted_order is None:
+                    stat_dir_items(self.local_path, self.items)
+                    keys = [get_item_sort_key(item, sort) for item in self.items]
+                    indices = sorted(range(len(keys)), key=keys.__getitem__)
+                    sorted_order = ([self.items[ii] for ii in indices],
+                                    [keys[ii] for ii in indices])
+                    self._sorted_items[sort] = sorted_order
+
+        sorted_items, sort_keys = sorted_order
+
+        return ListingOrder(self, sort, sorted_items, sort_keys, order == SORT_DESC)
+
+    def is_valid_for(self, dir_stat):
+        """is_valid_for
+
+        Args:
+            dir_stat (os.stat_result): current stat of the directory
+
+        Returns:
+            bool: whether this listing still describes the directory
+        """
+        return (self.ino == dir_stat.st_ino and
+                self.mtime_ns == dir_stat.st_mtime_ns)
+
+
+class ListingOrder(object):
+    """The items of a DirListing in one sort order, see DirListing.get_order()
+    """
+
+    __slots__ = ('listing', 'sort', 'reverse', '_items', '_keys')
+
+    def __init__(self, listing, sort, sorted_items, sort_keys, reverse=False):
+        """__init__
+
+        Args:
+            listing (DirListing): the listing
+            sort (str): one of dir_scanner.sort_list
+            sorted_items (list): items of the listing in ascending sort order
+            sort_keys (list): dir_scanner.get_item_sort_key() of sorted_items,
+                computed once per generation, None for the name sort, whose keys
+                are only computed if needed, see DirListing.get_name_sort_keys()
+            reverse (bool, optional): descending order. Defaults to False.
+        """
+        self.listing = listing
+        self.sort = sort
+        self.reverse = reverse
+        self._items = sorted_items
+        self._keys = sort_keys
+
+    def __len__(self):
+        return len(self._items)
+
+    def __getitem__(self, idx):
+        if self.reverse:
+            return self._items[len(self._items) - 1 - idx]
+
+        return self._items[idx]
+
+    def stat_items(self, start_idx, end_idx):
+        """make sure the items from start_idx to end_idx (excluded) have an
+        up to date type/size/mtime
+
+        Args:
+            start_idx (int): first item index
+            end_idx (int): last item index (excluded)
+
+        Returns:
+            list: the stat-ed items, see DirListing.stat_items()
+        """
+        if self.sort == SORT_NAME and not self.reverse:
+            return self.listing.stat_items(start_idx, end_idx)
+
+        items = [self[ii] for ii in range(start_idx, end_idx)]
+        stat_dir_items(self.listing.local_path, items)
+
+        return self.listing.revalidate_items(items)
+
+    def find_position_after(self, sort_key):
+        """find where a listing in the same sort order which ended with an item
+        of key sort_key continues in this one
+
+        Args:
+            sort_key (tuple): dir_scanner.get_item_sort_key() of the last item
+
+        Returns:
+            int: index of the first item sorted after it
+        """
+        keys = self._keys
+        if keys is None:
+            keys = self.listing.get_name_sort_keys()
+
+        if self.reverse:
+            return len(keys) - bisect.bisect_left(keys, sort_key)
+
+        return bisect.bisect_right(keys, sort_key)
+
+
+class DirListingCache(object):
+    """LRU cache of DirListing objects, bounded by entries and bytes
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES,
+                 item_max_age=DEFAULT_ITEM_MAX_AGE):
+        """__init__
+
+        Args:
+            max_entries (int, optional): max number of cached listings.
+                Defaults to DEFAULT_MAX_ENTRIES.
+            max_bytes (int, optional): max total estimated size of cached listings.
+                Defaults to DEFAULT_MAX_BYTES.
+            item_max_age (float, optional): seconds before the stat of an item of
+                an unwatched folder is checked again. Defaults to DEFAULT_ITEM_MAX_AGE.
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.item_max_age = item_max_age
+
+        self._lock = threading.Lock()
+        self._listings = OrderedDict()
+        self._nbytes = 0
+
+        self.watcher = None
+        # local path of each folder being scanned -> [number of scans, number of
+        # watcher invalidations of the folder since], see get_or_scan()
+        self._scans = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def configure(self, max_entries=None, max_bytes=None, item_max_age=None):
+        """configure cache bounds, evicting entries if needed
+
+        Args:
+            max_entries (int, optional): new max number of cached listings
+            max_bytes (int, optional): new max total size in bytes
+            item_max_age (float, optional): new max age of item stats in seconds
+        """
+        with self._lock:
+            if item_max_age is not None:
+                self.item_max_age = item_max_age
+            if max_entries is not None:
+                self.max_entries = max_entries
+            if max_bytes is not None:
+                self.max_bytes = max_bytes
+            self._evict()
+
+    def set_watcher(self, watcher):
+        """use a filesystem watcher to invalidate listings
+
+        Args:
+            watcher (FSWatcher): watcher, None to validate listings by stat()
+        """
+        self.watcher = watcher
+        if watcher is not None:
+            watcher.add_listener(self.on_fs_change)
+            watcher.set_entry_provider(self.get_stat_entries)
+
+    def get_or_scan(self, local_path, scan_func, dir_stat=None):
+        """get the listing of a folder, scanning it on a cache miss
+
+        Args:
+            local_path (str): normalized full local path of the directory
+            scan_func (callable): scan_func(local_path, dir_stat) returns a DirListing
+            dir_stat (os.stat_result, optional): fresh stat of the directory, if the
+                caller has one. Defaults to None.
+
+        Returns:
+            DirListing: listing of the folder
+        """
+        watcher = self.watcher
+
+        if watcher is not None and watcher.is_watched(local_path):
+            with self._lock:
+                listing = self._listings.get(local_path)
+                if listing is not None:
+                    self._listings.move_to_end(local_path)
+                    self.hits += 1
+                    return listing
+
+                self.misses += 1
+
+            if dir_stat is None:
+                dir_stat = timed_stat(local_path)
+        else:
+            if dir_stat is None:
+                dir_stat = timed_stat(local_path)
+            listing = self.get(local_path, dir_stat)
+            if listing is not None:
+                return listing
+
+            # watch before scanning, so changes made during the scan are not lost
+            if watcher is not None:
+                watcher.watch(local_path)
+
+        if watcher is None:
+            listing = scan_func(local_path, dir_stat)
+            self.put(listing)
+            return listing
+
+        with self._lock:
+            scan = self._scans.setdefault(local_path, [0, 0])
+            scan[0] += 1
+            invalidations = scan[1]
+
+        try:
+            listing = scan_func(local_path, dir_stat)
+        finally:
+            with self._lock:
+                scan[0] -= 1
+                if scan[0] == 0:
+                    del self._scans[local_path]
+
+        # a watcher event about this folder came in while scanning, this
+        # listing may be stale
+        if scan[1] == invalidations:
+            self.put(listing)
+
+        return listing
+
+    def _invalidate_scans(self, local_path=None, tree=False):
+        """mark the in-flight scans of a folder as stale
+
+        Args:
+            local_path (str, optional): full local path of the folder, None for
+                all folders. Defaults to None.
+            tree (bool, optional): also the folders below it. Defaults to False.
+        """
+        prefix = local_path.rstrip(os.sep) + os.sep if tree else None
+        with self._lock:
+            for scan_path, scan in self._scans.items():
+                if (local_path is None or scan_path == local_path or
+                        (prefix is not None and scan_path.startswith(prefix))):
+                    scan[1] += 1
+
+    def lookup_path_type(self, local_path):
+        """look up the type of a path in the cached listing of its parent,
+        without any syscall. Only listings of watched folders are trusted.
+
+        Args:
+            local_path (str): normalized full local path
+
+        Returns:
+            str: 'dir', 'file', 'other' or 'missing'; None if unknown
+        """
+        watcher = self.watcher
+        if watcher is None:
+            return None
+
+        parent_path, name = osp.split(local_path)
+        if not name or not watcher.is_watched(parent_path):
+            return None
+
+        listing = self._listings.get(parent_path)
+        if listing is None:
+            return None
+
+        item = listing.find_item(name)
+        if item is None:
+            return 'missing'
+        elif item.is_dir:
+            return 'dir'
+        elif item.is_file:
+            return 'file'
+        else:
+            return 'other'
+
+    def on_fs_change(self, kind, path, name=None):
+        """watcher listener, see fs_watcher.py
+
+        Args:
+            kind (str): one of CHANGE_ENTRY, CHANGE_DIR, CHANGE_TREE, CHANGE_ALL
+            path (str): folder path
+            name (str, optional): entry name for CHANGE_ENTRY. Defaults to None.
+        """
+        if kind == CHANGE_ENTRY:
+            self._invalidate_scans(path)
+            self.reset_item(path, name)
+        elif kind == CHANGE_DIR:
+            self._invalidate_scans(path)
+            self._invalidate_scans(osp.dirname(path))
+            self.invalidate(path)
+            # the folder's own mtime is shown in the listing of its parent
+            self.reset_item(*osp.split(path))
+        elif kind == CHANGE_TREE:
+            self._invalidate_scans(path, tree=True)
+            self._invalidate_scans(osp.dirname(path))
+            self.invalidate_tree(path)
+            self.invalidate(osp.dirname(path))
+        elif kind == CHANGE_ALL:
+            self._invalidate_scans()
+            self.clear()
+
+    def reset_item(self, local_path, name):
+        """forget the cached metadata of one entry
+
+        Args:
+            local_path (str): full local path of the directory
+            name (str): entry name
+        """
+        with self._lock:
+            listing = self._listings.get(local_path)
+
+        if listing is not None:
+            listing.replace_item(name)
+
+    def get_stat_entries(self, local_path):
+        """get the stat-ed items of the cached listing of a folder, the
+        entry provider of polling watchers
+
+        Args:
+            local_path (str): full local path of the directory
+
+        Returns:
+            list: DirItem list, empty if the folder has no cached listing
+        """
+        with self._lock:
+            listing = self._listings.get(local_path)
+
+        if listing is None:
+            return []
+
+        return listing.get_stat_entries()
+
+    def get(self, local_path, dir_stat):
+        """get a cached listing if it is still valid
+
+        Args:
+            local_path (str): full local path of the directory
+            dir_stat (os.stat_result): current stat of the directory
+
+        Returns:
+            DirListing: cached listing, or None on a miss
+        """
+        with self._lock:
+            listing = self._listings.get(local_path)
+
+            if listing is not None and not listing.is_valid_for(dir_stat):
+                self._remove(local_path)
+                listing = None
+
+            if listing is None:
+                self.misses += 1
+                return None
+
+            self._listings.move_to_end(local_path)
+            self.hits += 1
+            return listing
+
+    def put(self, listing):
+        """add a listing into the cache
+
+        Args:
+            listing (DirListing): listing to cache
+        """
+        with self._lock:
+            if listing.local_path in self._listings:
+                self._remove(listing.local_path)
+
+            watcher = self.watcher
+            if watcher is None or not watcher.is_watched(listing.local_path):
+                listing.item_max_age = self.item_max_age
+
+            if listing.nbytes > self.max_bytes:
+                self._unwatch(listing.local_path)
+                return
+
+            self._listings[listing.local_path] = listing
+            self._nbytes += listing.nbytes
+            self._evict()
+
+    def invalidate(self, local_path):
+        """drop the cached listing of a directory
+
+        Args:
+            local_path (str): full local path of the directory
+        """
+        with self._lock:
+            if local_path in self._listings:
+                self._remove(local_path)
+
+    def invalidate_tree(self, local_path):
+        """drop the cached listings of a directory and all directories below it
+
+        Args:
+            local_path (str): full local path of the directory
+        """
+        prefix = local_path.rstrip(os.sep) + os.sep
+        with self._lock:
+            for path in list(self._listings):
+                if path == local_path or path.startswith(prefix):
+                    self._remove(path)
+
+    def clear(self):
+        """drop all cached listings
+        """
+        with self._lock:
+            self._listings.clear()
+            self._nbytes = 0
+
+    def stats(self):
+        """stats
+
+        Returns:
+            dict: cache counters
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._listings),
+                'bytes': self._nbytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': float(self.hits) / lookups if lookups else 0.0,
+            }
+
+    def _remove(self, local_path):
+        listing = self._listings.pop(local_path)
+        self._nbytes -= listing.nbytes
+
+    def _evict(self):
+        while self._listings and (len(self._listings) > self.max_entries or
+                                  self._nbytes > self.max_bytes):
+            _, listing = self._listings.popitem(last=False)
+            self._nbytes -= listing.nbytes
+            self.evictions += 1
+            self._unwatch(listing.local_path)
+
+    def _unwatch(self, local_path):
+        if self.watcher is not None:
+            self.watcher.unwatch(local_path)
+
+
+dir_listing_cache = DirListingCache()
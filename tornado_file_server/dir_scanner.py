@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+"""
+scan folders with os.scandir
+
+Type info comes from the DirEntry (d_type, no syscall on most filesystems),
+and mtime/size/type all come from a single stat() per entry.
+
+author: zhaoyafei0210@gmail.com
+github: https://github.com/walkoncross/tornado-file-server
+"""
+
+import os
+import os.path as osp
+import stat
+import sys
+import time
+
+import tornado.escape
+
+from .chunked_uploads import is_session_file
+from .metrics import timed_stat, fs_timer
+
+
+SORT_NAME = 'name'
+SORT_MTIME = 'mtime'
+SORT_SIZE = 'size'
+SORT_TYPE = 'type'
+sort_list = [SORT_NAME, SORT_MTIME, SORT_SIZE, SORT_TYPE]
+
+SORT_ASC = 'asc'
+SORT_DESC = 'desc'
+sort_order_list = [SORT_ASC, SORT_DESC]
+
+
+class DirItem(object):
+    """One entry of a folder listing
+
+    In lazy listing mode, items are created from DirEntry type info only and
+    file_type/size/mtime stay None until stat_dir_items() is called on them.
+
+    Stat-ed items are not modified again: when the entry changes, the listing
+    swaps in a new item, so that a page being rendered never sees half of it.
+    """
+
+    __slots__ = ('name', 'escaped_name', 'html_name', 'is_dir', 'is_file',
+                 'file_type', 'size', 'mtime', 'stat_time', 'html_cells')
+
+    def __init__(self, name, is_dir, is_file=False, file_type=None, size=None, mtime=None,
+                 stat_time=None):
+        """__init__
+
+        Args:
+            name (str): file name
+            is_dir (bool): is a folder (or a symlink to a folder) or not
+            is_file (bool, optional): is a regular file (or a symlink to one) or not.
+                Defaults to False.
+            file_type (str, optional): 'DIR', 'SYMLINK', 'unknown' or the file extension,
+                None if not stat-ed yet. Defaults to None.
+            size (int, optional): file size in bytes, None for non-regular files. Defaults to None.
+            mtime (float, optional): modified time in seconds since epoch. Defaults to None.
+            stat_time (float, optional): time.monotonic() of the stat, None if not
+                stat-ed yet. Defaults to None.
+        """
+        self.name = name
+        self.escaped_name = tornado.escape.url_escape(name, plus=False)
+        self.html_name = tornado.escape.xhtml_escape(name)
+        self.is_dir = is_dir
+        self.is_file = is_file
+        self.file_type = file_type
+        self.size = size
+        self.mtime = mtime
+        self.stat_time = stat_time
+        # display cells of folder pages, see page_templates.get_item_cells()
+        self.html_cells = None
+
+    @property
+    def is_stat_done(self):
+        return self.file_type is not None
+
+    def update_from_stat(self, st, stat_time):
+        """fill type/size/mtime from a (followed) stat result
+
+        file_type is set last, so that other threads which see is_stat_done
+        also see the other fields.
+
+        Args:
+            st (os.stat_result): stat result of the item
+            stat_time (float): time.monotonic() of the stat, shared by the
+                items stat-ed together to save memory
+        """
+        st_mode = st.st_mode
+        self.is_dir = stat.S_ISDIR(st_mode)
+        self.is_file = stat.S_ISREG(st_mode)
+        self.size = st.st_size if stat.S_ISREG(st_mode) else None
+        self.mtime = st.st_mtime
+        self.stat_time = stat_time
+        self.file_type = get_file_type(self.name, st_mode)
+
+    def has_same_stat(self, other):
+        """has_same_stat
+
+        Args:
+            other (DirItem): stat-ed item of the same entry
+
+        Returns:
+            bool: same type, size and mtime
+        """
+        return (self.file_type == other.file_type and self.size == other.size and
+                self.mtime == other.mtime)
+
+    def nbytes(self):
+        """nbytes
+
+        Returns:
+            int: approximate memory footprint in bytes
+        """
+        return (sys.getsizeof(self) + sys.getsizeof(self.name) +
+                sys.getsizeof(self.escaped_name) + sys.getsizeof(self.html_name) + 160)
+
+
+def format_file_mtime(mtime):
+    """format_file_mtime
+
+    Args:
+        mtime (float): modified time in seconds since epoch
+
+    Returns:
+        str: description for file modified time
+    """
+    if mtime is None:
+        return u'-'
+
+    mt = time.localtime(mtime)
+    return time.strftime('%y-%m-%d %H:%M:%S', mt)
+
+
+def format_file_size(size):
+    """format_file_size
+
+    Args:
+        size (int): file size in bytes
+
+    Returns:
+        str: description for file size
+    """
+    sz_unit = ['Byte', 'KB', 'MB', 'GB']
+
+    if size is None:
+        return u'-'
+
+    sz = float(size)
+
+    unit_idx = 0
+    while (sz > 1024 and unit_idx < len(sz_unit) - 1):
+        sz = sz / 1024
+        unit_idx += 1
+
+    return u'%.3f %s' % (sz, sz_unit[unit_idx])
+
+
+def get_file_type(name, st_mode):
+    """get_file_type
+
+    Args:
+        name (str): file name
+        st_mode (int): st_mode of the (followed) stat result
+
+    Returns:
+        str: description for file type
+    """
+    ftype = 'unknown'
+    if stat.S_ISDIR(st_mode):
+        ftype = 'DIR'
+    elif stat.S_ISREG(st_mode):
+        ext = osp.splitext(name)[1]
+        if ext:
+            ftype = ext
+
+    return ftype
+
+
+def make_dir_item(entry, lazy=False, stat_time=None):
+    """make a DirItem out of a DirEntry, with at most one stat()
+
+    Args:
+        entry (os.DirEntry): entry returned by os.scandir
+        lazy (bool, optional): only use DirEntry type info, no stat(). Defaults to False.
+        stat_time (float, optional): time.monotonic() of the scan, see
+            DirItem.update_from_stat(). Defaults to None, the current time.
+
+    Returns:
+        DirItem: item info
+    """
+    if lazy:
+        try:
+            is_dir = entry.is_dir()
+            is_file = entry.is_file()
+        except OSError:
+            is_dir = is_file = False
+        return DirItem(entry.name, is_dir, is_file)
+
+    if stat_time is None:
+        stat_time = time.monotonic()
+
+    try:
+        st = entry.stat()
+    except OSError:
+        # broken symlink, or the entry is gone since scandir
+        return DirItem(entry.name, False, False,
+                       'SYMLINK' if entry.is_symlink() else 'unknown', stat_time=stat_time)
+
+    item = DirItem(entry.name, False)
+    item.update_from_stat(st, stat_time)
+
+    return item
+
+
+def stat_dir_item(full_local_path, item, stat_time):
+    """stat an item, one stat() call
+
+    Args:
+        full_local_path (str): full local path of the folder
+        item (DirItem): item of this folder, not stat-ed yet
+        stat_time (float): time.monotonic() of the stat
+    """
+    item_full_path = osp.join(full_local_path, item.name)
+    try:
+        item.update_from_stat(timed_stat(item_full_path), stat_time)
+    except OSError:
+        item.stat_time = stat_time
+        item.file_type = 'SYMLINK' if osp.islink(item_full_path) else 'unknown'
+
+
+def stat_dir_items(full_local_path, items):
+    """stat the items which are not stat-ed yet, one stat() per item
+
+    Args:
+        full_local_path (str): full local path of the folder
+        items (iterable): DirItem objects of this folder
+    """
+    stat_time = time.monotonic()
+    for item in items:
+        if not item.is_stat_done:
+            stat_dir_item(full_local_path, item, stat_time)
+
+
+def get_name_sort_key(name):
+    """get_name_sort_key
+
+    Args:
+        name (str): file name
+
+    Returns:
+        tuple: key of the listing order, lowercased name first. A total order,
+            so that a position in a listing can be found again from a name.
+    """
+    return (name.lower(), name)
+
+
+def get_sort_prefix(item, sort):
+    """get the part of the sort key of a stat-ed item before its name key
+
+    Args:
+        item (DirItem): stat-ed item
+        sort (str): one of sort_list
+
+    Returns:
+        tuple: () for 'name', (mtime,) for 'mtime', (size,) for 'size' (-1 for
+            folders and other non-regular files), (0 for folders 1 otherwise,
+            lowercased file type) for 'type'
+    """
+    if sort == SORT_MTIME:
+        return (item.mtime if item.mtime is not None else 0.0,)
+    elif sort == SORT_SIZE:
+        return (item.size if item.size is not None else -1,)
+    elif sort == SORT_TYPE:
+        return (0 if item.is_dir else 1, (item.file_type or u'').lower())
+
+    return ()
+
+
+def get_item_sort_key(item, sort):
+    """get_item_sort_key
+
+    Args:
+        item (DirItem): stat-ed item
+        sort (str): one of sort_list
+
+    Returns:
+        tuple: key of the item in the sort order, ties broken by name, so that
+            every sort order is a total order
+    """
+    return get_sort_prefix(item, sort) + get_name_sort_key(item.name)
+
+
+def scan_dir(full_local_path, lazy=False):
+    """scan a folder
+
+    Args:
+        full_local_path (str): full local path of the folder
+        lazy (bool, optional): do not stat the entries, see make_dir_item(). Defaults to False.
+
+    Returns:
+        list: DirItem list, sorted by get_name_sort_key(), without the files of
+            chunked uploads
+    """
+    stat_time = time.monotonic()
+    with fs_timer('scandir'), os.scandir(full_local_path) as it:
+        items = [make_dir_item(entry, lazy, stat_time) for entry in it
+                 if not is_session_file(entry.name)]
+
+    # os.scandir() returns entries in arbitray order on Linux filesystem,
+    # and cursor pagination needs the same order on every platform
+    items.sort(key=lambda item: get_name_sort_key(item.name))
+
+    return items
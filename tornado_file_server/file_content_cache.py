@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+"""
+in-memory cache of small file contents
+
+Preview pages make bursts of requests for the same small images, icons and
+JSON files. Files up to max_file_size are kept in an LRU cache bounded by
+total size, with their ETag and Content-Type computed once, and served
+without opening the file again.
+
+An entry is only used if the (st_ino, st_size, st_mtime_ns) of the file still
+match the ones it was read with. When a filesystem watcher is set, changed
+files are also dropped as soon as the watcher reports them, so their memory
+is freed right away.
+
+author: zhaoyafei0210@gmail.com
+github: https://github.com/walkoncross/tornado-file-server
+"""
+
+import mimetypes
+import os.path as osp
+import threading
+from collections import OrderedDict
+
+from .fs_watcher import CHANGE_ENTRY, CHANGE_DIR
+
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_MAX_FILE_SIZE = 256 * 1024
+
+
+def get_file_etag(st):
+    """get the ETag of a file from its inode/size/mtime
+
+    Args:
+        st (os.stat_result): stat of the file
+
+    Returns:
+        str: ETag, without quotes
+    """
+    return u'{:x}-{:x}-{:x}'.format(st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def get_file_content_type(full_local_path):
+    """get the Content-Type of a file, same as StaticFileHandler.get_content_type()
+
+    Args:
+        full_local_path (str): full local path of the file
+
+    Returns:
+        str: Content-Type
+    """
+    mime_type, encoding = mimetypes.guess_type(full_local_path)
+
+    if encoding == 'gzip':
+        return 'application/gzip'
+    elif encoding is not None:
+        return 'application/octet-stream'
+    elif mime_type is not None:
+        return mime_type
+    else:
+        return 'application/octet-stream'
+
+
+class FileContent(object):
+    """Cached content of one file
+    """
+
+    __slots__ = ('ino', 'size', 'mtime_ns', 'data', 'etag', 'content_type')
+
+    def __init__(self, st, data, etag, content_type):
+        """__init__
+
+        Args:
+            st (os.stat_result): stat of the file when it was read
+            data (bytes): file content
+            etag (str): ETag of the file, quoted
+            content_type (str): Content-Type of the file
+        """
+        self.ino = st.st_ino
+        self.size = st.st_size
+        self.mtime_ns = st.st_mtime_ns
+        self.data = data
+        self.etag = etag
+        self.content_type = content_type
+
+    def is_valid_for(self, st):
+        return (self.ino == st.st_ino and self.size == st.st_size and
+                self.mtime_ns == st.st_mtime_ns)
+
+
+class FileContentCache(object):
+    """LRU cache of small file contents, bounded by total size
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, max_file_size=DEFAULT_MAX_FILE_SIZE):
+        """__init__
+
+        Args:
+            max_bytes (int, optional): max total size of the cached contents.
+                Defaults to DEFAULT_MAX_BYTES.
+            max_file_size (int, optional): larger files are not cached.
+                Defaults to DEFAULT_MAX_FILE_SIZE.
+        """
+        self._lock = threading.Lock()
+        self._contents = OrderedDict()
+        self._nbytes = 0
+
+        self.max_bytes = max_bytes
+        self.max_file_size = max_file_size
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def configure(self, max_bytes=None, max_file_size=None):
+        """configure
+
+        Args:
+            max_bytes (int, optional): see __init__. Defaults to None (unchanged).
+            max_file_size (int, optional): see __init__. Defaults to None (unchanged).
+        """
+        with self._lock:
+            if max_bytes is not None:
+                self.max_bytes = max_bytes
+            if max_file_size is not None:
+                self.max_file_size = max_file_size
+            self._evict()
+
+    def set_watcher(self, watcher):
+        """drop changed files as soon as the watcher reports them
+
+        Args:
+            watcher (FSWatcher): watcher, None to only validate entries by stat
+        """
+        if watcher is not None:
+            watcher.add_listener(self.on_fs_change)
+
+    def is_cacheable(self, st):
+        """is_cacheable
+
+        Args:
+            st (os.stat_result): stat of the file
+
+        Returns:
+            bool: whether the file is small enough to be cached
+        """
+        return self.max_bytes > 0 and st.st_size <= self.max_file_size
+
+    def get(self, full_local_path, st):
+        """get the cached content of a file, no I/O
+
+        Args:
+            full_local_path (str): full local path of the file
+            st (os.stat_result): current stat of the file
+
+        Returns:
+            FileContent: cached content, None on a miss
+        """
+        if not self.is_cacheable(st):
+            return None
+
+        with self._lock:
+            content = self._contents.get(full_local_path)
+            if content is not None and content.is_valid_for(st):
+                self._contents.move_to_end(full_local_path)
+                self.hits += 1
+                return content
+
+            self.misses += 1
+            return None
+
+    def load(self, full_local_path, st):
+        """read a file into the cache, blocking
+
+        Args:
+            full_local_path (str): full local path of the file
+            st (os.stat_result): stat of the file
+
+        Returns:
+            FileContent: the content, None if the file changed since st
+        """
+        with open(full_local_path, 'rb') as fp:
+            data = fp.read(st.st_size + 1)
+
+        if len(data) != st.st_size:
+            return None
+
+        content = FileContent(st, data, u'"{}"'.format(get_file_etag(st)),
+                              get_file_content_type(full_local_path))
+
+        with self._lock:
+            old_content = self._contents.pop(full_local_path, None)
+            if old_content is not None:
+                self._nbytes -= len(old_content.data)
+
+            self._contents[full_local_path] = content
+            self._nbytes += len(data)
+            self._evict()
+
+        return content
+
+    def invalidate(self, full_local_path):
+        """invalidate
+
+        Args:
+            full_local_path (str): full local path of the file
+        """
+        with self._lock:
+            content = self._contents.pop(full_local_path, None)
+            if content is not None:
+                self._nbytes -= len(content.data)
+
+    def invalidate_dir(self, dir_path):
+        """drop the cached files of a folder
+
+        Args:
+            dir_path (str): full local path of the folder
+        """
+        with self._lock:
+            for full_local_path in list(self._contents):
+                if osp.dirname(full_local_path) == dir_path:
+                    content = self._contents.pop(full_local_path)
+                    self._nbytes -= len(content.data)
+
+    def clear(self):
+        with self._lock:
+            self._contents.clear()
+            self._nbytes = 0
+
+    def on_fs_change(self, kind, path, name=None):
+        """watcher listener, see fs_watcher.py
+
+        Args:
+            kind (str): one of CHANGE_ENTRY, CHANGE_DIR, CHANGE_TREE, CHANGE_ALL
+            path (str): folder path
+            name (str, optional): entry name for CHANGE_ENTRY. Defaults to None.
+        """
+        if kind == CHANGE_ENTRY:
+            self.invalidate(osp.join(path, name))
+        elif kind == CHANGE_DIR:
+            # a file may have been replaced by a rename
+            self.invalidate_dir(path)
+        else:
+            self.clear()
+
+    def stats(self):
+        """stats
+
+        Returns:
+            dict: cache statistics
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._contents),
+                'bytes': self._nbytes,
+                'max_bytes': self.max_bytes,
+                'max_file_size': self.max_file_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': float(self.hits) / lookups if lookups else 0.0,
+            }
+
+    def _evict(self):
+        while self._contents and self._nbytes > self.max_bytes:
+            _, content = self._contents.popitem(last=False)
+            self._nbytes -= len(content.data)
+            self.evictions += 1
+
+
+file_content_cache = FileContentCache()
@@ -0,0 +1,414 @@
+# -*- coding: utf-8 -*-
+"""
+recursive folder sizes, computed in the background
+
+Requests never wait for a folder size: FolderSizeCache.get() returns the
+cached size of a folder, if any, and queues the folder for a background
+walker thread when there is none or it has expired. The walker computes sizes bottom-up, caching the total size
+and file count of every folder below the requested one, so a later request
+for a sub folder, or a recomputation after a change, only scans the folders
+without a valid cached size.
+
+With a filesystem watcher, a change in a folder drops the cached sizes of
+the folder and of its ancestors, which are then recomputed from their
+direct entries and the still valid sizes of their other sub folders, e.g.
+a file written deep in a big tree costs one scandir per ancestor, not a
+walk of the whole tree.
+
+Sizes of folders the watcher could not watch (or without watcher) are not
+refreshed on a timer: when the listing of a folder is rescanned because the
+folder changed, FolderHandler calls expire(), and the folder and its
+ancestors are recomputed the same way the next time a page shows them.
+Files changing in place, without changing the mtime of their folder, are
+only seen after max_age seconds, if set.
+
+Folder symlinks are not followed, hard-linked files are counted every time.
+
+author: zhaoyafei0210@gmail.com
+github: https://github.com/walkoncross/tornado-file-server
+"""
+
+import logging
+import os
+import os.path as osp
+import stat
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import tornado.ioloop
+
+from .chunked_uploads import is_session_file
+from .fs_watcher import CHANGE_ENTRY, CHANGE_DIR, CHANGE_TREE
+
+
+# sizes of unwatched folders never expire by time
+DEFAULT_MAX_AGE = None
+# seconds changes are collected before the changed folders are recomputed
+UPDATE_DELAY = 1.0
+
+
+class FolderSize(object):
+    """Recursive size of a folder
+    """
+
+    __slots__ = ('total_size', 'file_count', 'watched', 'computed_at', 'expired')
+
+    def __init__(self, total_size, file_count, watched, computed_at):
+        """__init__
+
+        Args:
+            total_size (int): total size in bytes of the regular files below the folder
+            file_count (int): number of regular files below the folder
+            watched (bool): whether the folder and all its sub folders are watched
+            computed_at (float): time.time() of the computation
+        """
+        self.total_size = total_size
+        self.file_count = file_count
+        self.watched = watched
+        self.computed_at = computed_at
+        # set by FolderSizeCache.expire()
+        self.expired = False
+
+
+class FolderSizeCache(object):
+    """Cache of recursive folder sizes, computed by a background walker
+    """
+
+    def __init__(self, root_dir, max_age=DEFAULT_MAX_AGE):
+        """__init__
+
+        Args:
+            root_dir (str): root dir, folders outside of it are ignored
+            max_age (float, optional): seconds the size of an unwatched folder is
+                valid, None until expire(). Defaults to DEFAULT_MAX_AGE.
+        """
+        self.root_dir = osp.abspath(root_dir)
+        self.max_age = max_age
+
+        self._lock = threading.Lock()
+        self._sizes = {}
+
+        self.watcher = None
+        self._io_loop = None
+        # one thread: walking is disk bound, and must not starve the io pool
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='tfs-du')
+        # folders to compute, in request order
+        self._pending = OrderedDict()
+        self._running = False
+        # changes seen while a walk is running, applied after it
+        self._deferred_changes = []
+
+        self.num_computed = 0
+        self.num_scanned = 0
+
+    def start(self, watcher=None):
+        """start, on the IOLoop thread
+
+        Args:
+            watcher (FSWatcher, optional): watcher of the whole tree. Defaults to None.
+        """
+        self._io_loop = tornado.ioloop.IOLoop.current()
+        self.watcher = watcher
+        if watcher is not None:
+            watcher.add_listener(self.on_fs_change)
+
+    def _is_valid(self, folder_size):
+        if folder_size.watched:
+            return True
+        if folder_size.expired:
+            return False
+
+        return self.max_age is None or time.time() - folder_size.computed_at < self.max_age
+
+    def get(self, full_local_path):
+        """get the cached size of a folder, queue it for computation if there
+        is none or it's expired, may be called from any thread
+
+        Args:
+            full_local_path (str): full local path of the folder
+
+        Returns:
+            FolderSize: the size, possibly expired, None if not computed yet
+        """
+        with self._lock:
+            folder_size = self._sizes.get(full_local_path)
+
+        if folder_size is None or not self._is_valid(folder_size):
+            if self._io_loop is not None:
+                self._io_loop.add_callback(self._request, full_local_path)
+
+        return folder_size
+
+    def _request(self, full_local_path):
+        self._pending[full_local_path] = True
+        if not self._running:
+            self._running = True
+            self._io_loop.spawn_callback(self._run)
+
+    async def _run(self):
+        try:
+            while self._pending:
+                full_local_path, _ = self._pending.popitem(last=False)
+                with self._lock:
+                    folder_size = self._sizes.get(full_local_path)
+                if folder_size is not None and self._is_valid(folder_size):
+                    continue
+
+                try:
+                    await self._io_loop.run_in_executor(
+                        self._executor, self.compute, full_local_path)
+                except Exception:
+                    logging.exception(u'folder size of {} failed'.format(full_local_path))
+
+                changes, self._deferred_changes = self._deferred_changes, []
+                for change in changes:
+                    self._apply_change(*change)
+        finally:
+            self._running = False
+
+    def _scan(self, full_local_path):
+        """sizes of the direct entries of a folder
+
+        Returns:
+            tuple: (size, file_count, sub_dir_paths), None if it can't be scanned
+        """
+        if self.watcher is not None:
+            # before scanning, so changes made during the scan are not lost
+            self.watcher.watch(full_local_path)
+
+        size = 0
+        file_count = 0
+        sub_dir_paths = []
+        try:
+            with os.scandir(full_local_path) as it:
+                for entry in it:
+                    if is_session_file(entry.name):
+                        continue
+
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            sub_dir_paths.append(entry.path)
+                            continue
+
+                        st = entry.stat()
+                    except OSError:
+                        continue
+
+                    if stat.S_ISREG(st.st_mode):
+                        size += st.st_size
+                        file_count += 1
+        except OSError as e:
+            logging.info(u'folder size: can not scan {}: {}'.format(full_local_path, e))
+            return None
+
+        self.num_scanned += 1
+
+        return size, file_count, sub_dir_paths
+
+    def compute(self, full_local_path):
+        """compute the size of a folder, reusing the valid cached sizes of its
+        sub folders, blocking
+
+        Args:
+            full_local_path (str): full local path of the folder
+
+        Returns:
+            FolderSize: the size, None if the folder can't be scanned
+        """
+        # iterative, deep trees would hit the recursion limit
+        scans = {}
+        scan_order = []
+        pending_paths = [full_local_path]
+        while pending_paths:
+            path = pending_paths.pop()
+            if path != full_local_path:
+                with self._lock:
+                    folder_size = self._sizes.get(path)
+                if folder_size is not None and self._is_valid(folder_size):
+                    continue
+
+            scan = self._scan(path)
+            if scan is None:
+                continue
+
+            scans[path] = scan
+            scan_order.append(path)
+            pending_paths.extend(scan[2])
+
+        # sub folders were scanned after their parents
+        folder_size = None
+        for path in reversed(scan_order):
+            size, file_count, sub_dir_paths = scans.pop(path)
+            watched = self.watcher is not None and self.watcher.is_watched(path)
+
+            with self._lock:
+                for sub_dir_path in sub_dir_paths:
+                    sub_folder_size = self._sizes.get(sub_dir_path)
+                    if sub_folder_size is None:
+                        # could not be scanned
+                        watched = False
+                        continue
+
+                    size += sub_folder_size.total_size
+                    file_count += sub_folder_size.file_count
+                    watched = watched and sub_folder_size.watched
+
+                folder_size = FolderSize(size, file_count, watched, time.time())
+                self._sizes[path] = folder_size
+
+        self.num_computed += 1
+
+        return folder_size
+
+    def expire(self, full_local_path):
+        """mark the cached sizes of an unwatched folder and of its ancestors as
+        expired, they are kept until recomputed, may be called from any thread
+
+        Args:
+            full_local_path (str): full local path of the folder
+        """
+        path = full_local_path
+        with self._lock:
+            while True:
+                folder_size = self._sizes.get(path)
+                if folder_size is not None and not folder_size.watched:
+                    folder_size.expired = True
+
+                if path == self.root_dir or not path.startswith(self.root_dir):
+                    break
+
+                parent_path = osp.dirname(path)
+                if parent_path == path:
+                    break
+                path = parent_path
+
+    def invalidate(self, full_local_path):
+        """drop the cached sizes of a folder and of its ancestors
+
+        Args:
+            full_local_path (str): full local path of the folder
+
+        Returns:
+            str: the top-most folder whose size was dropped, None if none was cached
+        """
+        top_path = None
+        path = full_local_path
+        with self._lock:
+            while True:
+                if self._sizes.pop(path, None) is not None:
+                    top_path = path
+
+                if path == self.root_dir or not path.startswith(self.root_dir):
+                    break
+
+                parent_path = osp.dirname(path)
+                if parent_path == path:
+                    break
+                path = parent_path
+
+        return top_path
+
+    def invalidate_tree(self, full_local_path):
+        """drop the cached sizes of a folder, of all the folders below it, and
+        of its ancestors
+
+        Args:
+            full_local_path (str): full local path of the folder
+
+        Returns:
+            str: see invalidate()
+        """
+        prefix = full_local_path.rstrip(os.sep) + os.sep
+        with self._lock:
+            for path in [path for path in self._sizes if path.startswith(prefix)]:
+                del self._sizes[path]
+
+        return self.invalidate(full_local_path)
+
+    def clear(self):
+        with self._lock:
+            self._sizes.clear()
+
+    def on_fs_change(self, kind, path, name=None):
+        """watcher listener, see fs_watcher.py
+
+        Args:
+            kind (str): one of CHANGE_ENTRY, CHANGE_DIR, CHANGE_TREE, CHANGE_ALL
+            path (str): folder path
+            name (str, optional): entry name for CHANGE_ENTRY. Defaults to None.
+        """
+        if kind == CHANGE_ENTRY and is_session_file(name):
+            # every chunk written to a chunked upload, which is not counted
+            return
+
+        if self._running:
+            # the walk may have scanned the folder before the change
+            self._deferred_changes.append((kind, path, name))
+        else:
+            self._apply_change(kind, path, name)
+
+    def _apply_change(self, kind, path, name=None):
+        if kind in (CHANGE_ENTRY, CHANGE_DIR):
+            top_path = self.invalidate(path)
+        elif kind == CHANGE_TREE:
+            top_path = self.invalidate_tree(path)
+        else:
+            self.clear()
+            top_path = None
+
+        # recompute what was cached, in the background; a removed folder
+        # is just skipped by compute()
+        if top_path is not None:
+            self._io_loop.call_later(UPDATE_DELAY, self._request, top_path)
+
+    def stats(self):
+        """stats
+
+        Returns:
+            dict: cache statistics
+        """
+        with self._lock:
+            return {
+                'folders': len(self._sizes),
+                'pending': len(self._pending),
+                'computed': self.num_computed,
+                'scanned_folders': self.num_scanned,
+            }
+
+
+_folder_size_cache = None
+
+
+def configure_folder_sizes(root_dir, enabled=False, max_age=DEFAULT_MAX_AGE, watcher=None):
+    """create the folder size cache, on the IOLoop thread
+
+    Args:
+        root_dir (str): root dir
+        enabled (bool, optional): True to enable folder sizes. Defaults to False.
+        max_age (float, optional): see FolderSizeCache. Defaults to DEFAULT_MAX_AGE.
+        watcher (FSWatcher, optional): watcher of the whole tree. Defaults to None.
+
+    Returns:
+        FolderSizeCache: the cache, None if disabled
+    """
+    global _folder_size_cache
+
+    if not enabled:
+        _folder_size_cache = None
+        return None
+
+    _folder_size_cache = FolderSizeCache(root_dir, max_age)
+    _folder_size_cache.start(watcher)
+
+    return _folder_size_cache
+
+
+def get_folder_size_cache():
+    """get_folder_size_cache
+
+    Returns:
+        FolderSizeCache: the folder size cache, None if disabled
+    """
+    return _folder_size_cache
@@ -0,0 +1,421 @@
+# -*- coding: utf-8 -*-
+"""
+filesystem watchers used to invalidate cached listings
+
+InotifyWatcher (Linux only, through ctypes) reports changes as soon as the
+kernel sees them, so a watched folder can be served from cache without any
+stat(). PollingWatcher is the portable fallback: it stats every watched
+folder every few seconds, and the entries of the folder the listener knows the
+metadata of (see FSWatcher.set_entry_provider()), to see in-place rewrites of
+files too.
+
+Listeners are called on the IOLoop thread as listener(kind, path, name):
+    CHANGE_ENTRY: metadata of the entry `name` in folder `path` changed
+    CHANGE_DIR: entries were added to/removed from folder `path`
+    CHANGE_TREE: folder `path` and everything below it is gone or moved
+    CHANGE_ALL: events were lost, everything must be considered stale
+
+author: zhaoyafei0210@gmail.com
+github: https://github.com/walkoncross/tornado-file-server
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import os.path as osp
+import struct
+import sys
+import stat
+import threading
+
+import tornado.ioloop
+
+from .io_executor import run_in_io_executor
+
+
+CHANGE_ENTRY = 'entry'
+CHANGE_DIR = 'dir'
+CHANGE_TREE = 'tree'
+CHANGE_ALL = 'all'
+
+fs_watch_mode_list = ['off', 'auto', 'inotify', 'poll']
+
+
+# from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+INOTIFY_WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE |
+                      IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE |
+                      IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+_inotify_event_header = struct.Struct('iIII')
+
+
+class FSWatcher(object):
+    """Base class of filesystem watchers
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._listeners = []
+        self._entry_provider = None
+
+    def add_listener(self, listener):
+        """add_listener
+
+        Args:
+            listener (callable): called as listener(kind, path, name) on the IOLoop thread
+        """
+        self._listeners.append(listener)
+
+    def set_entry_provider(self, entry_provider):
+        """set where watchers which can not see changes of entries by themselves
+        (PollingWatcher) get the entries to check
+
+        Args:
+            entry_provider (callable): entry_provider(path) returns the stat-ed
+                dir_scanner.DirItem objects of folder path, called from any thread
+        """
+        self._entry_provider = entry_provider
+
+    def notify(self, kind, path, name=None):
+        """call all listeners
+
+        Args:
+            kind (str): one of CHANGE_ENTRY, CHANGE_DIR, CHANGE_TREE, CHANGE_ALL
+            path (str): folder path
+            name (str, optional): entry name for CHANGE_ENTRY. Defaults to None.
+        """
+        for listener in self._listeners:
+            try:
+                listener(kind, path, name)
+            except Exception:
+                logging.exception(u'fs watcher listener failed')
+
+    def start(self):
+        raise NotImplementedError()
+
+    def watch(self, path):
+        """start watching a folder, may be called from any thread
+
+        Args:
+            path (str): full local path of the folder
+
+        Returns:
+            bool: whether the folder is watched now
+        """
+        raise NotImplementedError()
+
+    def unwatch(self, path):
+        """stop watching a folder, may be called from any thread
+
+        Args:
+            path (str): full local path of the folder
+        """
+        raise NotImplementedError()
+
+    def is_watched(self, path):
+        """is_watched
+
+        Args:
+            path (str): full local path of the folder
+
+        Returns:
+            bool: whether changes of the folder are reported
+        """
+        raise NotImplementedError()
+
+    def unwatch_tree(self, path):
+        """stop watching a folder and all the folders below it
+
+        Args:
+            path (str): full local path of the folder
+        """
+        prefix = path.rstrip(os.sep) + os.sep
+        for watched_path in self.get_watched_paths():
+            if watched_path == path or watched_path.startswith(prefix):
+                self.unwatch(watched_path)
+
+    def get_watched_paths(self):
+        raise NotImplementedError()
+
+
+class InotifyWatcher(FSWatcher):
+    """Linux inotify watcher, events are read on the IOLoop thread
+    """
+
+    def __init__(self):
+        super(InotifyWatcher, self).__init__()
+
+        libc_name = ctypes.util.find_library('c') or 'libc.so.6'
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+        self._wd_to_paths = {}
+        self._path_to_wd = {}
+
+    @staticmethod
+    def is_supported():
+        """is_supported
+
+        Returns:
+            bool: whether inotify can be used on this platform
+        """
+        if not sys.platform.startswith('linux'):
+            return False
+
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6')
+            return hasattr(libc, 'inotify_init1')
+        except OSError:
+            return False
+
+    def start(self):
+        tornado.ioloop.IOLoop.current().add_handler(
+            self._fd, self._handle_events, tornado.ioloop.IOLoop.READ)
+
+    def watch(self, path):
+        with self._lock:
+            if path in self._path_to_wd:
+                return True
+
+            wd = self._libc.inotify_add_watch(
+                self._fd, os.fsencode(path), INOTIFY_WATCH_MASK)
+            if wd < 0:
+                err = ctypes.get_errno()
+                if err == errno.ENOSPC:
+                    logging.warning(
+                        u'inotify watch limit reached, not watching: {}'.format(path))
+                return False
+
+            # the same folder may be reached through several paths (symlinks)
+            self._wd_to_paths.setdefault(wd, set()).add(path)
+            self._path_to_wd[path] = wd
+
+            return True
+
+    def unwatch(self, path):
+        with self._lock:
+            wd = self._path_to_wd.pop(path, None)
+            if wd is None:
+                return
+
+            paths = self._wd_to_paths.get(wd)
+            if paths is not None:
+                paths.discard(path)
+                if not paths:
+                    del self._wd_to_paths[wd]
+                    self._libc.inotify_rm_watch(self._fd, wd)
+
+    def is_watched(self, path):
+        return path in self._path_to_wd
+
+    def get_watched_paths(self):
+        with self._lock:
+            return list(self._path_to_wd)
+
+    def _forget_wd(self, wd):
+        with self._lock:
+            paths = self._wd_to_paths.pop(wd, set())
+            for path in paths:
+                self._path_to_wd.pop(path, None)
+
+        return paths
+
+    def _handle_events(self, fd, events):
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EINTR):
+                return
+            raise
+
+        changes = []
+        offset = 0
+        while offset + _inotify_event_header.size <= len(data):
+            wd, mask, _, name_len = _inotify_event_header.unpack_from(data, offset)
+            offset += _inotify_event_header.size
+            name = data[offset:offset + name_len].rstrip(b'\0')
+            offset += name_len
+            name = os.fsdecode(name) if name else None
+
+            if mask & IN_Q_OVERFLOW:
+                changes.append((CHANGE_ALL, None, None))
+                continue
+
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                for path in self._forget_wd(wd):
+                    changes.append((CHANGE_TREE, path, None))
+                continue
+
+            for path in list(self._wd_to_paths.get(wd, ())):
+                if name is None:
+                    continue
+
+                if mask & (IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO):
+                    changes.append((CHANGE_DIR, path, None))
+                    if mask & IN_ISDIR and mask & (IN_DELETE | IN_MOVED_FROM):
+                        changes.append((CHANGE_TREE, osp.join(path, name), None))
+                else:
+                    changes.append((CHANGE_ENTRY, path, name))
+
+        last = None
+        for change in changes:
+            # writes to a file come as long runs of identical IN_MODIFY events
+            if change == last:
+                continue
+            last = change
+
+            kind, path, name = change
+            if kind == CHANGE_TREE:
+                self.unwatch_tree(path)
+            elif kind == CHANGE_ALL:
+                self.unwatch_tree(os.sep)
+            self.notify(kind, path, name)
+
+
+class PollingWatcher(FSWatcher):
+    """Portable watcher, stats the watched folders every poll_interval seconds
+    """
+
+    def __init__(self, poll_interval=2.0):
+        """__init__
+
+        Args:
+            poll_interval (float, optional): seconds between two polls. Defaults to 2.0.
+        """
+        super(PollingWatcher, self).__init__()
+        self.poll_interval = poll_interval
+        self._dir_stats = {}
+        self._polling = False
+        self._periodic_callback = None
+
+    def start(self):
+        self._periodic_callback = tornado.ioloop.PeriodicCallback(
+            self._poll, self.poll_interval * 1000)
+        self._periodic_callback.start()
+
+    def watch(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+
+        with self._lock:
+            self._dir_stats.setdefault(path, (st.st_ino, st.st_mtime_ns))
+
+        return True
+
+    def unwatch(self, path):
+        with self._lock:
+            self._dir_stats.pop(path, None)
+
+    def is_watched(self, path):
+        return path in self._dir_stats
+
+    def get_watched_paths(self):
+        with self._lock:
+            return list(self._dir_stats)
+
+    def _check_dirs(self):
+        changes = []
+        for path, old_stat in list(self._dir_stats.items()):
+            try:
+                st = os.stat(path)
+            except OSError:
+                changes.append((CHANGE_TREE, path, None))
+                continue
+
+            new_stat = (st.st_ino, st.st_mtime_ns)
+            if new_stat != old_stat:
+                with self._lock:
+                    if path in self._dir_stats:
+                        self._dir_stats[path] = new_stat
+                changes.append((CHANGE_DIR, path, None))
+            elif self._entry_provider is not None:
+                changes.extend(self._check_entries(path))
+
+        return changes
+
+    def _check_entries(self, path):
+        changes = []
+        for item in self._entry_provider(path):
+            try:
+                st = os.stat(osp.join(path, item.name))
+            except OSError:
+                # gone, the next poll sees the folder change
+                continue
+
+            size = st.st_size if stat.S_ISREG(st.st_mode) else None
+            if st.st_mtime != item.mtime or size != item.size:
+                changes.append((CHANGE_ENTRY, path, item.name))
+
+        return changes
+
+    async def _poll(self):
+        if self._polling:
+            return
+
+        self._polling = True
+        try:
+            changes = await run_in_io_executor(self._check_dirs)
+        finally:
+            self._polling = False
+
+        for kind, path, name in changes:
+            if kind == CHANGE_TREE:
+                self.unwatch_tree(path)
+            self.notify(kind, path, name)
+
+
+def create_fs_watcher(fs_watch_mode='auto', poll_interval=2.0):
+    """create and start a filesystem watcher
+
+    Args:
+        fs_watch_mode (str, optional): one of fs_watch_mode_list. 'auto' uses
+            inotify when available and polling otherwise. Defaults to 'auto'.
+        poll_interval (float, optional): seconds between two polls of PollingWatcher.
+            Defaults to 2.0.
+
+    Returns:
+        FSWatcher: started watcher, None if fs_watch_mode is 'off'
+    """
+    assert(fs_watch_mode in fs_watch_mode_list)
+
+    if fs_watch_mode == 'off':
+        return None
+
+    watcher = None
+    if fs_watch_mode in ('auto', 'inotify'):
+        if InotifyWatcher.is_supported():
+            watcher = InotifyWatcher()
+        elif fs_watch_mode == 'inotify':
+            raise RuntimeError(u'inotify is not supported on this platform')
+
+    if watcher is None:
+        watcher = PollingWatcher(poll_interval)
+
+    logging.info(u'===> fs watcher: {}'.format(type(watcher).__name__))
+    watcher.start()
+
+    return watcher
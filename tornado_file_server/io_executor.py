@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+thread pool for blocking filesystem work
+
+Folder scans, stats, page rendering and file reads are run in this pool so
+that the IOLoop thread only does socket I/O.
+
+author: zhaoyafei0210@gmail.com
+github: https://github.com/walkoncross/tornado-file-server
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import tornado.ioloop
+
+
+DEFAULT_IO_THREADS = 16
+
+_io_executor = None
+
+
+def configure_io_executor(max_workers=DEFAULT_IO_THREADS):
+    """(re)create the io thread pool
+
+    Args:
+        max_workers (int, optional): number of threads. Defaults to DEFAULT_IO_THREADS.
+
+    Returns:
+        ThreadPoolExecutor: the io thread pool
+    """
+    global _io_executor
+
+    if _io_executor is not None:
+        _io_executor.shutdown(wait=False)
+
+    _io_executor = ThreadPoolExecutor(
+        max_workers=max_workers, thread_name_prefix='tfs-io')
+
+    return _io_executor
+
+
+def get_io_executor():
+    """get the io thread pool, creating it with default size if needed
+
+    Returns:
+        ThreadPoolExecutor: the io thread pool
+    """
+    if _io_executor is None:
+        configure_io_executor()
+
+    return _io_executor
+
+
+def run_in_io_executor(func, *args):
+    """run func(*args) in the io thread pool
+
+    Args:
+        func (callable): blocking function to run
+
+    Returns:
+        Future: awaitable result of func(*args)
+    """
+    return tornado.ioloop.IOLoop.current().run_in_executor(
+        get_io_executor(), func, *args)
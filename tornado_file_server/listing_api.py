@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+machine-readable folder listings: ?format=json / ?format=ndjson
+
+Pages are addressed by an opaque cursor holding the generation of the
+listing it was issued for (see DirListing.generation), the index of the
+next item, and the name of the last item returned. While the generation
+is unchanged the next page starts at the index. Once the folder has been
+rescanned, or the request lands on another server process, the next page
+starts after the last returned name in the new listing, which is sorted by
+the same key: entries present in both listings are never skipped nor
+returned twice.
+
+With ?sort=mtime|size|type and/or &order=desc, the cursor also holds the
+sort order and the sort key of the last item, so the next page is found in
+the same order. A cursor is only valid with the sort order it was issued for.
+
+author: zhaoyafei0210@gmail.com
+github: https://github.com/walkoncross/tornado-file-server
+"""
+
+import base64
+import json
+
+from .dir_scanner import (
+    get_sort_prefix, get_name_sort_key, sort_list, SORT_NAME, SORT_ASC, SORT_DESC
+)
+
+
+listing_format_list = ['json', 'ndjson']
+
+DEFAULT_LISTING_LIMIT = 1000
+MAX_LISTING_LIMIT = 10000
+
+
+class InvalidCursorError(ValueError):
+    """Malformed listing cursor
+    """
+    pass
+
+
+def encode_cursor(generation, index, last_name, sort=SORT_NAME, order=SORT_ASC, sort_prefix=()):
+    """encode_cursor
+
+    Args:
+        generation (str): generation of the listing
+        index (int): index of the next item
+        last_name (str): name of the last returned item
+        sort (str, optional): sort of the listing. Defaults to SORT_NAME.
+        order (str, optional): sort order of the listing. Defaults to SORT_ASC.
+        sort_prefix (tuple, optional): dir_scanner.get_sort_prefix() of the last
+            returned item. Defaults to ().
+
+    Returns:
+        str: url-safe cursor
+    """
+    fields = [generation, index, last_name]
+    if sort != SORT_NAME or order != SORT_ASC:
+        fields += [sort, order, list(sort_prefix)]
+    data = json.dumps(fields, separators=(',', ':'))
+
+    return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """decode_cursor
+
+    Args:
+        cursor (str): cursor returned by encode_cursor()
+
+    Returns:
+        tuple: (generation, index, last_name, sort, order, sort_prefix)
+    """
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        fields = json.loads(data.decode('utf-8'))
+        generation, index, last_name = fields[:3]
+        sort, order, sort_prefix = fields[3:] or [SORT_NAME, SORT_ASC, []]
+    except (ValueError, TypeError, KeyError):
+        raise InvalidCursorError(u'Invalid cursor: {}'.format(cursor))
+
+    if (not isinstance(index, int) or index < 0 or not isinstance(last_name, str) or
+            sort not in sort_list or not isinstance(sort_prefix, list)):
+        raise InvalidCursorError(u'Invalid cursor: {}'.format(cursor))
+
+    return generation, index, last_name, sort, order, tuple(sort_prefix)
+
+
+def get_listing_page(listing_order, cursor=None, limit=DEFAULT_LISTING_LIMIT):
+    """get_listing_page
+
+    Args:
+        listing_order (ListingOrder): current listing of the folder, in the requested
+            sort order, see DirListing.get_order()
+        cursor (str, optional): cursor of the page, None for the first one.
+            Defaults to None.
+        limit (int, optional): max number of items. Defaults to DEFAULT_LISTING_LIMIT.
+
+    Returns:
+        tuple: (start_idx, end_idx, next_cursor), next_cursor is None on the last page
+    """
+    dir_listing = listing_order.listing
+    order = SORT_DESC if listing_order.reverse else SORT_ASC
+
+    start_idx = 0
+    if cursor:
+        generation, index, last_name, sort, cursor_order, sort_prefix = decode_cursor(cursor)
+        if sort != listing_order.sort or cursor_order != order:
+            raise InvalidCursorError(
+                u'Cursor issued for sort={}&order={}'.format(sort, cursor_order))
+
+        if generation == dir_listing.generation:
+            start_idx = min(index, len(listing_order))
+        else:
+            try:
+                start_idx = listing_order.find_position_after(
+                    sort_prefix + get_name_sort_key(last_name))
+            except TypeError:
+                # a sort key of the wrong types
+                raise InvalidCursorError(u'Invalid cursor: {}'.format(cursor))
+
+    end_idx = min(start_idx + limit, len(listing_order))
+
+    next_cursor = None
+    if end_idx < len(listing_order):
+        last_item = listing_order[end_idx - 1]
+        next_cursor = encode_cursor(
+            dir_listing.generation, end_idx, last_item.name, listing_order.sort, order,
+            get_sort_prefix(last_item, listing_order.sort))
+
+    return start_idx, end_idx, next_cursor
+
+
+def get_item_dict(item, uri, folder_size=None):
+    """get_item_dict
+
+    Args:
+        item (DirItem): stat-ed folder item
+        uri (str): uri of the item
+        folder_size (FolderSize, optional): recursive size of a folder item,
+            None if unknown. Defaults to None.
+
+    Returns:
+        dict: JSON-serializable item info, folders also have total_size and
+            file_count, null while they are being computed
+    """
+    if item.is_dir:
+        item_type = 'dir'
+    elif item.is_file:
+        item_type = 'file'
+    else:
+        item_type = 'other'
+
+    item_dict = {
+        'name': item.name,
+        'type': item_type,
+        'file_type': item.file_type,
+        'size': item.size,
+        'mtime': item.mtime,
+        'uri': uri,
+    }
+
+    if item.is_dir:
+        item_dict['total_size'] = folder_size.total_size if folder_size is not None else None
+        item_dict['file_count'] = folder_size.file_count if folder_size is not None else None
+
+    return item_dict
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""
+logging off the IOLoop thread, and one structured access log line per request
+
+LogQueue puts the handlers of the root logger (the log file, or the queue to
+the supervisor with --workers) behind an in-process queue drained by a
+listener thread: a logging call on the IOLoop thread only appends the record
+to the queue. Messages are formatted by the listener thread too, so logging
+calls should pass their arguments lazily, logging.debug(u'x: %s', x), rather
+than formatting them first. The queue is bounded, records logged while it is
+full are dropped and counted rather than blocking the IOLoop.
+
+AccessLog replaces the access log of tornado (the log_function setting of the
+apps): one JSON line per request on the tornado.access logger, with the
+method, uri, status, route, duration and body bytes of the request. Requests
+answered with an error (status >= 400) are always logged, the others with a
+probability of sample_rate.
+
+author: zhaoyafei0210@gmail.com
+github: https://github.com/walkoncross/tornado-file-server
+"""
+
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import threading
+
+from .metrics import MeteredConnection
+
+
+DEFAULT_MAX_QUEUED_RECORDS = 100000
+
+access_logger = logging.getLogger('tornado.access')
+
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler neither formatting nor blocking in the logging thread
+    """
+
+    def __init__(self, record_queue, log_queue):
+        super(_NonBlockingQueueHandler, self).__init__(record_queue)
+        self.log_queue = log_queue
+
+    def prepare(self, record):
+        # formatted by the handlers, in the listener thread
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.log_queue.add_dropped()
+
+
+class _LogQueueListener(logging.handlers.QueueListener):
+
+    def enqueue_sentinel(self):
+        # blocking, the queue may be full on stop()
+        self.queue.put(self._sentinel)
+
+
+class LogQueue(object):
+    """Moves the handlers of the root logger behind a queue and a listener thread
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._handler = None
+        self._listener = None
+        self._handlers = []
+        self.max_records = 0
+        self.dropped = 0
+
+    def start(self, max_records=DEFAULT_MAX_QUEUED_RECORDS):
+        """start, in the serving process: the listener thread does not survive fork()
+
+        Args:
+            max_records (int, optional): max number of queued records.
+                Defaults to DEFAULT_MAX_QUEUED_RECORDS.
+        """
+        self.stop()
+
+        root_logger = logging.getLogger()
+        self._handlers = root_logger.handlers[:]
+        if not self._handlers:
+            return
+
+        record_queue = queue.Queue(max_records)
+        self._handler = _NonBlockingQueueHandler(record_queue, self)
+        self._listener = _LogQueueListener(
+            record_queue, *self._handlers, respect_handler_level=True)
+        self.max_records = max_records
+
+        for handler in self._handlers:
+            root_logger.removeHandler(handler)
+        root_logger.addHandler(self._handler)
+        self._listener.start()
+
+    def stop(self):
+        """write the queued records and give the handlers back to the root logger
+        """
+        if self._listener is None:
+            return
+
+        root_logger = logging.getLogger()
+        root_logger.removeHandler(self._handler)
+        self._listener.stop()
+        for handler in self._handlers:
+            root_logger.addHandler(handler)
+
+        self._handler = None
+        self._listener = None
+        self._handlers = []
+
+    def add_dropped(self):
+        with self._lock:
+            self.dropped += 1
+
+    def stats(self):
+        """stats
+
+        Returns:
+            dict: statistics
+        """
+        return {
+            'queued': self._handler.queue.qsize() if self._handler is not None else 0,
+            'max_queued': self.max_records,
+            'dropped': self.dropped,
+        }
+
+
+class AccessLogEntry(object):
+    """Fields of an access log line, turned into JSON when the line is written
+    """
+
+    __slots__ = ('fields',)
+
+    def __init__(self, fields):
+        self.fields = fields
+
+    def __str__(self):
+        return json.dumps(self.fields, ensure_ascii=False)
+
+
+class AccessLog(object):
+    """Structured, sampled access log, see log()
+    """
+
+    def __init__(self):
+        self.sample_rate = 1.0
+        self.logged = 0
+        self.sampled_out = 0
+
+    def configure(self, sample_rate=1.0):
+        """configure
+
+        Args:
+            sample_rate (float, optional): share of the successful requests to log,
+                0 to only log errors. Defaults to 1.0.
+        """
+        self.sample_rate = max(0.0, min(1.0, sample_rate))
+
+    def log(self, handler):
+        """log a finished request, the log_function of the apps
+
+        Args:
+            handler (tornado.web.RequestHandler): handler of the request
+        """
+        status = handler.get_status()
+        if status < 400:
+            level = logging.INFO
+        elif status < 500:
+            level = logging.WARNING
+        else:
+            level = logging.ERROR
+
+        if not access_logger.isEnabledFor(level):
+            return
+
+        if status < 400 and self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            self.sampled_out += 1
+            return
+
+        request = handler.request
+        fields = {
+            'method': request.method,
+            'uri': request.uri,
+            'status': status,
+            'duration_ms': round(request.request_time() * 1000.0, 2),
+            'remote_ip': request.remote_ip,
+        }
+
+        connection = request.connection
+        if isinstance(connection, MeteredConnection):
+            fields['route'] = connection.route
+            fields['bytes_sent'] = connection.bytes_sent
+            fields['bytes_received'] = connection.bytes_received
+
+        self.logged += 1
+        access_logger.log(level, u'%s', AccessLogEntry(fields))
+
+    def stats(self):
+        """stats
+
+        Returns:
+            dict: statistics
+        """
+        return {
+            'sample_rate': self.sample_rate,
+            'logged': self.logged,
+            'sampled_out': self.sampled_out,
+        }
+
+
+log_queue = LogQueue()
+access_log = AccessLog()
+
+
+def log_access(handler):
+    access_log.log(handler)
+
+
+def get_logging_stats():
+    """get_logging_stats
+
+    Returns:
+        dict: statistics of the log queue and the access log
+    """
+    stats = log_queue.stats()
+    stats.update(access_log.stats())
+
+    return stats
@@ -0,0 +1,461 @@
+# -*- coding: utf-8 -*-
+"""
+request, filesystem and IOLoop metrics, in Prometheus text format
+
+Per request, MetricsRouter wraps the HTTP connection in a MeteredConnection,
+which counts the body bytes received and sent, and MeteredApplication (one
+per route type: file, folder, upload, 404, service) records the status and
+latency when the handler finishes. A request whose client goes away first is
+recorded with code 499, as nginx does. Everything is plain attribute updates
+on the IOLoop thread, no extra callback or syscall per request.
+
+Filesystem stat/scandir calls on the request path go through timed_stat()
+and fs_timer(), which run in the io thread pool, so the histograms are
+locked. The background walkers (search index, folder sizes) report their own
+counts in the cache statistics, exported by the /_metrics handler.
+
+IOLoopLagMonitor measures how late a timer fires on the IOLoop, i.e. how
+long requests wait before the IOLoop gets to them.
+
+Metrics are per process: with --workers, each scrape is answered by one of
+the workers.
+
+author: zhaoyafei0210@gmail.com
+github: https://github.com/walkoncross/tornado-file-server
+"""
+
+import bisect
+import os
+import threading
+import time
+
+import tornado.ioloop
+import tornado.routing
+import tornado.web
+
+
+# seconds, from cached file hits to large downloads
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+FS_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001,
+              0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+LAG_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+ROUTE_FILE = 'file'
+ROUTE_FOLDER = 'folder'
+ROUTE_UPLOAD = 'upload'
+ROUTE_NOT_FOUND = '404'
+ROUTE_SERVICE = 'service'
+
+# status of the requests whose client closed the connection first
+CLIENT_CLOSED_STATUS = 499
+
+DEFAULT_LAG_INTERVAL = 0.5
+
+
+def format_labels(label_names, label_values):
+    if not label_names:
+        return u''
+
+    return u'{' + u','.join(
+        u'{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for name, value in zip(label_names, label_values)
+    ) + u'}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return u'+Inf'
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter(object):
+    """Monotonic counter, by label values
+    """
+
+    metric_type = 'counter'
+
+    def __init__(self, name, documentation, label_names=()):
+        """__init__
+
+        Args:
+            name (str): metric name
+            documentation (str): help text
+            label_names (tuple, optional): label names. Defaults to ().
+        """
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount=1, *label_values):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def get(self, *label_values):
+        with self._lock:
+            return self._values.get(label_values, 0)
+
+    def collect(self):
+        """collect
+
+        Returns:
+            list: (name suffix, label names, label values, value) of the samples
+        """
+        with self._lock:
+            values = sorted(self._values.items())
+
+        return [(u'', self.label_names, label_values, value) for label_values, value in values]
+
+
+class Gauge(Counter):
+    """Value that goes up and down, by label values
+    """
+
+    metric_type = 'gauge'
+
+    def dec(self, amount=1, *label_values):
+        self.inc(-amount, *label_values)
+
+    def set(self, value, *label_values):
+        with self._lock:
+            self._values[label_values] = value
+
+
+class Histogram(object):
+    """Cumulative histogram of observed values, by label values
+    """
+
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, buckets, label_names=()):
+        """__init__
+
+        Args:
+            name (str): metric name
+            documentation (str): help text
+            buckets (tuple): sorted upper bounds of the buckets, +Inf is added
+            label_names (tuple, optional): label names. Defaults to ().
+        """
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        # label values -> [bucket counts..., +Inf count, sum]
+        self._values = {}
+
+    def observe(self, value, *label_values):
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(label_values)
+            if counts is None:
+                counts = self._values[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[idx] += 1
+            counts[-1] += value
+
+    def get_count(self, *label_values):
+        with self._lock:
+            counts = self._values.get(label_values)
+            return sum(counts[:-1]) if counts is not None else 0
+
+    def collect(self):
+        """collect
+
+        Returns:
+            list: (name suffix, label names, label values, value) of the samples
+        """
+        with self._lock:
+            values = sorted((label_values, list(counts))
+                            for label_values, counts in self._values.items())
+
+        samples = []
+        bucket_label_names = self.label_names + ('le',)
+        for label_values, counts in values:
+            cumulative = 0
+            for upper_bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                samples.append((u'_bucket', bucket_label_names,
+                                label_values + (format_value(upper_bound),), cumulative))
+            samples.append((u'_sum', self.label_names, label_values, counts[-1]))
+            samples.append((u'_count', self.label_names, label_values, cumulative))
+
+        return samples
+
+
+class MetricsRegistry(object):
+    """The metrics of this process
+    """
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """render the metrics in Prometheus text format (version 0.0.4)
+
+        Returns:
+            str: the metrics
+        """
+        lines = []
+        for metric in self._metrics:
+            lines.append(u'# HELP {} {}'.format(metric.name, metric.documentation))
+            lines.append(u'# TYPE {} {}'.format(metric.name, metric.metric_type))
+            for suffix, label_names, label_values, value in metric.collect():
+                lines.append(u'{}{}{} {}'.format(
+                    metric.name, suffix, format_labels(label_names, label_values),
+                    format_value(value)))
+
+        return u'\n'.join(lines) + u'\n'
+
+
+registry = MetricsRegistry()
+
+requests_total = registry.register(Counter(
+    'tfs_requests_total', 'Finished requests, by route type and status code.',
+    ('route', 'code')))
+request_duration_seconds = registry.register(Histogram(
+    'tfs_request_duration_seconds',
+    'Time from the request headers to the end of the response, by route type.',
+    LATENCY_BUCKETS, ('route',)))
+requests_in_flight = registry.register(Gauge(
+    'tfs_requests_in_flight', 'Requests whose headers are received and response not finished.'))
+received_bytes_total = registry.register(Counter(
+    'tfs_received_bytes_total', 'Request body bytes received, by route type.', ('route',)))
+sent_bytes_total = registry.register(Counter(
+    'tfs_sent_bytes_total', 'Response body bytes sent, by route type.', ('route',)))
+fs_op_duration_seconds = registry.register(Histogram(
+    'tfs_fs_op_duration_seconds',
+    'Duration of the filesystem stat and scandir calls made to serve requests, by operation.',
+    FS_BUCKETS, ('op',)))
+ioloop_lag_seconds = registry.register(Histogram(
+    'tfs_ioloop_lag_seconds', 'Delay of IOLoop timers, i.e. time callbacks wait for the IOLoop.',
+    LAG_BUCKETS))
+ioloop_last_lag_seconds = registry.register(Gauge(
+    'tfs_ioloop_last_lag_seconds', 'Last measured IOLoop lag.'))
+
+
+def timed_stat(path):
+    """os.stat(), timed
+
+    Args:
+        path (str): path
+
+    Returns:
+        os.stat_result: stat result, raises OSError as os.stat()
+    """
+    time_start = time.perf_counter()
+    try:
+        return os.stat(path)
+    finally:
+        fs_op_duration_seconds.observe(time.perf_counter() - time_start, 'stat')
+
+
+class fs_timer(object):
+    """context manager timing a filesystem operation, e.g.
+
+        with fs_timer('scandir'):
+            ...
+    """
+
+    __slots__ = ('op', 'time_start')
+
+    def __init__(self, op):
+        self.op = op
+
+    def __enter__(self):
+        self.time_start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        fs_op_duration_seconds.observe(time.perf_counter() - self.time_start, self.op)
+
+
+class MeteredConnection(object):
+    """Proxy of the HTTP1Connection of one request, counting the body bytes
+    """
+
+    __slots__ = ('_connection', 'route', 'bytes_received', 'bytes_sent',
+                 'time_start', 'done')
+
+    def __init__(self, connection):
+        object.__setattr__(self, '_connection', connection)
+        self.route = ROUTE_NOT_FOUND
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.time_start = None
+        self.done = False
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def __setattr__(self, name, value):
+        # e.g. _expected_content_remaining, updated after a sendfile
+        if name in MeteredConnection.__slots__:
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._connection, name, value)
+
+    def write_headers(self, start_line, headers, chunk=None):
+        if chunk:
+            self.bytes_sent += len(chunk)
+        return self._connection.write_headers(start_line, headers, chunk)
+
+    def write(self, chunk):
+        self.bytes_sent += len(chunk)
+        return self._connection.write(chunk)
+
+    def set_close_callback(self, callback):
+        if callback is None:
+            self._connection.set_close_callback(None)
+            return
+
+        def on_close():
+            self.record(CLIENT_CLOSED_STATUS)
+            callback()
+
+        self._connection.set_close_callback(on_close)
+
+    def start(self):
+        self.time_start = time.perf_counter()
+        requests_in_flight.inc()
+
+    def record(self, status):
+        """record the request once, when the response is finished or the
+        client is gone
+
+        Args:
+            status (int): status code
+        """
+        if self.done or self.time_start is None:
+            return
+        self.done = True
+
+        requests_in_flight.dec()
+        requests_total.inc(1, self.route, status)
+        request_duration_seconds.observe(time.perf_counter() - self.time_start, self.route)
+        if self.bytes_received:
+            received_bytes_total.inc(self.bytes_received, self.route)
+        if self.bytes_sent:
+            sent_bytes_total.inc(self.bytes_sent, self.route)
+
+
+def add_sent_bytes(request, num_bytes):
+    """count bytes sent around the connection, e.g. with os.sendfile()
+
+    Args:
+        request (tornado.httputil.HTTPServerRequest): request
+        num_bytes (int): number of bytes sent
+    """
+    connection = request.connection
+    if isinstance(connection, MeteredConnection):
+        connection.bytes_sent += num_bytes
+
+
+class _MeteredDelegate(object):
+    """HTTPMessageDelegate wrapper, starts the metering of a request
+    """
+
+    __slots__ = ('_delegate', '_connection')
+
+    def __init__(self, delegate, connection):
+        self._delegate = delegate
+        self._connection = connection
+
+    def headers_received(self, start_line, headers):
+        self._connection.start()
+        return self._delegate.headers_received(start_line, headers)
+
+    def data_received(self, chunk):
+        self._connection.bytes_received += len(chunk)
+        return self._delegate.data_received(chunk)
+
+    def finish(self):
+        self._delegate.finish()
+
+    def on_connection_close(self):
+        # closed while the request body was being received
+        self._connection.record(CLIENT_CLOSED_STATUS)
+        self._delegate.on_connection_close()
+
+
+class MetricsRouter(tornado.routing.RuleRouter):
+    """RuleRouter metering each request, see MeteredApplication
+    """
+
+    def start_request(self, server_conn, request_conn):
+        connection = MeteredConnection(request_conn)
+        delegate = super(MetricsRouter, self).start_request(server_conn, connection)
+
+        return _MeteredDelegate(self.wrap_delegate(delegate), connection)
+
+    def wrap_delegate(self, delegate):
+        """wrap the routing delegate of a request, inside the metering, for subclasses
+
+        Args:
+            delegate (tornado.httputil.HTTPMessageDelegate): routing delegate
+
+        Returns:
+            tornado.httputil.HTTPMessageDelegate: the delegate to use
+        """
+        return delegate
+
+
+class MeteredApplication(tornado.web.Application):
+    """Application labelling its requests with a route type, and recording
+    them when their handler finishes
+
+    The route type is the metrics_route setting, ROUTE_NOT_FOUND by default.
+    """
+
+    def find_handler(self, request, **kwargs):
+        # called by the RuleRouter, Application.start_request() is not
+        connection = request.connection
+        if isinstance(connection, MeteredConnection):
+            connection.route = self.settings.get('metrics_route', ROUTE_NOT_FOUND)
+
+        return super(MeteredApplication, self).find_handler(request, **kwargs)
+
+    def log_request(self, handler):
+        connection = handler.request.connection
+        if isinstance(connection, MeteredConnection):
+            connection.record(handler.get_status())
+
+        super(MeteredApplication, self).log_request(handler)
+
+
+class IOLoopLagMonitor(object):
+    """Measure the IOLoop lag: how late a timer fires, every interval seconds
+    """
+
+    def __init__(self, interval=DEFAULT_LAG_INTERVAL):
+        """__init__
+
+        Args:
+            interval (float, optional): seconds between two measures.
+                Defaults to DEFAULT_LAG_INTERVAL.
+        """
+        self.interval = interval
+        self._io_loop = None
+        self._deadline = None
+
+    def start(self):
+        """start, on the IOLoop thread
+        """
+        self._io_loop = tornado.ioloop.IOLoop.current()
+        self._schedule()
+
+    def _schedule(self):
+        self._deadline = self._io_loop.time() + self.interval
+        self._io_loop.call_at(self._deadline, self._measure)
+
+    def _measure(self):
+        lag = max(0.0, self._io_loop.time() - self._deadline)
+        ioloop_lag_seconds.observe(lag)
+        ioloop_last_lag_seconds.set(lag)
+        self._schedule()
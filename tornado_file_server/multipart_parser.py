@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+incremental multipart/form-data parser
+
+tornado.httputil.parse_body_arguments() needs the whole request body in
+memory. StreamingMultipartParser is fed the body chunk by chunk (e.g. from
+RequestHandler.data_received) and only buffers a few KB at a time.
+
+author: zhaoyafei0210@gmail.com
+github: https://github.com/walkoncross/tornado-file-server
+"""
+
+import tornado.escape
+import tornado.httputil
+
+
+# events returned by StreamingMultipartParser.feed()
+PART_START = 'start'
+PART_DATA = 'data'
+PART_END = 'end'
+
+MAX_PART_HEADER_SIZE = 16 * 1024
+
+
+class MultipartError(ValueError):
+    """Malformed multipart body
+    """
+    pass
+
+
+class MultipartPart(object):
+    """Headers of one part of a multipart body
+    """
+
+    def __init__(self, headers):
+        """__init__
+
+        Args:
+            headers (tornado.httputil.HTTPHeaders): part headers
+        """
+        self.headers = headers
+
+        disposition, params = tornado.httputil._parse_header(
+            headers.get('Content-Disposition', ''))
+        if disposition != 'form-data':
+            raise MultipartError(u'Invalid Content-Disposition: {}'.format(disposition))
+
+        self.name = params.get('name')
+        self.filename = params.get('filename')
+        self.content_type = headers.get('Content-Type', 'application/unknown')
+
+
+def get_multipart_boundary(content_type):
+    """get the boundary of a multipart/form-data Content-Type header
+
+    Args:
+        content_type (str): Content-Type header
+
+    Returns:
+        bytes: boundary, None if content_type is not multipart/form-data
+    """
+    if not content_type or not content_type.startswith('multipart/form-data'):
+        return None
+
+    _, params = tornado.httputil._parse_header(content_type)
+    boundary = params.get('boundary')
+    if not boundary:
+        return None
+
+    # RFC 2046 allows quoted boundaries
+    if boundary.startswith('"') and boundary.endswith('"'):
+        boundary = boundary[1:-1]
+
+    return tornado.escape.utf8(boundary)
+
+
+class StreamingMultipartParser(object):
+    """Incremental multipart/form-data parser
+
+    feed() returns a list of events:
+        (PART_START, MultipartPart)
+        (PART_DATA, bytes)
+        (PART_END, None)
+    """
+
+    _STATE_PREAMBLE = 0
+    _STATE_HEADERS = 1
+    _STATE_BODY = 2
+    _STATE_DELIMITER_END = 3
+    _STATE_DONE = 4
+
+    def __init__(self, boundary):
+        """__init__
+
+        Args:
+            boundary (bytes): multipart boundary, see get_multipart_boundary()
+        """
+        self._first_delimiter = b'--' + boundary
+        self._delimiter = b'\r\n--' + boundary
+        self._buffer = b''
+        self._state = StreamingMultipartParser._STATE_PREAMBLE
+
+    @property
+    def is_done(self):
+        return self._state == StreamingMultipartParser._STATE_DONE
+
+    def feed(self, data):
+        """feed a chunk of the body
+
+        Args:
+            data (bytes): next chunk of the request body
+
+        Returns:
+            list: parsed events
+        """
+        cls = StreamingMultipartParser
+
+        events = []
+        buf = self._buffer + data if self._buffer else data
+
+        while True:
+            if self._state == cls._STATE_PREAMBLE:
+                idx = buf.find(self._first_delimiter)
+                if idx < 0:
+                    # keep a tail which may be the start of the delimiter
+                    buf = buf[-len(self._first_delimiter):]
+                    break
+                buf = buf[idx + len(self._first_delimiter):]
+                self._state = cls._STATE_DELIMITER_END
+
+            elif self._state == cls._STATE_DELIMITER_END:
+                if len(buf) < 2:
+                    break
+                if buf[:2] == b'--':
+                    self._state = cls._STATE_DONE
+                    buf = b''
+                    break
+                if buf[:2] != b'\r\n':
+                    raise MultipartError(u'Invalid multipart delimiter')
+                buf = buf[2:]
+                self._state = cls._STATE_HEADERS
+
+            elif self._state == cls._STATE_HEADERS:
+                idx = buf.find(b'\r\n\r\n')
+                if idx < 0:
+                    if len(buf) > MAX_PART_HEADER_SIZE:
+                        raise MultipartError(u'Multipart part headers too large')
+                    break
+                headers = tornado.httputil.HTTPHeaders.parse(
+                    buf[:idx].decode('utf-8'))
+                buf = buf[idx + 4:]
+                events.append((PART_START, MultipartPart(headers)))
+                self._state = cls._STATE_BODY
+
+            elif self._state == cls._STATE_BODY:
+                idx = buf.find(self._delimiter)
+                if idx < 0:
+                    # everything except a possible partial delimiter at the end
+                    safe_len = len(buf) - len(self._delimiter) + 1
+                    if safe_len > 0:
+                        events.append((PART_DATA, buf[:safe_len]))
+                        buf = buf[safe_len:]
+                    break
+                if idx > 0:
+                    events.append((PART_DATA, buf[:idx]))
+                events.append((PART_END, None))
+                buf = buf[idx + len(self._delimiter):]
+                self._state = cls._STATE_DELIMITER_END
+
+            else:
+                # epilogue after the closing delimiter is ignored
+                buf = b''
+                break
+
+        self._buffer = buf
+
+        return events
@@ -0,0 +1,389 @@
+# -*- coding: utf-8 -*-
+"""
+html pages of the file server, as precompiled tornado templates
+
+Each template is compiled to python code once per process, on first use, and
+a page is rendered in one pass into a list of chunks joined at the end,
+instead of growing a string fragment by fragment.
+
+Values are xhtml-escaped by {{ }} expressions. Item names, types and times
+are escaped and formatted once per cached folder listing entry (see
+get_item_cells()) and written with {% raw %}.
+
+author: zhaoyafei0210@gmail.com
+github: https://github.com/walkoncross/tornado-file-server
+"""
+
+import tornado.escape
+import tornado.template
+
+from .check_file_types import is_an_image, is_supported_audio, is_supported_video
+from .dir_scanner import format_file_mtime, format_file_size
+
+
+MEDIA_IMAGE = 'image'
+MEDIA_AUDIO = 'audio'
+MEDIA_VIDEO = 'video'
+
+
+base_template = u'''
+    <meta http-equiv="Content-Type" content="text/html;charset=ISO-8859-1">
+    <head>
+    <style>
+        h1, h2, h3, h4 {
+        font-family: arial, sans-serif;
+        }
+        table {
+        font-family: arial, sans-serif;
+        border-collapse: collapse;
+        width: 100%;
+        }
+        td, th {
+        border: 1px solid #dddddd;
+        text-align: left;
+        padding: 8px;
+        }
+        tr:nth-child(even) {
+        background-color: #dddddd;
+        }
+    </style>
+    </head>
+    <body>
+    {% block content %}{% end %}
+    <footer>
+    <p><a href="https://github.com/walkoncross/tornado-file-server">github repo</a></p>
+    </footer>
+    </body>
+'''
+
+search_form_template = u'''
+    <form action="{{ search_path }}" method="get">
+    <input type="text" name="q" value="{{ search_query }}" placeholder="file name">
+    <select name="mode">
+    {% for option in search_modes %}
+    <option value="{{ option }}"{% if option == search_mode %} selected{% end %}>{{ option }}</option>
+    {% end %}
+    </select>
+    <input type="hidden" name="in" value="{{ search_scope }}">
+    <button>Search</button>
+    </form>
+'''
+
+# resumable upload through the chunked upload api, see chunked_uploads.py
+upload_forms_template = u'''
+    <form method="post" enctype="multipart/form-data">
+    <div>
+        <label for="files">Choose and upload files: </label>
+        </br>
+        <input type="file" id="files" name="files" multiple>
+        </br>
+        <button>Upload</button>
+    </div>
+    </form>
+    <div>
+        <label for="chunked_files">Or upload large files in resumable chunks: </label>
+        </br>
+        <input type="file" id="chunked_files" multiple>
+        </br>
+        <button type="button" onclick="tfsChunkedUpload()">Upload in chunks</button>
+        <span id="chunked_upload_status"></span>
+    </div>
+    <script>
+    var TFS_CHUNK_SIZE = 8 * 1024 * 1024;
+    var TFS_PARALLEL_CHUNKS = 4;
+    var TFS_MAX_RETRIES = 5;
+
+    function tfsRequest(method, query, body) {
+        return fetch('?' + query, {method: method, body: body}).then(function (resp) {
+            if (!resp.ok) {
+                throw new Error(method + ' ?' + query + ': HTTP ' + resp.status);
+            }
+            return resp.json();
+        });
+    }
+
+    async function tfsUploadFile(file, setStatus) {
+        // remember the session, so the same file can be resumed after a failure
+        var key = 'tfs-upload:' + location.pathname + ':' + file.name + ':' +
+                  file.size + ':' + file.lastModified;
+        var upload = null;
+        var uploadId = localStorage.getItem(key);
+        if (uploadId) {
+            try {
+                upload = await tfsRequest('GET', 'upload_id=' + uploadId);
+            } catch (e) {
+                upload = null;
+            }
+        }
+        if (!upload) {
+            upload = await tfsRequest('POST', 'upload=create', JSON.stringify(
+                {filename: file.name, size: file.size, chunk_size: TFS_CHUNK_SIZE}));
+            localStorage.setItem(key, upload.upload_id);
+        }
+
+        var received = new Set(upload.received);
+        var pending = [];
+        for (var i = 0; i < upload.num_chunks; i++) {
+            if (!received.has(i)) {
+                pending.push(i);
+            }
+        }
+        var done = received.size;
+        setStatus(file.name + ': ' + done + '/' + upload.num_chunks + ' chunks');
+
+        async function worker() {
+            while (pending.length > 0) {
+                var index = pending.shift();
+                var start = index * upload.chunk_size;
+                var blob = file.slice(start, Math.min(start + upload.chunk_size, file.size));
+                for (var attempt = 1; ; attempt++) {
+                    try {
+                        await tfsRequest('PUT', 'upload_id=' + upload.upload_id +
+                                         '&chunk=' + index + '&offset=' + start, blob);
+                        break;
+                    } catch (e) {
+                        if (attempt >= TFS_MAX_RETRIES) {
+                            throw e;
+                        }
+                        await new Promise(function (r) { setTimeout(r, 1000 * attempt); });
+                    }
+                }
+                done++;
+                setStatus(file.name + ': ' + done + '/' + upload.num_chunks + ' chunks');
+            }
+        }
+
+        var workers = [];
+        for (var w = 0; w < TFS_PARALLEL_CHUNKS; w++) {
+            workers.push(worker());
+        }
+        await Promise.all(workers);
+
+        var result = await tfsRequest('POST', 'upload_id=' + upload.upload_id + '&action=finalize');
+        localStorage.removeItem(key);
+        return result;
+    }
+
+    async function tfsChunkedUpload() {
+        var files = document.getElementById('chunked_files').files;
+        var status = document.getElementById('chunked_upload_status');
+        var setStatus = function (text) { status.textContent = text; };
+        try {
+            for (var i = 0; i < files.length; i++) {
+                await tfsUploadFile(files[i], setStatus);
+            }
+            location.reload();
+        } catch (e) {
+            setStatus(e + ' (click upload again to resume)');
+        }
+    }
+    </script>
+'''
+
+# sort_uris: sort -> uri of the page sorted by it, see dir_scanner.sort_list
+folder_sort_template = u'''
+    <h4>Sort by:
+    {% for ii, (link_sort, label) in enumerate(sort_columns) %}
+    {% if ii %}|{% end %} <a href="{{ sort_uris[link_sort] }}">{{ label }}</a>{% if link_sort == sort %} {% raw '&uarr;' if order == 'asc' else '&darr;' %}{% end %}
+    {% end %}
+    </h4>
+'''
+
+folder_navi_template = u'''
+    {% if prev_uri %}<a href="{{ prev_uri }}">&lt;Prev</a>{% else %}&lt;Prev{% end %}
+    <a href="{{ parent_uri }}">Up</a>
+    {% if next_uri %}<a href="{{ next_uri }}">Next&gt;</a>{% else %}Next&gt;{% end %}
+'''
+
+# items are (uri, html_name, html_file_type, mtime, size, media, image_src) tuples,
+# all but media already escaped
+folder_list_table_template = u'''
+    <table style="width:100%;text-align: left">
+    <tr>
+    {% for link_sort, label in sort_columns %}
+    <th><a href="{{ sort_uris[link_sort] }}">{{ label }}</a></th>
+    {% end %}
+    </tr>
+    {% for uri, name, file_type, mtime, size, media, image_src in items %}
+    <tr>
+        <td><a href="{% raw uri %}">{% raw name %}</a></td>
+        <td>{% raw file_type %}</td>
+        <td>{% raw mtime %}</td>
+        <td>{% raw size %}</td>
+    </tr>
+    {% end %}
+    </table>
+'''
+
+folder_preview_table_template = u'''
+    <table style="width:100%;text-align: center">
+    {% for row_start in range(0, len(items), items_per_row) %}
+    <tr>
+    {% for uri, name, file_type, mtime, size, media, image_src in items[row_start:row_start + items_per_row] %}
+        <td>
+        {% if media == 'image' %}
+            <a href="{% raw uri %}"><img src="{% raw image_src %}" width="{{ image_width }}"></a>
+            <a href="{% raw uri %}">{% raw name %}</a>
+            <br/>
+        {% elif media == 'audio' %}
+            <audio controls>
+                <source src="{% raw uri %}">
+                Your browser does not support the audio tag.
+            </audio>
+            <br/>
+            <a href="{% raw uri %}">{% raw name %}</a>
+        {% elif media == 'video' %}
+            <video width="{{ image_width }}" controls>
+                <source src="{% raw uri %}">
+                Your browser does not support the video tag.
+            </video>
+            <br/>
+            <a href="{% raw uri %}">{% raw name %}</a>
+        {% else %}
+            <a href="{% raw uri %}">{% raw name %}</a><br/>
+        {% end %}
+            <p>
+            Type: {% raw file_type %}<br/>
+            Modified:{% raw mtime %}<br/>
+            Size: {% raw size %}
+            </p>
+        </td>
+    {% end %}
+    </tr>
+    {% end %}
+    </table>
+'''
+
+folder_template = u'''{% extends "base.html" %}
+{% block content %}
+    <header>
+    <h1>Directory: {{ dir_path }}</h1>
+    </header>
+    <nav>
+    <h4><a href="{{ parent_uri }}">Go to Parent Dir</a></h4>
+    </nav>
+    <h4>View Mode: {{ view_mode }} mode (swith to <a href="{{ switch_mode_uri }}">{{ switch_mode }}</a> mode)</h4>
+    <h4>Download this folder: <a href="{{ folder_uri }}?download=zip">zip</a>
+    | <a href="{{ folder_uri }}?download=zip-deflate">zip (compressed)</a>
+    | <a href="{{ folder_uri }}?download=tar">tar</a> (resumable)</h4>
+    {% if search_path %}{% include "search_form.html" %}{% end %}
+    {% include "upload_forms.html" %}
+    {% if not items %}
+    <h4>Nothing under this directory</h4>
+    {% else %}
+    <h4>{{ total_cnt }} items in total, {{ total_cnt - sub_folder_cnt }} files, {{ sub_folder_cnt }} folders</h4>
+    <h4>show {{ items_per_page }} items per page, {{ max_page_id }} pages</h4>
+    {% include "folder_sort.html" %}
+    {% include "folder_navi.html" %}
+    {% if view_mode == 'preview' %}
+    {% include "folder_preview_table.html" %}
+    {% else %}
+    {% include "folder_list_table.html" %}
+    {% end %}
+    {% if len(items) >= 10 %}{% include "folder_navi.html" %}{% end %}
+    {% end %}
+{% end %}
+'''
+
+# results are (uri, path) tuples
+search_template = u'''{% extends "base.html" %}
+{% block content %}
+    <header>
+    <h1>Search: {{ search_query }}</h1>
+    <h4>in <a href="{{ scope_uri }}">{{ search_scope }}</a>, {{ len(results) }} results{% if truncated %} (more not shown){% end %}</h4>
+    </header>
+    {% include "search_form.html" %}
+    <ul>
+    {% for uri, path in results %}
+    <li><a href="{{ uri }}">{{ path }}</a></li>
+    {% end %}
+    </ul>
+{% end %}
+'''
+
+# uploaded_files are (filename, save_filename) tuples
+upload_done_template = u'''
+    <p><a href="{{ folder_uri }}">Back</a></p>
+    <h4>OK</h4>
+    {% for filename, save_filename in uploaded_files %}
+    <p><em>{{ filename }}</em> saved into: <em>{{ save_filename }}</em></p>
+    {% end %}
+'''
+
+# (sort, label) of the columns of the list table
+sort_columns = [
+    ('name', u'Name'),
+    ('type', u'Type'),
+    ('mtime', u'Modified Time'),
+    ('size', u'File Size'),
+]
+
+template_loader = tornado.template.DictLoader({
+    'base.html': base_template,
+    'search_form.html': search_form_template,
+    'upload_forms.html': upload_forms_template,
+    'folder_sort.html': folder_sort_template,
+    'folder_navi.html': folder_navi_template,
+    'folder_list_table.html': folder_list_table_template,
+    'folder_preview_table.html': folder_preview_table_template,
+    'folder.html': folder_template,
+    'search.html': search_template,
+    'upload_done.html': upload_done_template,
+})
+
+
+def render_page(name, **kwargs):
+    """render a page, may be called from any thread
+
+    Args:
+        name (str): template name, e.g. 'folder.html'
+        kwargs: template arguments
+
+    Returns:
+        bytes: the utf-8 encoded page
+    """
+    # the loader compiles a template once and keeps it
+    return template_loader.load(name).generate(**kwargs)
+
+
+def get_media_kind(name):
+    """get_media_kind
+
+    Args:
+        name (str): file name
+
+    Returns:
+        str: MEDIA_IMAGE, MEDIA_AUDIO, MEDIA_VIDEO, or None for other files
+    """
+    if is_an_image(name):
+        return MEDIA_IMAGE
+    elif is_supported_audio(name):
+        return MEDIA_AUDIO
+    elif is_supported_video(name):
+        return MEDIA_VIDEO
+
+    return None
+
+
+def get_item_cells(item):
+    """get the escaped and formatted display cells of a stat-ed DirItem,
+    computed once and kept on the item until its stat changes
+
+    Args:
+        item (DirItem): folder listing item
+
+    Returns:
+        tuple: (html_file_type, mtime, size, media), size is None for folders
+            whose recursive size is looked up per request
+    """
+    cells = item.html_cells
+    if cells is None:
+        cells = (
+            tornado.escape.xhtml_escape(item.file_type),
+            format_file_mtime(item.mtime),
+            None if item.is_dir else format_file_size(item.size),
+            None if item.is_dir else get_media_kind(item.name),
+        )
+        item.html_cells = cells
+
+    return cells
@@ -0,0 +1,413 @@
+# -*- coding: utf-8 -*-
+"""
+resolve request paths to local paths, once per request
+
+The router matchers and the handlers all need the local path of the request
+and its type. PathResolver resolves, normalizes and stats it once, and
+attaches the result to the request as `request.resolved_path`, so the
+downstream handler can reuse it.
+
+PathResolvingRouter (see tornado_file_server.py) calls preresolve() in the io
+thread pool before routing a request whose type is not cached, so that the
+matchers find its type without a syscall on the IOLoop thread.
+
+The types of recently resolved paths are cached for a short time, positive
+and negative (missing paths, e.g. from scanners probing for /wp-login.php)
+results separately, so repeated requests cost no syscall at all. Only the
+type is cached: a stat result is only handed to a handler when it was taken
+for this request. The filesystem watcher, when there is one, invalidates
+cached types as soon as entries are added or removed.
+
+author: zhaoyafei0210@gmail.com
+github: https://github.com/walkoncross/tornado-file-server
+"""
+
+import os
+import os.path as osp
+import stat
+import threading
+import time
+from collections import OrderedDict
+
+import tornado.escape
+
+from .dir_listing_cache import dir_listing_cache
+from .fs_watcher import CHANGE_ENTRY, CHANGE_DIR
+from .metrics import timed_stat
+from .python_version import is_python3
+
+
+if is_python3():
+    from builtins import str as unicode
+
+
+PATH_FILE = 'file'
+PATH_DIR = 'dir'
+PATH_OTHER = 'other'
+PATH_MISSING = 'missing'
+# outside of the root dir, e.g. through "/../"
+PATH_FORBIDDEN = 'forbidden'
+
+DEFAULT_TTL = 1.0
+DEFAULT_NEGATIVE_TTL = 5.0
+DEFAULT_MAX_ENTRIES = 64 * 1024
+
+
+def get_full_local_path_for_url(uri_path, root_dir=None):
+    """Get full local path for url_path
+
+    Args:
+        uri_path (str): uri path
+        root_dir (str, optional): local root dir. Defaults to None.
+
+    Returns:
+        str: full local path
+    """
+    if not root_dir:
+        root_dir = unicode(os.getcwd())
+
+    if not isinstance(root_dir, unicode):
+        raise(AssertionError(
+            "In get_full_local_path_for_url: root_dir must be Unicode"))
+
+    if uri_path == '/':
+        full_local_path = root_dir
+    else:
+        local_path = tornado.escape.url_unescape(uri_path, plus=False)
+        # print('type(local_path): ', type(local_path))
+        # print(local_path)
+        # full_local_path = osp.join(root_dir, local_path) # Error: osp.join('/working/path/', '/static_file') = /static_file
+        full_local_path = root_dir + local_path
+
+    return full_local_path
+
+
+def is_local_path_under_root(full_local_path, root_dir):
+    """check that a local path does not escape root_dir (e.g. through "/../")
+
+    Args:
+        full_local_path (str): normalized full local path
+        root_dir (str): local root dir
+
+    Returns:
+        bool: whether full_local_path is root_dir or below it
+    """
+    root_dir = osp.normpath(root_dir)
+    return (full_local_path == root_dir or
+            full_local_path.startswith(root_dir.rstrip(os.sep) + os.sep))
+
+
+def get_path_type(st_mode):
+    """get_path_type
+
+    Args:
+        st_mode (int): st_mode of a (followed) stat result
+
+    Returns:
+        str: PATH_FILE, PATH_DIR or PATH_OTHER
+    """
+    if stat.S_ISREG(st_mode):
+        return PATH_FILE
+    elif stat.S_ISDIR(st_mode):
+        return PATH_DIR
+    else:
+        return PATH_OTHER
+
+
+class ResolvedPath(object):
+    """Local path of a request and its type
+    """
+
+    __slots__ = ('full_local_path', 'path_type', 'stat')
+
+    def __init__(self, full_local_path, path_type, st=None):
+        """__init__
+
+        Args:
+            full_local_path (str): absolute, normalized local path
+            path_type (str): one of PATH_FILE, PATH_DIR, PATH_OTHER, PATH_MISSING, PATH_FORBIDDEN
+            st (os.stat_result, optional): stat taken while resolving this request,
+                None if the type came from a cache. Defaults to None.
+        """
+        self.full_local_path = full_local_path
+        self.path_type = path_type
+        self.stat = st
+
+
+class PathResolver(object):
+    """Resolve local paths, with a short-TTL cache of their types
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL, negative_ttl=DEFAULT_NEGATIVE_TTL,
+                 max_entries=DEFAULT_MAX_ENTRIES):
+        """__init__
+
+        Args:
+            ttl (float, optional): seconds the type of an existing path is cached.
+                Defaults to DEFAULT_TTL.
+            negative_ttl (float, optional): seconds a missing path is cached.
+                Defaults to DEFAULT_NEGATIVE_TTL.
+            max_entries (int, optional): max number of cached paths.
+                Defaults to DEFAULT_MAX_ENTRIES.
+        """
+        self._lock = threading.Lock()
+        # full_local_path -> (path_type, expire_time)
+        self._types = OrderedDict()
+        # parent folder -> set of cached paths in it, for watcher invalidation
+        self._children = {}
+
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+
+        self.hits = 0
+        self.misses = 0
+
+        # full_local_path -> ResolvedPath, see use_preresolved()
+        self._preresolved = None
+
+    def configure(self, ttl=None, negative_ttl=None, max_entries=None):
+        """configure
+
+        Args:
+            see __init__, None keeps the current value
+        """
+        with self._lock:
+            if ttl is not None:
+                self.ttl = ttl
+            if negative_ttl is not None:
+                self.negative_ttl = negative_ttl
+            if max_entries is not None:
+                self.max_entries = max_entries
+            self._types.clear()
+            self._children.clear()
+
+    def set_watcher(self, watcher):
+        """invalidate cached types on filesystem changes
+
+        Args:
+            watcher (FSWatcher): watcher, None to rely on the TTLs only
+        """
+        if watcher is not None:
+            watcher.add_listener(self.on_fs_change)
+
+    def resolve_request(self, request, root_dir):
+        """resolve the local path of a request, once per request
+
+        Args:
+            request (tornado.httputil.HTTPServerRequest): the request
+            root_dir (str): local root dir
+
+        Returns:
+            ResolvedPath: resolved path, also attached as request.resolved_path
+        """
+        resolved = getattr(request, 'resolved_path', None)
+        if resolved is None:
+            resolved = self.resolve(
+                get_full_local_path_for_url(request.path, root_dir), root_dir)
+            request.resolved_path = resolved
+
+        return resolved
+
+    def lookup(self, full_local_path, root_dir, count_hit=True):
+        """resolve a local path without any syscall, if possible
+
+        Args:
+            full_local_path (str): absolute, normalized local path
+            root_dir (str): local root dir, paths outside of it are PATH_FORBIDDEN
+            count_hit (bool, optional): count a cache hit in the stats. Defaults to True.
+
+        Returns:
+            ResolvedPath: resolved path, None if it needs a stat()
+        """
+        if not is_local_path_under_root(full_local_path, osp.abspath(root_dir)):
+            return ResolvedPath(full_local_path, PATH_FORBIDDEN)
+
+        preresolved = self._preresolved
+        if preresolved is not None and full_local_path in preresolved:
+            return preresolved[full_local_path]
+
+        now = time.time()
+        with self._lock:
+            cached = self._types.get(full_local_path)
+            if cached is not None and cached[1] > now:
+                if count_hit:
+                    self.hits += 1
+                return ResolvedPath(full_local_path, cached[0])
+
+        # syscall-free when the parent folder is watched and cached
+        path_type = dir_listing_cache.lookup_path_type(full_local_path)
+        if path_type is not None:
+            return ResolvedPath(full_local_path, path_type)
+
+        return None
+
+    def get_request_paths(self, uri_path, root_dir, with_parent=False):
+        """get_request_paths
+
+        Args:
+            uri_path (str): path of a request uri, without the query
+            root_dir (str): local root dir
+            with_parent (bool, optional): also the parent folder, e.g. for uploads.
+                Defaults to False.
+
+        Returns:
+            list: the full local paths the router resolves for the request
+        """
+        full_local_path = osp.abspath(get_full_local_path_for_url(uri_path, root_dir))
+        if with_parent:
+            return [full_local_path, osp.dirname(full_local_path)]
+
+        return [full_local_path]
+
+    def needs_stat(self, full_local_paths, root_dir):
+        """needs_stat, never blocks
+
+        Args:
+            full_local_paths (list): absolute, normalized local paths
+            root_dir (str): local root dir
+
+        Returns:
+            bool: whether resolving any of the paths would stat() it
+        """
+        return any(self.lookup(path, root_dir, count_hit=False) is None
+                   for path in full_local_paths)
+
+    def preresolve(self, full_local_paths, root_dir):
+        """resolve local paths, blocking: runs in the io thread pool
+
+        Args:
+            full_local_paths (list): absolute, normalized local paths
+            root_dir (str): local root dir
+
+        Returns:
+            dict: full local path -> ResolvedPath, see use_preresolved()
+        """
+        return dict((path, self.resolve(path, root_dir)) for path in full_local_paths)
+
+    def use_preresolved(self, preresolved):
+        """make resolve() return paths resolved by preresolve(), for the
+        synchronous routing of one request on the IOLoop thread
+
+        Args:
+            preresolved (dict): see preresolve(), None when routing is done
+        """
+        self._preresolved = preresolved
+
+    def resolve(self, local_path, root_dir):
+        """resolve a local path
+
+        Args:
+            local_path (str): local path, not normalized
+            root_dir (str): local root dir, paths outside of it are PATH_FORBIDDEN
+
+        Returns:
+            ResolvedPath: resolved path
+        """
+        full_local_path = osp.abspath(local_path)
+
+        resolved = self.lookup(full_local_path, root_dir)
+        if resolved is not None:
+            return resolved
+
+        now = time.time()
+        with self._lock:
+            self.misses += 1
+
+        try:
+            st = timed_stat(full_local_path)
+        except (OSError, ValueError):
+            # ValueError: embedded null byte
+            st = None
+
+        if st is None:
+            path_type = PATH_MISSING
+            expire_time = now + self.negative_ttl
+        else:
+            path_type = get_path_type(st.st_mode)
+            expire_time = now + self.ttl
+
+        self._put(full_local_path, path_type, expire_time)
+
+        return ResolvedPath(full_local_path, path_type, st)
+
+    def _put(self, full_local_path, path_type, expire_time):
+        with self._lock:
+            if full_local_path in self._types:
+                self._types.move_to_end(full_local_path)
+            else:
+                parent_path = osp.dirname(full_local_path)
+                self._children.setdefault(parent_path, set()).add(full_local_path)
+            self._types[full_local_path] = (path_type, expire_time)
+
+            while len(self._types) > self.max_entries:
+                old_path, _ = self._types.popitem(last=False)
+                self._forget_child(old_path)
+
+    def _forget_child(self, full_local_path):
+        parent_path = osp.dirname(full_local_path)
+        children = self._children.get(parent_path)
+        if children is not None:
+            children.discard(full_local_path)
+            if not children:
+                del self._children[parent_path]
+
+    def invalidate(self, full_local_path):
+        """forget the cached type of a path, e.g. after an upload created it
+
+        Args:
+            full_local_path (str): absolute, normalized local path
+        """
+        with self._lock:
+            if self._types.pop(full_local_path, None) is not None:
+                self._forget_child(full_local_path)
+
+    def invalidate_children(self, dir_path):
+        """forget the cached types of all the entries of a folder
+
+        Args:
+            dir_path (str): absolute, normalized local path of the folder
+        """
+        with self._lock:
+            for full_local_path in self._children.pop(dir_path, ()):
+                self._types.pop(full_local_path, None)
+
+    def clear(self):
+        with self._lock:
+            self._types.clear()
+            self._children.clear()
+
+    def on_fs_change(self, kind, path, name=None):
+        """watcher listener, see fs_watcher.py
+
+        Args:
+            kind (str): one of CHANGE_ENTRY, CHANGE_DIR, CHANGE_TREE, CHANGE_ALL
+            path (str): folder path
+            name (str, optional): entry name for CHANGE_ENTRY. Defaults to None.
+        """
+        if kind == CHANGE_ENTRY:
+            self.invalidate(osp.join(path, name))
+        elif kind == CHANGE_DIR:
+            self.invalidate_children(path)
+        else:
+            # CHANGE_TREE is rare, not worth indexing whole subtrees
+            self.clear()
+
+    def stats(self):
+        """stats
+
+        Returns:
+            dict: cache statistics
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._types),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': float(self.hits) / lookups if lookups else 0.0,
+            }
+
+
+path_resolver = PathResolver()
@@ -0,0 +1,369 @@
+# -*- coding: utf-8 -*-
+"""
+bandwidth and concurrency limits of downloads
+
+A few clients pulling large files can saturate the network link and slow
+down everybody else's pages. DownloadLimiter bounds:
+- the bandwidth of each client (by ip) and of all clients together, with
+  token buckets: the sending loops call DownloadSlot.throttle() before each
+  chunk and sleep on the IOLoop when a bucket runs out of tokens;
+- the number of concurrent downloads (responses of at least
+  MIN_LIMITED_DOWNLOAD_SIZE bytes) of each client and of all clients.
+
+A download over a concurrency limit, or which would first wait more than
+MAX_THROTTLE_DELAY seconds for bandwidth, is rejected right away: 429 Too
+Many Requests for a per-client limit, 503 Service Unavailable for a global
+one, with a Retry-After header. Smaller responses (pages, thumbnails) are
+never rejected, only throttled.
+
+Everything runs on the IOLoop thread, and limits apply per server process.
+
+author: zhaoyafei0210@gmail.com
+github: https://github.com/walkoncross/tornado-file-server
+"""
+
+import math
+
+import tornado.gen
+import tornado.ioloop
+
+
+# smaller responses don't count as downloads for the concurrency limits
+MIN_LIMITED_DOWNLOAD_SIZE = 1024 * 1024
+# a download which would wait longer than this for bandwidth is rejected
+MAX_THROTTLE_DELAY = 30.0
+# Retry-After of the downloads rejected by a concurrency limit
+CONCURRENCY_RETRY_AFTER = 5
+# seconds of bandwidth a bucket can accumulate
+BURST_SECONDS = 1.0
+
+MIN_SEND_CHUNK_SIZE = 16 * 1024
+MAX_SEND_CHUNK_SIZE = 1024 * 1024
+
+
+class DownloadLimitError(Exception):
+    """A download rejected by a limit
+    """
+
+    def __init__(self, status_code, retry_after, reason):
+        """__init__
+
+        Args:
+            status_code (int): 429 for a per-client limit, 503 for a global one
+            retry_after (int): seconds, for the Retry-After header
+            reason (str): which limit
+        """
+        super(DownloadLimitError, self).__init__(reason)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class TokenBucket(object):
+    """Token bucket of `rate` bytes per second, holding up to `burst` bytes
+
+    Tokens are reserved ahead: consume() may take the bucket below zero and
+    returns how long the caller has to wait, so that concurrent senders are
+    served in the order they asked.
+    """
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst, now):
+        """__init__
+
+        Args:
+            rate (float): bytes per second
+            burst (float): max number of tokens
+            now (float): current IOLoop time
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def get_delay(self, now):
+        """get_delay
+
+        Args:
+            now (float): current IOLoop time
+
+        Returns:
+            float: seconds until the bucket is out of debt
+        """
+        self.refill(now)
+
+        return max(0.0, -self.tokens / self.rate)
+
+    def consume(self, num_bytes, now):
+        """reserve num_bytes tokens
+
+        Args:
+            num_bytes (int): number of bytes to send
+            now (float): current IOLoop time
+
+        Returns:
+            float: seconds to wait before sending them
+        """
+        self.refill(now)
+        self.tokens -= num_bytes
+
+        return max(0.0, -self.tokens / self.rate)
+
+
+class _ClientState(object):
+
+    __slots__ = ('bucket', 'downloads', 'slots')
+
+    def __init__(self):
+        self.bucket = None
+        self.downloads = 0
+        self.slots = 0
+
+
+class DownloadSlot(object):
+    """One response sent under the limits, release() it when done
+    """
+
+    __slots__ = ('limiter', 'client', 'counted', 'released')
+
+    def __init__(self, limiter, client, counted):
+        """__init__
+
+        Args:
+            limiter (DownloadLimiter): limiter
+            client (str): client ip
+            counted (bool): whether it counts as a download for the concurrency limits
+        """
+        self.limiter = limiter
+        self.client = client
+        self.counted = counted
+        self.released = False
+
+    def get_send_chunk_size(self, default_size):
+        """get_send_chunk_size
+
+        Args:
+            default_size (int): chunk size without bandwidth limit
+
+        Returns:
+            int: size of the chunks to send, about a tenth of a second of the
+                lowest bandwidth limit
+        """
+        rate = self.limiter.get_lowest_rate()
+        if rate is None:
+            return default_size
+
+        return int(min(default_size, max(MIN_SEND_CHUNK_SIZE, min(MAX_SEND_CHUNK_SIZE, rate / 10))))
+
+    async def throttle(self, num_bytes):
+        """wait until num_bytes can be sent within the bandwidth limits
+
+        Args:
+            num_bytes (int): number of bytes about to be sent
+        """
+        delay = self.limiter.consume(self.client, num_bytes)
+        if delay > 0:
+            await tornado.gen.sleep(delay)
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.limiter.release(self)
+
+
+class DownloadLimiter(object):
+    """Bandwidth and concurrency limits of the downloads, see the module docstring
+    """
+
+    def __init__(self):
+        self.client_rate = 0
+        self.global_rate = 0
+        self.max_client_downloads = 0
+        self.max_downloads = 0
+
+        self._clients = {}
+        self._global_bucket = None
+        self.downloads = 0
+
+        self.rejected_429 = 0
+        self.rejected_503 = 0
+        self.throttled_seconds = 0.0
+        self.bytes_sent = 0
+
+    def configure(self, client_rate=0, global_rate=0, max_client_downloads=0, max_downloads=0):
+        """configure, 0 means no limit
+
+        Args:
+            client_rate (float, optional): bytes per second of each client. Defaults to 0.
+            global_rate (float, optional): bytes per second of all clients. Defaults to 0.
+            max_client_downloads (int, optional): concurrent downloads of each client.
+                Defaults to 0.
+            max_downloads (int, optional): concurrent downloads of all clients. Defaults to 0.
+        """
+        self.client_rate = client_rate
+        self.global_rate = global_rate
+        self.max_client_downloads = max_client_downloads
+        self.max_downloads = max_downloads
+
+        self._global_bucket = None
+        for state in self._clients.values():
+            state.bucket = None
+
+    @property
+    def enabled(self):
+        return bool(self.client_rate or self.global_rate or
+                    self.max_client_downloads or self.max_downloads)
+
+    def get_lowest_rate(self):
+        """get_lowest_rate
+
+        Returns:
+            float: the lowest bandwidth limit in bytes per second, None if none
+        """
+        rates = [rate for rate in (self.client_rate, self.global_rate) if rate]
+
+        return min(rates) if rates else None
+
+    def acquire(self, client, content_length):
+        """get a slot to send a response, or reject it
+
+        Args:
+            client (str): client ip
+            content_length (int): number of bytes to send, None if unknown
+
+        Raises:
+            DownloadLimitError: if over a limit
+
+        Returns:
+            DownloadSlot: the slot, None without any limit
+        """
+        if not self.enabled:
+            return None
+
+        counted = content_length is None or content_length >= MIN_LIMITED_DOWNLOAD_SIZE
+        state = self._clients.get(client)
+
+        if counted:
+            now = tornado.ioloop.IOLoop.current().time()
+
+            client_downloads = state.downloads if state is not None else 0
+            if self.max_client_downloads and client_downloads >= self.max_client_downloads:
+                self.rejected_429 += 1
+                raise DownloadLimitError(429, CONCURRENCY_RETRY_AFTER, u'Too many downloads')
+
+            if self.max_downloads and self.downloads >= self.max_downloads:
+                self.rejected_503 += 1
+                raise DownloadLimitError(503, CONCURRENCY_RETRY_AFTER, u'Server busy')
+
+            if state is not None and state.bucket is not None:
+                delay = state.bucket.get_delay(now)
+                if delay > MAX_THROTTLE_DELAY:
+                    self.rejected_429 += 1
+                    raise DownloadLimitError(429, int(math.ceil(delay)), u'Bandwidth limit')
+
+            if self._global_bucket is not None:
+                delay = self._global_bucket.get_delay(now)
+                if delay > MAX_THROTTLE_DELAY:
+                    self.rejected_503 += 1
+                    raise DownloadLimitError(503, int(math.ceil(delay)), u'Server busy')
+
+        if state is None:
+            state = self._clients[client] = _ClientState()
+
+        state.slots += 1
+        if counted:
+            state.downloads += 1
+            self.downloads += 1
+
+        return DownloadSlot(self, client, counted)
+
+    def release(self, slot):
+        state = self._clients.get(slot.client)
+        if state is None:
+            return
+
+        state.slots -= 1
+        if slot.counted:
+            state.downloads -= 1
+            self.downloads -= 1
+
+        # a client's bucket is dropped with its last response, at most one
+        # burst of extra bandwidth for the next one
+        if state.slots <= 0:
+            del self._clients[slot.client]
+
+    def consume(self, client, num_bytes):
+        """reserve num_bytes of bandwidth for a client
+
+        Args:
+            client (str): client ip
+            num_bytes (int): number of bytes about to be sent
+
+        Returns:
+            float: seconds to wait before sending them
+        """
+        now = tornado.ioloop.IOLoop.current().time()
+        delay = 0.0
+
+        if self.client_rate:
+            state = self._clients.get(client)
+            if state is not None:
+                if state.bucket is None:
+                    state.bucket = TokenBucket(
+                        self.client_rate, self.client_rate * BURST_SECONDS, now)
+                delay = state.bucket.consume(num_bytes, now)
+
+        if self.global_rate:
+            if self._global_bucket is None:
+                self._global_bucket = TokenBucket(
+                    self.global_rate, self.global_rate * BURST_SECONDS, now)
+            delay = max(delay, self._global_bucket.consume(num_bytes, now))
+
+        self.bytes_sent += num_bytes
+        self.throttled_seconds += delay
+
+        return delay
+
+    def stats(self):
+        """stats
+
+        Returns:
+            dict: limits and current state, clients maps the ip of each client
+                being sent something to its number of downloads
+        """
+        return {
+            'client_rate': self.client_rate,
+            'global_rate': self.global_rate,
+            'max_client_downloads': self.max_client_downloads,
+            'max_downloads': self.max_downloads,
+            'downloads': self.downloads,
+            'clients': dict(
+                (client, state.downloads) for client, state in self._clients.items()),
+            'rejected_429': self.rejected_429,
+            'rejected_503': self.rejected_503,
+            'throttled_seconds': self.throttled_seconds,
+            'bytes_sent': self.bytes_sent,
+        }
+
+
+download_limiter = DownloadLimiter()
+
+
+def write_limit_error(handler, error):
+    """answer a request rejected by a limit
+
+    Args:
+        handler (tornado.web.RequestHandler): handler of the request
+        error (DownloadLimitError): the rejection
+    """
+    # drop the headers of the response it would have been
+    handler.clear()
+    handler.set_status(error.status_code)
+    handler.set_header('Retry-After', str(error.retry_after))
+    handler.set_header('Content-Type', 'text/plain; charset=UTF-8')
+    handler.finish(error.reason + u'\n')
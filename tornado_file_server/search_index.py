@@ -0,0 +1,597 @@
+# -*- coding: utf-8 -*-
+"""
+in-memory index of every path under the root dir, for filename search
+
+The index is built at startup by walking the tree with a thread pool, and
+kept up to date by a filesystem watcher of the whole tree (see fs_watcher.py,
+not the one of the listing cache, which unwatches the folders it evicts): folders
+reported as changed are rescanned, in batches, and their added/removed
+entries applied to the index.
+
+Paths are stored as two big strings, one path per line: the paths as they
+are, and lowercased for case-insensitive matching. A query is compiled into
+one regular expression run over the lowercased string, so matching millions
+of paths is a C loop, not a Python one. Paths added since the last build go
+into a small delta segment, removed ones are tombstoned; both are merged
+into a new base segment once they grow too large.
+
+Names are matched by prefix, substring or glob pattern; a glob with a "/"
+is matched against the whole path from the root dir ("**" matches across
+folders).
+
+author: zhaoyafei0210@gmail.com
+github: https://github.com/walkoncross/tornado-file-server
+"""
+
+import bisect
+import logging
+import os
+import os.path as osp
+import re
+import threading
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import tornado.ioloop
+
+from .chunked_uploads import is_session_file
+from .fs_watcher import CHANGE_DIR, CHANGE_TREE, CHANGE_ALL
+from .io_executor import run_in_io_executor
+
+
+SEARCH_PREFIX = 'prefix'
+SEARCH_SUBSTRING = 'substring'
+SEARCH_GLOB = 'glob'
+
+search_mode_list = [SEARCH_SUBSTRING, SEARCH_PREFIX, SEARCH_GLOB]
+
+DEFAULT_SEARCH_LIMIT = 100
+MAX_SEARCH_LIMIT = 1000
+DEFAULT_WALK_THREADS = 8
+
+# seconds changes are collected before the changed folders are rescanned
+UPDATE_DELAY = 0.5
+MIN_COMPACT_SIZE = 10000
+
+
+class IndexNotReadyError(Exception):
+    """The index is still being built
+    """
+    pass
+
+
+def translate_glob(pattern, cross_folders=True):
+    """translate a glob pattern into a regex matching within one line
+
+    Args:
+        pattern (str): glob pattern, "*", "?", "[...]", "[!...]" and "**"
+        cross_folders (bool, optional): "**" matches across folders, or is
+            the same as "*". Defaults to True.
+
+    Returns:
+        str: regex
+    """
+    parts = []
+    idx, n = 0, len(pattern)
+    while idx < n:
+        c = pattern[idx]
+        idx += 1
+        if c == '*':
+            if idx < n and pattern[idx] == '*':
+                idx += 1
+                parts.append('[^\n]*' if cross_folders else '[^/\n]*')
+            else:
+                parts.append('[^/\n]*')
+        elif c == '?':
+            parts.append('[^/\n]')
+        elif c == '[':
+            end = idx
+            if end < n and pattern[end] == '!':
+                end += 1
+            if end < n and pattern[end] == ']':
+                end += 1
+            end = pattern.find(']', end)
+            if end < 0:
+                parts.append(re.escape(c))
+                continue
+
+            chars = pattern[idx:end].replace('\\', '\\\\')
+            idx = end + 1
+            if chars.startswith('!'):
+                parts.append('[^/\n' + chars[1:] + ']')
+            else:
+                if chars.startswith('^'):
+                    chars = '\\' + chars
+                parts.append('[' + chars + ']')
+        else:
+            parts.append(re.escape(c))
+
+    return ''.join(parts)
+
+
+def compile_query(query, mode):
+    """compile a search query
+
+    Args:
+        query (str): search query
+        mode (str): one of search_mode_list
+
+    Returns:
+        tuple: (regex, anchored), regex to run over the lowercased paths, one per
+            line; anchored is True if a match must start at the start of a line
+    """
+    query = query.lower()
+    anchored = False
+
+    # regexes start with a literal where possible: re scans for it at C speed,
+    # while a leading "^" or "[^/\n]*" is tried at every position
+    if mode == SEARCH_PREFIX:
+        regex = '/' + re.escape(query) + '[^/\n]*$'
+    elif mode == SEARCH_SUBSTRING:
+        regex = re.escape(query) + '[^/\n]*$'
+    elif mode == SEARCH_GLOB:
+        if '/' in query:
+            pattern = query.lstrip('/')
+            anchored = True
+            while pattern.startswith('**/'):
+                pattern = pattern[3:]
+                anchored = False
+            regex = '/' + translate_glob(pattern) + '$'
+        else:
+            # "*x" matches names ending with "x": no need to find where names start
+            pattern = query.lstrip('*')
+            if not pattern:
+                regex = '[^/\n]+$'
+            elif pattern != query:
+                regex = translate_glob(pattern, cross_folders=False) + '$'
+            else:
+                regex = '/' + translate_glob(pattern, cross_folders=False) + '$'
+    else:
+        raise ValueError(u'Invalid search mode: {}'.format(mode))
+
+    return re.compile(regex, re.MULTILINE), anchored
+
+
+def lower_path(path):
+    # a few characters change length when lowercased, keep those paths as they
+    # are so both strings have the same line offsets
+    lowered = path.lower()
+    if len(lowered) != len(path):
+        return path
+    return lowered
+
+
+class _IndexSegment(object):
+    """Immutable set of paths, one per line
+    """
+
+    __slots__ = ('paths', 'lower_paths', 'starts', 'is_dirs')
+
+    def __init__(self, entries):
+        """__init__
+
+        Args:
+            entries (list): (path, is_dir) tuples
+        """
+        self.paths = ''.join(path + '\n' for path, _ in entries)
+        self.lower_paths = ''.join(lower_path(path) + '\n' for path, _ in entries)
+        self.is_dirs = bytearray(is_dir for _, is_dir in entries)
+
+        self.starts = array('q')
+        offset = 0
+        for path, _ in entries:
+            self.starts.append(offset)
+            offset += len(path) + 1
+
+    def __len__(self):
+        return len(self.starts)
+
+    def get_entry(self, idx):
+        start = self.starts[idx]
+        return self.paths[start:self.paths.index('\n', start)], bool(self.is_dirs[idx])
+
+    def iter_matches(self, regex, anchored=False):
+        """iter_matches
+
+        Args:
+            regex (re.Pattern): compiled query
+            anchored (bool, optional): only matches starting at the start of
+                a path count. Defaults to False.
+
+        Yields:
+            int: index of the matching paths
+        """
+        for match in regex.finditer(self.lower_paths):
+            idx = bisect.bisect_right(self.starts, match.start()) - 1
+            # matches are leftmost: a match starting at the path start would
+            # have been found before any other one in the same path
+            if not anchored or self.starts[idx] == match.start():
+                yield idx
+
+
+class SearchIndex(object):
+    """Index of all paths under a root dir
+    """
+
+    def __init__(self, root_dir, walk_threads=DEFAULT_WALK_THREADS):
+        """__init__
+
+        Args:
+            root_dir (str): root dir to index
+            walk_threads (int, optional): number of threads walking the tree at
+                startup. Defaults to DEFAULT_WALK_THREADS.
+        """
+        self.root_dir = osp.abspath(root_dir)
+        self.walk_threads = walk_threads
+
+        self._lock = threading.Lock()
+        self._base = _IndexSegment([])
+        self._delta_entries = []
+        self._delta = None
+        # ids of removed paths, base paths first, then delta paths
+        self._deleted = set()
+        self.ready = False
+
+        self.watcher = None
+        self._watch_limit_reached = False
+        self._dirty_dirs = set()
+        self._rebuild_needed = False
+        self._updating = False
+
+        self.build_seconds = None
+        self.num_queries = 0
+
+    def start(self, watcher=None):
+        """build the index in the background, on the IOLoop thread
+
+        Args:
+            watcher (FSWatcher, optional): watcher of the whole tree, None to
+                build the index once, without updates. Defaults to None.
+        """
+        self.watcher = watcher
+        if watcher is not None:
+            watcher.add_listener(self.on_fs_change)
+
+        self._rebuild_needed = True
+        tornado.ioloop.IOLoop.current().spawn_callback(self._update)
+
+    def _to_index_path(self, full_local_path):
+        rel_path = osp.relpath(full_local_path, self.root_dir)
+        if rel_path == '.':
+            return ''
+        return '/' + rel_path.replace(os.sep, '/')
+
+    def _to_local_path(self, index_path):
+        return self.root_dir + index_path.replace('/', os.sep)
+
+    def _watch(self, full_local_path):
+        if self.watcher is None or self._watch_limit_reached:
+            return
+
+        if not self.watcher.watch(full_local_path):
+            self._watch_limit_reached = True
+            logging.warning(u'===> search index: can not watch {}, changes below '
+                            u'unwatched folders are not indexed'.format(full_local_path))
+
+    def _scan_dir(self, full_local_path):
+        """scan_dir, watching it first so no change is missed
+
+        Args:
+            full_local_path (str): full local path of the folder
+
+        Returns:
+            list: (name, is_dir) of the entries, folder symlinks are not folders here
+        """
+        self._watch(full_local_path)
+
+        entries = []
+        try:
+            with os.scandir(full_local_path) as it:
+                for entry in it:
+                    if is_session_file(entry.name):
+                        continue
+
+                    try:
+                        is_dir = entry.is_dir(follow_symlinks=False)
+                    except OSError:
+                        is_dir = False
+                    entries.append((entry.name, is_dir))
+        except OSError as e:
+            logging.info(u'search index: can not scan {}: {}'.format(full_local_path, e))
+
+        return entries
+
+    def _walk(self, index_path, executor=None):
+        """walk a folder tree
+
+        Args:
+            index_path (str): index path of the folder, '' for the root dir
+            executor (ThreadPoolExecutor, optional): scan folders in parallel.
+                Defaults to None (in this thread).
+
+        Returns:
+            list: (index_path, is_dir) of all the entries below the folder
+        """
+        results = []
+
+        if executor is None:
+            pending_dirs = [index_path]
+            while pending_dirs:
+                dir_path = pending_dirs.pop()
+                for name, is_dir in self._scan_dir(self._to_local_path(dir_path)):
+                    path = dir_path + '/' + name
+                    results.append((path, is_dir))
+                    if is_dir:
+                        pending_dirs.append(path)
+
+            return results
+
+        futures = {executor.submit(self._scan_dir, self._to_local_path(index_path)): index_path}
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                dir_path = futures.pop(future)
+                for name, is_dir in future.result():
+                    path = dir_path + '/' + name
+                    results.append((path, is_dir))
+                    if is_dir:
+                        futures[executor.submit(self._scan_dir, self._to_local_path(path))] = path
+
+        return results
+
+    def build(self):
+        """(re)build the whole index, blocking
+        """
+        time_start = time.time()
+
+        with ThreadPoolExecutor(max_workers=self.walk_threads,
+                                thread_name_prefix='tfs-search-walk') as executor:
+            entries = self._walk('', executor)
+
+        base = _IndexSegment(entries)
+
+        with self._lock:
+            self._base = base
+            self._delta_entries = []
+            self._delta = None
+            self._deleted = set()
+            self.ready = True
+
+        self.build_seconds = time.time() - time_start
+        logging.info(u'===> search index: {} paths indexed in {:.2f}s'.format(
+            len(base), self.build_seconds))
+
+    def on_fs_change(self, kind, path, name=None):
+        """watcher listener, see fs_watcher.py
+
+        Args:
+            kind (str): one of CHANGE_ENTRY, CHANGE_DIR, CHANGE_TREE, CHANGE_ALL
+            path (str): folder path
+            name (str, optional): entry name for CHANGE_ENTRY. Defaults to None.
+        """
+        if kind == CHANGE_DIR:
+            self._dirty_dirs.add(path)
+        elif kind == CHANGE_TREE:
+            # also reported as a CHANGE_DIR of the parent, unless the tree is the root
+            self._dirty_dirs.add(osp.dirname(path))
+        elif kind == CHANGE_ALL:
+            self._watch_limit_reached = False
+            self._rebuild_needed = True
+        else:
+            # CHANGE_ENTRY: only the content or metadata of a file changed
+            return
+
+        if not self._updating:
+            self._updating = True
+            tornado.ioloop.IOLoop.current().call_later(UPDATE_DELAY, self._update)
+
+    async def _update(self):
+        self._updating = True
+        try:
+            while self._rebuild_needed or self._dirty_dirs:
+                if self._rebuild_needed:
+                    self._rebuild_needed = False
+                    self._dirty_dirs.clear()
+                    await run_in_io_executor(self.build)
+                else:
+                    dirty_dirs, self._dirty_dirs = self._dirty_dirs, set()
+                    await run_in_io_executor(self.rescan_dirs, dirty_dirs)
+        except Exception:
+            logging.exception(u'search index update failed')
+        finally:
+            self._updating = False
+
+    def _find_ids(self, regex, anchored=False):
+        """ids of the live paths matching a regex, under self._lock
+
+        Yields:
+            int: path id
+        """
+        for idx in self._base.iter_matches(regex, anchored):
+            if idx not in self._deleted:
+                yield idx
+
+        if self._delta_entries:
+            if self._delta is None:
+                self._delta = _IndexSegment(self._delta_entries)
+
+            offset = len(self._base)
+            for idx in self._delta.iter_matches(regex, anchored):
+                if idx + offset not in self._deleted:
+                    yield idx + offset
+
+    def _get_entry(self, path_id):
+        if path_id < len(self._base):
+            return self._base.get_entry(path_id)
+
+        return self._delta_entries[path_id - len(self._base)]
+
+    def _get_children(self, index_path, recursive=False):
+        """{path: id} of the indexed entries of a folder, under self._lock
+        """
+        regex = re.escape(lower_path(index_path)) + ('/[^\n]+$' if recursive else '/[^/\n]+$')
+        children = {}
+        for path_id in self._find_ids(re.compile(regex, re.MULTILINE), anchored=True):
+            path = self._get_entry(path_id)[0]
+            # the lowercased match may be a sibling with another case
+            if path.startswith(index_path + '/'):
+                children[path] = path_id
+
+        return children
+
+    def rescan_dirs(self, dir_paths):
+        """rescan changed folders and apply the changes to the index, blocking
+
+        Args:
+            dir_paths (set): full local paths of the changed folders
+        """
+        for full_local_path in sorted(dir_paths):
+            index_path = self._to_index_path(full_local_path)
+            if index_path.startswith('/..'):
+                continue
+
+            if osp.isdir(full_local_path) and not osp.islink(full_local_path):
+                scanned = self._scan_dir(full_local_path)
+            else:
+                # removed, its parent is rescanned as well
+                scanned = []
+
+            current = dict((index_path + '/' + name, is_dir) for name, is_dir in scanned)
+
+            with self._lock:
+                indexed = self._get_children(index_path)
+                indexed_types = dict(
+                    (path, self._get_entry(path_id)[1]) for path, path_id in indexed.items())
+
+            removed = [path for path, is_dir in indexed_types.items()
+                       if current.get(path) != is_dir]
+            added = [(path, is_dir) for path, is_dir in current.items()
+                     if indexed_types.get(path) != is_dir]
+
+            # new folders may come with contents, e.g. moved in
+            for path, is_dir in list(added):
+                if is_dir:
+                    added.extend(self._walk(path))
+
+            with self._lock:
+                for path in removed:
+                    self._deleted.add(indexed[path])
+                    if indexed_types[path]:
+                        self._deleted.update(self._get_children(path, recursive=True).values())
+
+                if added:
+                    self._delta_entries.extend(added)
+                    self._delta = None
+
+        self._compact_if_needed()
+
+    def _compact_if_needed(self):
+        with self._lock:
+            garbage = len(self._delta_entries) + len(self._deleted)
+            if garbage < max(MIN_COMPACT_SIZE, len(self._base) // 10):
+                return
+
+            entries = [self._get_entry(path_id)
+                       for path_id in range(len(self._base) + len(self._delta_entries))
+                       if path_id not in self._deleted]
+
+        # only the updater changes the index, no change can come in meanwhile
+        base = _IndexSegment(entries)
+
+        with self._lock:
+            self._base = base
+            self._delta_entries = []
+            self._delta = None
+            self._deleted = set()
+
+    def search(self, query, mode=SEARCH_SUBSTRING, limit=DEFAULT_SEARCH_LIMIT, scope=''):
+        """search
+
+        Args:
+            query (str): search query
+            mode (str, optional): one of search_mode_list. Defaults to SEARCH_SUBSTRING.
+            limit (int, optional): max number of results. Defaults to DEFAULT_SEARCH_LIMIT.
+            scope (str, optional): only search below this folder, as an index path
+                ("/a/b"), '' for everything. Defaults to ''.
+
+        Returns:
+            tuple: (results, truncated), results are sorted (index_path, is_dir) tuples,
+                truncated is True if there are more than limit results
+        """
+        if not self.ready:
+            raise IndexNotReadyError(u'The search index is being built')
+
+        regex, anchored = compile_query(query, mode)
+        scope = scope.rstrip('/')
+
+        results = []
+        truncated = False
+        with self._lock:
+            self.num_queries += 1
+            for path_id in self._find_ids(regex, anchored):
+                path, is_dir = self._get_entry(path_id)
+                if scope and not path.startswith(scope + '/'):
+                    continue
+
+                if len(results) >= limit:
+                    truncated = True
+                    break
+                results.append((path, is_dir))
+
+        results.sort()
+
+        return results, truncated
+
+    def stats(self):
+        """stats
+
+        Returns:
+            dict: index statistics
+        """
+        with self._lock:
+            return {
+                'ready': self.ready,
+                'paths': len(self._base) + len(self._delta_entries) - len(self._deleted),
+                'delta_paths': len(self._delta_entries),
+                'deleted_paths': len(self._deleted),
+                'bytes': len(self._base.paths) + len(self._base.lower_paths),
+                'build_seconds': self.build_seconds,
+                'queries': self.num_queries,
+            }
+
+
+_search_index = None
+
+
+def configure_search_index(root_dir, walk_threads=DEFAULT_WALK_THREADS, watcher=None):
+    """create the search index and start building it, on the IOLoop thread
+
+    Args:
+        root_dir (str): root dir to index
+        walk_threads (int, optional): see SearchIndex. 0 disables the search.
+            Defaults to DEFAULT_WALK_THREADS.
+        watcher (FSWatcher, optional): see SearchIndex.start(). Defaults to None.
+
+    Returns:
+        SearchIndex: the index, None if the search is disabled
+    """
+    global _search_index
+
+    if walk_threads <= 0:
+        _search_index = None
+        return None
+
+    _search_index = SearchIndex(root_dir, walk_threads)
+    _search_index.start(watcher)
+
+    return _search_index
+
+
+def get_search_index():
+    """get_search_index
+
+    Returns:
+        SearchIndex: the search index, None if the search is disabled
+    """
+    return _search_index
@@ -15,6 +15,7 @@ Use the --port option to change the port on which the server listens.
 import logging
 from argparse import ArgumentParser
 from .tornado_file_server import start_server, generate_404_html
+from .thumbnails import DEFAULT_THUMBNAIL_CACHE_DIR
 
 from .python_version import is_python3
 
@@ -47,6 +48,18 @@ def define_arg_parser():
         dest='log_path', type=unicode, default='./tornado-file-server.log',
         help='log file path. Default: "./tornado-file-server.log"'
     )
+    parser.add_argument(
+        "--log-level",
+        dest='log_level', type=str, default='info',
+        choices=['debug', 'info', 'warning', 'error'],
+        help="min level of the logged messages, 'debug' adds per-request details. Default: 'info'"
+    )
+    parser.add_argument(
+        "--access-log-sample",
+        dest='access_log_sample_rate', type=float, default=1.0,
+        help="share (0 to 1) of the successful requests written to the access log, "
+             "errors are always logged. Default: 1.0"
+    )
     parser.add_argument(
         '-p', '--port',
         dest='port', type=int, default=8899,
@@ -73,6 +86,173 @@ def define_arg_parser():
         dest='image_width', type=int, default=256,
         help="image width for media preview mode. Default: 256"
     )
+    parser.add_argument(
+        "--listing-cache-entries",
+        dest='listing_cache_entries', type=int, default=256,
+        help="max number of folder listings kept in cache. Default: 256"
+    )
+    parser.add_argument(
+        "--listing-cache-size",
+        dest='listing_cache_size_mb', type=int, default=64,
+        help="max memory (in MB) of folder listings kept in cache. Default: 64"
+    )
+    parser.add_argument(
+        "--io-threads",
+        dest='io_threads', type=int, default=16,
+        help="number of threads for filesystem work (listing, stat, file reads). Default: 16"
+    )
+    parser.add_argument(
+        "--listing-mode",
+        dest='listing_mode', type=str, default='lazy', choices=['lazy', 'eager'],
+        help="'lazy': only stat the items shown on the requested page; "
+             "'eager': stat all items when scanning a folder. Default: 'lazy'"
+    )
+    parser.add_argument(
+        "--fs-watch",
+        dest='fs_watch_mode', type=str, default='off',
+        choices=['off', 'auto', 'inotify', 'poll'],
+        help="invalidate cached listings by watching the filesystem instead of "
+             "stat-ing folders on every request. 'auto': inotify if available, "
+             "polling otherwise. Default: 'off'"
+    )
+    parser.add_argument(
+        "--fs-poll-interval",
+        dest='fs_poll_interval', type=float, default=2.0,
+        help="seconds between two polls when watching the filesystem by polling. Default: 2.0"
+    )
+    parser.add_argument(
+        "--search",
+        dest='search', action='store_true',
+        help="enable the filename search: an index of the whole tree is built at startup "
+             "and kept up to date by watching the tree (see --tree-watch). With --workers, "
+             "every worker builds and watches its own index. Default: off"
+    )
+    parser.add_argument(
+        "--search-walk-threads",
+        dest='search_walk_threads', type=int, default=8,
+        help="number of threads walking the tree to build the filename search index "
+             "at startup. Default: 8"
+    )
+    parser.add_argument(
+        "--folder-sizes",
+        dest='folder_sizes', action='store_true',
+        help="show the recursive sizes of folders in listings, computed in the background "
+             "and kept up to date by watching the tree (see --tree-watch). With --workers, "
+             "every worker computes and watches its own. Default: off"
+    )
+    parser.add_argument(
+        "--tree-watch",
+        dest='tree_watch_mode', type=str, default='auto',
+        choices=['off', 'auto', 'inotify', 'poll'],
+        help="how the search index and the folder sizes watch the whole tree to stay "
+             "up to date, 'off' to only refresh the size of a folder when its listing is "
+             "rescanned and never update the search index. Default: 'auto'"
+    )
+    parser.add_argument(
+        "--debug",
+        dest='debug', action='store_true',
+        help="run tornado in debug mode: autoreload on source changes, tracebacks "
+             "in error pages. Default: off"
+    )
+    parser.add_argument(
+        "--max-upload-size",
+        dest='max_upload_size_gb', type=float, default=100,
+        help="max size (in GB) of an upload. Default: 100"
+    )
+    parser.add_argument(
+        "--chunked-upload-ttl",
+        dest='chunked_upload_ttl_hours', type=float, default=24,
+        help="hours after which a chunked upload which received no chunk is abandoned "
+             "and its files removed. Default: 24"
+    )
+    parser.add_argument(
+        '-w', "--workers",
+        dest='workers', type=int, default=1,
+        help="number of server processes, 0 for one per CPU core. Workers share the "
+             "port through SO_REUSEPORT where available, crashed workers are "
+             "restarted. Default: 1"
+    )
+    parser.add_argument(
+        "--thumbnail-processes",
+        dest='thumbnail_processes', type=int, default=2,
+        help="number of processes generating image thumbnails for the preview mode "
+             "(needs Pillow), 0 to show full-size images. Default: 2"
+    )
+    parser.add_argument(
+        "--thumbnail-cache-dir",
+        dest='thumbnail_cache_dir', type=unicode, default=DEFAULT_THUMBNAIL_CACHE_DIR,
+        help="folder of the thumbnail cache. Default: {}".format(DEFAULT_THUMBNAIL_CACHE_DIR)
+    )
+    parser.add_argument(
+        "--thumbnail-cache-size",
+        dest='thumbnail_cache_size_mb', type=int, default=512,
+        help="max size (in MB) of the thumbnail cache. Default: 512"
+    )
+    parser.add_argument(
+        "--no-compression",
+        dest='compression', action='store_false',
+        help="don't gzip/brotli compress folder pages and text files. Default: compress "
+             "if the client accepts it"
+    )
+    parser.add_argument(
+        "--compression-cache-size",
+        dest='compression_cache_size_mb', type=int, default=64,
+        help="max memory (in MB) of the cached compressed variants of text files. Default: 64"
+    )
+    parser.add_argument(
+        "--file-cache-size",
+        dest='file_cache_size_mb', type=int, default=64,
+        help="max memory (in MB) of the cached contents of small files, 0 to disable. Default: 64"
+    )
+    parser.add_argument(
+        "--file-cache-max-file-size",
+        dest='file_cache_max_file_size_kb', type=int, default=256,
+        help="max size (in KB) of a file kept in the file cache. Default: 256"
+    )
+    parser.add_argument(
+        "--path-cache-ttl",
+        dest='path_cache_ttl', type=float, default=1.0,
+        help="seconds the type (file/folder) of a requested path is cached. Default: 1.0"
+    )
+    parser.add_argument(
+        "--path-cache-negative-ttl",
+        dest='path_cache_negative_ttl', type=float, default=5.0,
+        help="seconds a requested path which does not exist is cached. Default: 5.0"
+    )
+    parser.add_argument(
+        "--item-stat-ttl",
+        dest='item_stat_ttl', type=float, default=2.0,
+        help="seconds the size/mtime of a file in a folder listing is cached, "
+             "when the folder is not watched (see --fs-watch). Default: 2.0"
+    )
+    parser.add_argument(
+        "--client-rate-limit",
+        dest='client_rate_limit_mb', type=float, default=0,
+        help="max download bandwidth (in MB/s) of each client ip, 0 for no limit. Default: 0"
+    )
+    parser.add_argument(
+        "--global-rate-limit",
+        dest='global_rate_limit_mb', type=float, default=0,
+        help="max download bandwidth (in MB/s) of all clients, 0 for no limit. Default: 0"
+    )
+    parser.add_argument(
+        "--max-client-downloads",
+        dest='max_client_downloads', type=int, default=0,
+        help="max concurrent downloads (of 1 MB or more) of each client ip, more are "
+             "answered with 429, 0 for no limit. Default: 0"
+    )
+    parser.add_argument(
+        "--max-downloads",
+        dest='max_downloads', type=int, default=0,
+        help="max concurrent downloads (of 1 MB or more) of all clients, more are "
+             "answered with 503, 0 for no limit. Default: 0"
+    )
+    parser.add_argument(
+        "--no-sendfile",
+        dest='sendfile', action='store_false',
+        help="send file contents through Python instead of os.sendfile(). Default: "
+             "use sendfile for plain http, uncompressed responses"
+    )
 
     return parser
 
@@ -92,7 +272,7 @@ def serving():
         args.dir = args.dir.decode('utf-8')  # convert into unicode
 
     logging.basicConfig(filename=args.log_path,
-                        encoding='utf-8', level=logging.INFO)
+                        encoding='utf-8', level=getattr(logging, args.log_level.upper()))
 
     logging.info(u"===> args: {}".format(args))
     logging.info(u'===> Current Working Dir: {}'.format(args.dir))
@@ -104,7 +284,37 @@ def serving():
         items_per_page=args.items_per_page,
         view_mode=args.view_mode,
         items_per_row=args.items_per_row,
-        image_width=args.image_width
+        image_width=args.image_width,
+        listing_cache_entries=args.listing_cache_entries,
+        listing_cache_size_mb=args.listing_cache_size_mb,
+        io_threads=args.io_threads,
+        listing_mode=args.listing_mode,
+        fs_watch_mode=args.fs_watch_mode,
+        fs_poll_interval=args.fs_poll_interval,
+        debug=args.debug,
+        max_upload_size_gb=args.max_upload_size_gb,
+        chunked_upload_ttl_hours=args.chunked_upload_ttl_hours,
+        workers=args.workers,
+        thumbnail_processes=args.thumbnail_processes,
+        thumbnail_cache_dir=args.thumbnail_cache_dir,
+        thumbnail_cache_size_mb=args.thumbnail_cache_size_mb,
+        compression=args.compression,
+        compression_cache_size_mb=args.compression_cache_size_mb,
+        file_cache_size_mb=args.file_cache_size_mb,
+        file_cache_max_file_size_kb=args.file_cache_max_file_size_kb,
+        path_cache_ttl=args.path_cache_ttl,
+        path_cache_negative_ttl=args.path_cache_negative_ttl,
+        item_stat_ttl=args.item_stat_ttl,
+        sendfile=args.sendfile,
+        search=args.search,
+        search_walk_threads=args.search_walk_threads,
+        tree_watch_mode=args.tree_watch_mode,
+        folder_sizes=args.folder_sizes,
+        access_log_sample_rate=args.access_log_sample_rate,
+        client_rate_limit_mb=args.client_rate_limit_mb,
+        global_rate_limit_mb=args.global_rate_limit_mb,
+        max_client_downloads=args.max_client_downloads,
+        max_downloads=args.max_downloads
     )
 
 
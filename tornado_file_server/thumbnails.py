@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+"""
+thumbnails for the preview mode
+
+Thumbnails are generated with Pillow in a process pool (decoding and
+resizing is CPU-bound and holds the GIL) and kept in an on-disk cache. A
+cache file is named after the sha1 of (path, mtime, size, width) of its
+source image, so a changed image gets a new thumbnail and stale ones are
+simply evicted. Eviction is LRU on the cache file mtimes, which are touched
+on every hit, so several server processes can share the same cache folder.
+
+Pillow is optional: without it is_thumbnail_supported() is False and the
+preview pages show the original images.
+
+author: zhaoyafei0210@gmail.com
+github: https://github.com/walkoncross/tornado-file-server
+"""
+
+import hashlib
+import logging
+import multiprocessing
+import os
+import os.path as osp
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import tornado.ioloop
+
+from .io_executor import run_in_io_executor
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+    ImageOps = None
+
+
+DEFAULT_THUMBNAIL_PROCESSES = 2
+DEFAULT_THUMBNAIL_CACHE_SIZE = 512 * 1024 * 1024
+DEFAULT_THUMBNAIL_CACHE_DIR = osp.join(
+    tempfile.gettempdir(), 'tornado-file-server-thumbnails')
+
+MIN_THUMBNAIL_WIDTH = 16
+MAX_THUMBNAIL_WIDTH = 2048
+# max height as a multiple of the width, for very tall images
+MAX_THUMBNAIL_ASPECT = 4
+THUMBNAIL_QUALITY = 85
+
+# evict down to this fraction of max_bytes, so that eviction scans are rare
+EVICTION_LOW_WATERMARK = 0.9
+
+_thumbnail_cache = None
+
+
+def is_thumbnail_supported():
+    """is_thumbnail_supported
+
+    Returns:
+        bool: whether Pillow is installed
+    """
+    return Image is not None
+
+
+def make_thumbnail(src_path, dst_path, width):
+    """downscale an image to width and save it as JPEG, run in the process pool
+
+    Args:
+        src_path (str): full local path of the image
+        dst_path (str): full local path of the thumbnail
+        width (int): thumbnail width, images narrower than this are not upscaled
+
+    Returns:
+        int: size in bytes of the thumbnail
+    """
+    with Image.open(src_path) as img:
+        # let the JPEG decoder downscale by 1/2..1/8 while decoding
+        img.draft('RGB', (width, width * MAX_THUMBNAIL_ASPECT))
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((width, width * MAX_THUMBNAIL_ASPECT))
+
+        if img.mode in ('RGBA', 'LA', 'P'):
+            img = img.convert('RGBA')
+            background = Image.new('RGB', img.size, (255, 255, 255))
+            background.paste(img, mask=img.getchannel('A'))
+            img = background
+        elif img.mode != 'RGB':
+            img = img.convert('RGB')
+
+        os.makedirs(osp.dirname(dst_path), exist_ok=True)
+
+        # write to a temp file first, concurrent readers never see a partial file
+        fd, temp_path = tempfile.mkstemp(
+            dir=osp.dirname(dst_path), prefix='.', suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                img.save(fp, 'JPEG', quality=THUMBNAIL_QUALITY, optimize=True)
+            os.replace(temp_path, dst_path)
+        except BaseException:
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+            raise
+
+    return os.stat(dst_path).st_size
+
+
+class ThumbnailCache(object):
+    """On-disk thumbnail cache, bounded by total size
+    """
+
+    def __init__(self, cache_dir=DEFAULT_THUMBNAIL_CACHE_DIR,
+                 max_bytes=DEFAULT_THUMBNAIL_CACHE_SIZE,
+                 processes=DEFAULT_THUMBNAIL_PROCESSES):
+        """__init__
+
+        Args:
+            cache_dir (str, optional): folder of the cache files.
+                Defaults to DEFAULT_THUMBNAIL_CACHE_DIR.
+            max_bytes (int, optional): max total size of the cache files.
+                Defaults to DEFAULT_THUMBNAIL_CACHE_SIZE.
+            processes (int, optional): number of thumbnail processes.
+                Defaults to DEFAULT_THUMBNAIL_PROCESSES.
+        """
+        self.cache_dir = osp.abspath(cache_dir)
+        self.max_bytes = max_bytes
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        # don't fork a process which runs the IOLoop and thread pools
+        methods = multiprocessing.get_all_start_methods()
+        mp_context = multiprocessing.get_context(
+            'forkserver' if 'forkserver' in methods else 'spawn')
+        self._process_pool = ProcessPoolExecutor(
+            max_workers=processes, mp_context=mp_context)
+
+        self._lock = threading.Lock()
+        # bytes written since the last eviction scan, plus the size found by it
+        self._nbytes = self._scan_cache_dir()[1]
+        self._pending = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def get_cache_path(self, src_path, src_stat, width):
+        """get_cache_path
+
+        Args:
+            src_path (str): full local path of the image
+            src_stat (os.stat_result): stat of the image
+            width (int): thumbnail width
+
+        Returns:
+            str: full local path of the cache file
+        """
+        key = u'{}\0{}\0{}\0{}'.format(
+            src_path, src_stat.st_mtime_ns, src_stat.st_size, width)
+        digest = hashlib.sha1(key.encode('utf-8', 'surrogateescape')).hexdigest()
+
+        return osp.join(self.cache_dir, digest[:2], digest + '.jpg')
+
+    async def get_thumbnail(self, src_path, src_stat, width):
+        """get the thumbnail of an image, generating it if needed
+
+        Args:
+            src_path (str): full local path of the image
+            src_stat (os.stat_result): stat of the image
+            width (int): thumbnail width
+
+        Returns:
+            str: full local path of the thumbnail, None if it can't be generated
+        """
+        cache_path = self.get_cache_path(src_path, src_stat, width)
+
+        if await run_in_io_executor(self._touch, cache_path):
+            self.hits += 1
+            return cache_path
+
+        self.misses += 1
+
+        # concurrent requests for the same thumbnail share one generation
+        future = self._pending.get(cache_path)
+        is_generating = future is None
+        if is_generating:
+            future = tornado.ioloop.IOLoop.current().run_in_executor(
+                self._process_pool, make_thumbnail, src_path, cache_path, width)
+            self._pending[cache_path] = future
+            future.add_done_callback(lambda f: self._pending.pop(cache_path, None))
+
+        try:
+            nbytes = await future
+        except Exception as e:
+            self.errors += 1
+            logging.warning(u'Failed to make thumbnail of {}: {}'.format(src_path, e))
+            return None
+
+        if not is_generating:
+            return cache_path
+
+        with self._lock:
+            self._nbytes += nbytes
+            need_eviction = self._nbytes > self.max_bytes
+
+        if need_eviction:
+            await run_in_io_executor(self.evict)
+
+        return cache_path
+
+    @staticmethod
+    def _touch(cache_path):
+        try:
+            # the mtime is the LRU timestamp of the eviction
+            os.utime(cache_path)
+            return True
+        except OSError:
+            return False
+
+    def _scan_cache_dir(self):
+        entries = []
+        total_bytes = 0
+
+        for sub_dir in os.scandir(self.cache_dir):
+            if not sub_dir.is_dir(follow_symlinks=False):
+                continue
+            for entry in os.scandir(sub_dir.path):
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime_ns, st.st_size, entry.path))
+                total_bytes += st.st_size
+
+        return entries, total_bytes
+
+    def evict(self):
+        """remove the least recently used cache files until the cache is below
+        its low watermark, blocking
+        """
+        entries, total_bytes = self._scan_cache_dir()
+        low_watermark = self.max_bytes * EVICTION_LOW_WATERMARK
+
+        entries.sort()
+        for _, size, path in entries:
+            if total_bytes <= low_watermark:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total_bytes -= size
+
+        with self._lock:
+            self._nbytes = total_bytes
+
+    def stats(self):
+        """stats
+
+        Returns:
+            dict: cache statistics
+        """
+        with self._lock:
+            return {
+                'bytes': self._nbytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'errors': self.errors,
+            }
+
+
+def configure_thumbnails(cache_dir=DEFAULT_THUMBNAIL_CACHE_DIR,
+                         max_bytes=DEFAULT_THUMBNAIL_CACHE_SIZE,
+                         processes=DEFAULT_THUMBNAIL_PROCESSES):
+    """create the thumbnail cache
+
+    Args:
+        see ThumbnailCache, processes <= 0 disables thumbnails
+
+    Returns:
+        ThumbnailCache: the thumbnail cache, None if thumbnails are disabled or
+            Pillow is not installed
+    """
+    global _thumbnail_cache
+
+    _thumbnail_cache = None
+
+    if processes <= 0:
+        return None
+
+    if not is_thumbnail_supported():
+        logging.warning(u'===> Pillow is not installed, preview pages show full-size images')
+        return None
+
+    _thumbnail_cache = ThumbnailCache(cache_dir, max_bytes, processes)
+    logging.info(u'===> thumbnail cache: {}'.format(_thumbnail_cache.cache_dir))
+
+    return _thumbnail_cache
+
+
+def get_thumbnail_cache():
+    """get_thumbnail_cache
+
+    Returns:
+        ThumbnailCache: the thumbnail cache, None if thumbnails are disabled
+    """
+    return _thumbnail_cache
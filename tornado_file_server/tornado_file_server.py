@@ -10,11 +10,13 @@ a tornado-based file server
 from __future__ import print_function
 
 import os.path as osp
-import time
 import os
 import logging
-import sys
 import math
+import json
+import hashlib
+import signal
+import asyncio
 
 from urllib.parse import urlencode
 
@@ -24,12 +26,66 @@ import tornado.escape
 import tornado.web
 import tornado.ioloop
 import tornado.httpserver
+import tornado.httputil
+import tornado.iostream
+import tornado.gen
 import tornado.routing
 
 
 from .get_ip import get_ip
 from .python_version import is_python3
-from .check_file_types import is_an_image, is_supported_audio, is_supported_video
+from .check_file_types import is_an_image
+from .dir_listing_cache import DirListing, dir_listing_cache
+from .dir_scanner import (
+    scan_dir, format_file_size, sort_list, sort_order_list,
+    SORT_NAME, SORT_MTIME, SORT_SIZE, SORT_ASC, SORT_DESC
+)
+from .page_templates import render_page, get_item_cells, sort_columns, MEDIA_IMAGE
+from .io_executor import configure_io_executor, run_in_io_executor
+from .fs_watcher import create_fs_watcher
+from .multipart_parser import (
+    StreamingMultipartParser, get_multipart_boundary,
+    PART_START, PART_DATA, PART_END
+)
+from .uploads import UploadFileWriter
+from .chunked_uploads import (
+    ChunkWriter, ChunkedUploadError, chunked_upload_store, DEFAULT_CHUNK_SIZE
+)
+from .thumbnails import (
+    configure_thumbnails, get_thumbnail_cache, MIN_THUMBNAIL_WIDTH, MAX_THUMBNAIL_WIDTH,
+    DEFAULT_THUMBNAIL_CACHE_DIR, DEFAULT_THUMBNAIL_PROCESSES
+)
+from .compression import (
+    choose_encoding, compress, is_compressible, stat_sidecar,
+    compressed_content_cache, sidecar_extensions
+)
+from .file_content_cache import file_content_cache, get_file_etag
+from .search_index import (
+    configure_search_index, get_search_index, IndexNotReadyError, search_mode_list,
+    DEFAULT_SEARCH_LIMIT, MAX_SEARCH_LIMIT, DEFAULT_WALK_THREADS
+)
+from .folder_sizes import configure_folder_sizes, get_folder_size_cache
+from .archives import (
+    build_tar_archive, iter_zip, get_archive_name, archive_format_list,
+    archive_content_types, ARCHIVE_TAR, ARCHIVE_ZIP_DEFLATE
+)
+from .listing_api import (
+    get_listing_page, get_item_dict, InvalidCursorError,
+    listing_format_list, DEFAULT_LISTING_LIMIT, MAX_LISTING_LIMIT
+)
+# get_full_local_path_for_url and is_local_path_under_root used to live here
+from .path_resolver import (
+    path_resolver, get_full_local_path_for_url, is_local_path_under_root,
+    PATH_FILE, PATH_DIR, PATH_FORBIDDEN
+)
+from .workers import WorkerSupervisor, bind_server_sockets, SHUTDOWN_TIMEOUT
+from .metrics import (
+    registry as metrics_registry, timed_stat, add_sent_bytes, IOLoopLagMonitor,
+    requests_in_flight, format_labels, format_value, MetricsRouter, MeteredApplication,
+    ROUTE_FILE, ROUTE_FOLDER, ROUTE_UPLOAD, ROUTE_NOT_FOUND, ROUTE_SERVICE
+)
+from .log_pipeline import log_queue, access_log, log_access, get_logging_stats
+from .rate_limits import download_limiter, DownloadLimitError, write_limit_error
 
 
 if is_python3():
@@ -39,6 +95,19 @@ else:
     from urllib import unquote
 
 
+DEFAULT_MAX_UPLOAD_SIZE = 100 * 1024 * 1024 * 1024
+# smaller files are sent through the IOStream, sendfile isn't worth a syscall more
+MIN_SENDFILE_SIZE = 64 * 1024
+# tornado versions whose HTTP1Connection is known to track the body length in
+# _expected_content_remaining, see skip_expected_content()
+SENDFILE_TORNADO_VERSIONS = ((5, 1), (7, 0))
+MAX_CHUNKED_UPLOAD_REQUEST_SIZE = 64 * 1024
+# served before any file or folder, shadows a "_stats" entry in the root dir
+STATS_PATH = '/_stats'
+SEARCH_PATH = '/_search'
+METRICS_PATH = '/_metrics'
+
+
 content_404_html = u'''
 <!DOCTYPE html>
 <html>
@@ -60,33 +129,32 @@ def generate_404_html(save_dir):
     fp.close()
 
 
-def get_full_local_path_for_url(uri_path, root_dir=None):
-    """Get full local path for url_path
+def can_skip_expected_content(connection):
+    """can_skip_expected_content
 
     Args:
-        uri_path (str): uri path
-        root_dir (str, optional): local root dir. Defaults to None.
+        connection (HTTP1Connection): connection of a request
 
     Returns:
-        str: full local path
+        bool: whether skip_expected_content() works with this connection
     """
-    if not root_dir:
-        root_dir = unicode(os.getcwd())
+    min_version, max_version = SENDFILE_TORNADO_VERSIONS
+    return (min_version <= tornado.version_info[:2] < max_version and
+            hasattr(connection, '_expected_content_remaining'))
 
-    if not isinstance(root_dir, unicode):
-        raise(AssertionError(
-            "In get_full_local_path_for_url: root_dir must be Unicode"))
 
-    if uri_path == '/':
-        full_local_path = root_dir
-    else:
-        local_path = tornado.escape.url_unescape(uri_path, plus=False)
-        # print('type(local_path): ', type(local_path))
-        # print(local_path)
-        # full_local_path = osp.join(root_dir, local_path) # Error: osp.join('/working/path/', '/static_file') = /static_file
-        full_local_path = root_dir + local_path
+def skip_expected_content(connection, num_bytes):
+    """count body bytes written to the socket directly, bypassing the connection
 
-    return full_local_path
+    HTTP1Connection checks the body length against Content-Length in finish(),
+    and has no public api for bytes it did not write itself: this is the only
+    access to its private state, check can_skip_expected_content() first.
+
+    Args:
+        connection (HTTP1Connection): connection of a request
+        num_bytes (int): number of bytes written
+    """
+    connection._expected_content_remaining -= num_bytes
 
 
 class TypeMatchesFile(tornado.routing.Matcher):
@@ -110,11 +178,11 @@ class TypeMatchesFile(tornado.routing.Matcher):
         Returns:
             _type_: _description_
         """
-        full_local_path = get_full_local_path_for_url(
-            request.path, self.root_dir)
+        # resolved once per request, and shared with the other matchers and the handler
+        resolved = path_resolver.resolve_request(request, self.root_dir)
 
-        # logging.info(u'full_local_path in TypeMatchesFile:', full_local_path)
-        if osp.isfile(full_local_path):
+        # logging.info(u'full_local_path in TypeMatchesFile:', resolved.full_local_path)
+        if resolved.path_type == PATH_FILE:
             # print('--> request to access a local file')
             return {}
         else:
@@ -129,22 +197,263 @@ class TypeMatchesFolder(tornado.routing.Matcher):
         self.root_dir = root_dir
 
     def match(self, request):
-        full_local_path = get_full_local_path_for_url(
-            request.path, self.root_dir)
+        resolved = path_resolver.resolve_request(request, self.root_dir)
 
         # logging.info(
-        #     u'full_local_path in TypeMatchesFolder:{}'.format(full_local_path))
-        if osp.isdir(full_local_path):
+        #     u'full_local_path in TypeMatchesFolder:{}'.format(resolved.full_local_path))
+        if resolved.path_type == PATH_DIR:
             # print('--> request to access a local folder')
             return {}
         else:
             return None
 
 
+class TypeMatchesUpload(tornado.routing.Matcher):
+    """matcher for PUT requests uploading a single file into an existing folder
+    """
+    def __init__(self, root_dir=None):
+        super(TypeMatchesUpload, self).__init__()
+        self.root_dir = root_dir
+
+    def match(self, request):
+        if request.method != 'PUT':
+            return None
+
+        resolved = path_resolver.resolve_request(request, self.root_dir)
+        if resolved.path_type in (PATH_DIR, PATH_FORBIDDEN):
+            return None
+
+        parent = path_resolver.resolve(
+            osp.dirname(resolved.full_local_path), self.root_dir)
+        if parent.path_type == PATH_DIR:
+            return {}
+        else:
+            return None
+
+
+class _PathResolvingDelegate(object):
+    """HTTPMessageDelegate wrapper, resolves the local path of a request in
+    the io thread pool before routing it, see PathResolvingRouter
+    """
+
+    __slots__ = ('_delegate', '_root_dir')
+
+    def __init__(self, delegate, root_dir):
+        self._delegate = delegate
+        self._root_dir = root_dir
+
+    def headers_received(self, start_line, headers):
+        uri_path = start_line.path.partition('?')[0]
+        if uri_path in (STATS_PATH, SEARCH_PATH, METRICS_PATH):
+            return self._delegate.headers_received(start_line, headers)
+
+        # TypeMatchesUpload also resolves the parent folder
+        full_local_paths = path_resolver.get_request_paths(
+            uri_path, self._root_dir, with_parent=(start_line.method == 'PUT'))
+        if not path_resolver.needs_stat(full_local_paths, self._root_dir):
+            return self._delegate.headers_received(start_line, headers)
+
+        return self._resolve_and_route(start_line, headers, full_local_paths)
+
+    async def _resolve_and_route(self, start_line, headers, full_local_paths):
+        preresolved = await run_in_io_executor(
+            path_resolver.preresolve, full_local_paths, self._root_dir)
+
+        # the matchers run synchronously in headers_received()
+        path_resolver.use_preresolved(preresolved)
+        try:
+            result = self._delegate.headers_received(start_line, headers)
+        finally:
+            path_resolver.use_preresolved(None)
+
+        if result is not None:
+            await result
+
+    def data_received(self, chunk):
+        return self._delegate.data_received(chunk)
+
+    def finish(self):
+        self._delegate.finish()
+
+    def on_connection_close(self):
+        self._delegate.on_connection_close()
+
+
+class PathResolvingRouter(MetricsRouter):
+    """MetricsRouter whose matchers never stat() on the IOLoop thread: paths
+    whose type is not cached are resolved in the io thread pool first
+    """
+
+    def __init__(self, rules, root_dir):
+        """__init__
+
+        Args:
+            rules (list): routing rules
+            root_dir (str): local root dir
+        """
+        super(PathResolvingRouter, self).__init__(rules)
+        self.root_dir = root_dir
+
+    def wrap_delegate(self, delegate):
+        return _PathResolvingDelegate(delegate, self.root_dir)
+
+
+class StreamingUploadMixin(object):
+    """Mixin for @stream_request_body handlers which write the request body
+    into files through UploadFileWriter, in the io thread pool
+
+    Subclasses call init_upload_state() in prepare() and implement
+    receive_upload_chunk(chunk). A writer is an UploadFileWriter or a
+    ChunkWriter, both have open/write/commit/abort methods.
+    """
+
+    def init_upload_state(self):
+        """init_upload_state
+        """
+        self.upload_writer = None
+        self.upload_error = None
+        self.upload_error_status = 400
+        self.upload_receiving = False
+
+    async def receive_upload_chunk(self, chunk):
+        raise NotImplementedError()
+
+    async def data_received(self, chunk):
+        """data_received, called by tornado for each chunk of the body
+
+        Args:
+            chunk (bytes): next chunk of the request body
+        """
+        if self.upload_error is not None:
+            return
+
+        self.upload_receiving = True
+        try:
+            await self.receive_upload_chunk(chunk)
+        except ValueError as e:
+            # MultipartError, ChunkedUploadError
+            self.set_upload_error(e, 400)
+        except OSError as e:
+            self.set_upload_error(e, 500)
+        finally:
+            self.upload_receiving = False
+
+        if self.upload_error is not None:
+            await self.abort_upload()
+
+    def set_upload_error(self, error, status_code=400):
+        """set_upload_error
+
+        Args:
+            error (Exception or str): what went wrong
+            status_code (int, optional): http status to respond with. Defaults to 400.
+        """
+        if self.upload_error is None:
+            logging.warning(u'Upload to {} failed: {}'.format(self.request.path, error))
+            self.upload_error = error
+            self.upload_error_status = status_code
+
+    def check_upload_error(self):
+        """raise HTTPError if the upload failed
+        """
+        if self.upload_error is not None:
+            raise tornado.web.HTTPError(
+                self.upload_error_status, u'Upload failed: {}'.format(self.upload_error))
+
+    async def open_upload_writer(self, writer):
+        """open_upload_writer
+
+        Args:
+            writer (UploadFileWriter or ChunkWriter): writer for the upload
+        """
+        self.upload_writer = writer
+        await run_in_io_executor(writer.open)
+
+    async def write_upload(self, data):
+        """write_upload
+
+        Args:
+            data (bytes): next chunk of the uploaded file
+        """
+        if self.upload_writer is not None:
+            await run_in_io_executor(self.upload_writer.write, data)
+
+    async def commit_upload(self):
+        """commit_upload
+
+        Returns:
+            UploadFileWriter or ChunkWriter: the committed writer
+        """
+        writer = self.upload_writer
+        self.upload_writer = None
+
+        await run_in_io_executor(writer.commit)
+
+        # a cached "missing" must not hide the new file
+        save_filename = getattr(writer, 'save_filename', None)
+        if save_filename is not None:
+            path_resolver.invalidate(save_filename)
+
+        return writer
+
+    async def abort_upload(self):
+        """remove the temp file of an unfinished upload
+        """
+        writer = self.upload_writer
+        self.upload_writer = None
+
+        if writer is not None:
+            await run_in_io_executor(writer.abort)
+
+    def on_connection_close(self):
+        """on_connection_close, drop the unfinished upload
+        """
+        super(StreamingUploadMixin, self).on_connection_close()
+
+        if self.request.method not in ('POST', 'PUT'):
+            return
+
+        self.set_upload_error(u'connection closed')
+        # otherwise data_received() aborts when its pending write returns
+        if not self.upload_receiving:
+            tornado.ioloop.IOLoop.current().spawn_callback(self.abort_upload)
+
+
 class FileHandler(tornado.web.StaticFileHandler):
     """Static File Handler
     """
 
+    # set by use_thumbnail() when a thumbnail is served instead of the image
+    thumbnail_width = None
+    # set by use_compression() when a gzip/brotli variant is served
+    content_encoding = None
+    content_type = None
+    # stat of the file actually sent when it's not the requested one
+    # (thumbnail, precompressed sidecar)
+    content_stat = None
+    # compressed variant from compressed_content_cache, or content from
+    # file_content_cache, sent instead of reading the file
+    content_data = None
+    # precomputed ETag from file_content_cache
+    content_etag = None
+    # DownloadSlot of the response, None without download limits
+    download_slot = None
+
+    def initialize(self, path, default_filename=None, compression=True, sendfile=True):
+        """initialize
+
+        Args:
+            path (str): root dir
+            default_filename (str, optional): see StaticFileHandler. Defaults to None.
+            compression (bool, optional): serve gzip/brotli variants of text files
+                if the client accepts it. Defaults to True.
+            sendfile (bool, optional): send file contents with os.sendfile() when
+                possible. Defaults to True.
+        """
+        super(FileHandler, self).initialize(path, default_filename)
+        self.compression = compression
+        self.sendfile = sendfile
+
     def parse_url_path(self, url_path):
         """parse url_path
 
@@ -160,221 +469,430 @@ class FileHandler(tornado.web.StaticFileHandler):
         # logging.info(u'===> self.request.headers: {}'.format(self.request.headers))
         # logging.info(u'===> self.request.body: {}'.format(self.request.body))
 
-        logging.info(
-            u'GET file path: {}'.format(url_path)
-        )
+        logging.debug(u'GET file path: %s', url_path)
 
         if not url_path or url_path.endswith('/'):
-            logging.info(
-                u'Cannot find: {}'.format(url_path)
-            )
+            logging.debug(u'Cannot find: %s', url_path)
             url_path = osp.join(self.root, '404.html')
-            logging.info(
-                u'Return: {}'.format(url_path)
-            )
+            logging.debug(u'Return: %s', url_path)
 
         if os.path.sep != "/":
             url_path = url_path.replace("/", os.path.sep)
 
         return url_path
 
+    def compute_etag(self):
+        """compute Etag from inode/size/mtime of the file, instead of
+        StaticFileHandler's md5 over the whole file content
+
+        Returns:
+            str: Etag
+        """
+        if self.content_etag is not None:
+            return self.content_etag
+
+        etag = get_file_etag(self._stat())
+
+        if self.thumbnail_width is not None:
+            etag += u'-t{}'.format(self.thumbnail_width)
+        if self.content_encoding is not None:
+            etag += u'-' + self.content_encoding
+
+        return u'"{}"'.format(etag)
+
+    def get_content_size(self):
+        if self.content_data is not None:
+            return len(self.content_data)
+        if self.content_stat is not None:
+            return self.content_stat.st_size
+
+        return super(FileHandler, self).get_content_size()
+
+    def get_content_type(self):
+        if self.content_type is not None:
+            return self.content_type
+
+        return super(FileHandler, self).get_content_type()
+
+    async def use_thumbnail(self, width):
+        """serve the thumbnail of the requested image instead of the image,
+        falls back to the image if no thumbnail can be made
+
+        ETag and Last-Modified still come from the image, the thumbnail file
+        is only used for the content.
+
+        Args:
+            width (str): thumbnail width from the query
+        """
+        try:
+            width = int(width)
+        except ValueError:
+            raise tornado.web.HTTPError(400, u'Invalid thumbnail width: {}'.format(width))
+
+        if not MIN_THUMBNAIL_WIDTH <= width <= MAX_THUMBNAIL_WIDTH:
+            raise tornado.web.HTTPError(400, u'Thumbnail width must be in [{}, {}]'.format(
+                MIN_THUMBNAIL_WIDTH, MAX_THUMBNAIL_WIDTH))
+
+        thumbnail_cache = get_thumbnail_cache()
+        if thumbnail_cache is None or not is_an_image(self.absolute_path):
+            return
+
+        thumbnail_path = await thumbnail_cache.get_thumbnail(
+            self.absolute_path, self._stat_result, width)
+        if thumbnail_path is None:
+            return
+
+        try:
+            thumbnail_stat = await run_in_io_executor(os.stat, thumbnail_path)
+        except OSError:
+            # evicted in the meantime
+            return
+
+        self.absolute_path = thumbnail_path
+        self.thumbnail_width = width
+        self.content_stat = thumbnail_stat
+
+    async def use_compression(self):
+        """serve a gzip/brotli variant of a text file if the client accepts it:
+        the precompressed sidecar file ("name.br"/"name.gz") when there is an
+        up-to-date one, otherwise a cached compressed variant
+
+        Range requests are always served uncompressed.
+        """
+        content_type = self.get_content_type()
+        if not is_compressible(content_type, self._stat_result.st_size):
+            return
+
+        self.set_header('Vary', 'Accept-Encoding')
+
+        if self.request.headers.get('Range'):
+            return
+
+        encoding = choose_encoding(self.request.headers.get('Accept-Encoding'))
+        if encoding is None:
+            return
+
+        sidecar_stat = await run_in_io_executor(
+            stat_sidecar, self.absolute_path, self._stat_result, encoding)
+        if sidecar_stat is not None:
+            self.absolute_path += sidecar_extensions[encoding]
+            self.content_stat = sidecar_stat
+        else:
+            content_data = await run_in_io_executor(
+                compressed_content_cache.get_compressed,
+                self.absolute_path, self._stat_result, encoding)
+            if content_data is None:
+                return
+            self.content_data = content_data
+
+        self.content_type = content_type
+        self.content_encoding = encoding
+        self.set_header('Content-Encoding', encoding)
+
+    def use_content_cache(self):
+        """take the content of the file to send from file_content_cache,
+        without any I/O, if it's cached and unchanged
+        """
+        content = file_content_cache.get(
+            self.absolute_path, self.content_stat or self._stat_result)
+        if content is None:
+            return
+
+        self.content_data = content.data
+        if self.content_type is None:
+            self.content_type = content.content_type
+        if self.thumbnail_width is None and self.content_encoding is None:
+            self.content_etag = content.etag
+
+    async def load_content_cache(self):
+        """read the file to send into file_content_cache, if it's small enough
+        """
+        st = self.content_stat or self._stat_result
+        if not file_content_cache.is_cacheable(st):
+            return
+
+        try:
+            content = await run_in_io_executor(file_content_cache.load, self.absolute_path, st)
+        except OSError:
+            # removed in the meantime, sent (or not) by write_content_chunks()
+            return
+
+        if content is not None:
+            self.content_data = content.data
+
+    async def get(self, path, include_body=True):
+        """get method, same as StaticFileHandler.get() except that stats
+        and file reads run in the io thread pool
+
+        Args:
+            path (str): url path
+            include_body (bool, optional): False for HEAD requests. Defaults to True.
+        """
+        self.path = self.parse_url_path(path)
+        del path
+        absolute_path = self.get_absolute_path(self.root, self.path)
+
+        resolved = path_resolver.resolve_request(self.request, self.root)
+        if resolved.stat is not None and resolved.full_local_path == absolute_path:
+            # stat-ed by the router for this request, and known to be a regular
+            # file under root: what validate_absolute_path() checks
+            self.absolute_path = absolute_path
+            self._stat_result = resolved.stat
+        else:
+            self.absolute_path = await run_in_io_executor(
+                self.validate_absolute_path, self.root, absolute_path)
+            if self.absolute_path is None:
+                return
+
+            # StaticFileHandler._stat() reuses this instead of calling os.stat()
+            try:
+                self._stat_result = await run_in_io_executor(timed_stat, self.absolute_path)
+            except OSError:
+                # removed since validate_absolute_path()
+                raise tornado.web.HTTPError(404)
+
+        thumbnail_width = self.get_query_argument('thumbnail', None)
+        if thumbnail_width is not None:
+            await self.use_thumbnail(thumbnail_width)
+        elif self.compression:
+            await self.use_compression()
+
+        if self.content_data is None:
+            self.use_content_cache()
+
+        self.modified = self.get_modified_time()
+        self.set_headers()
+
+        if self.should_return_304():
+            self.set_status(304)
+            return
+
+        request_range = None
+        range_header = self.request.headers.get("Range")
+        if range_header:
+            # As per RFC 2616 14.16, if an invalid Range header is specified,
+            # the request will be treated as if the header didn't exist.
+            request_range = tornado.httputil._parse_request_range(range_header)
+
+        size = self.get_content_size()
+        if request_range:
+            start, end = request_range
+            if start is not None and start < 0:
+                start += size
+                if start < 0:
+                    start = 0
+            if (
+                start is not None
+                and (start >= size or (end is not None and start >= end))
+            ) or end == 0:
+                self.set_status(416)  # Range Not Satisfiable
+                self.set_header("Content-Type", "text/plain")
+                self.set_header("Content-Range", "bytes */{}".format(size))
+                return
+            if end is not None and end > size:
+                end = size
+            if size != (end or size) - (start or 0):
+                self.set_status(206)  # Partial Content
+                self.set_header(
+                    "Content-Range",
+                    tornado.httputil._get_content_range(start, end, size)
+                )
+        else:
+            start = end = None
+
+        if start is not None and end is not None:
+            content_length = end - start
+        elif end is not None:
+            content_length = end
+        elif start is not None:
+            content_length = size - start
+        else:
+            content_length = size
+        self.set_header("Content-Length", content_length)
+
+        if not include_body:
+            assert self.request.method == "HEAD"
+            return
+
+        try:
+            self.download_slot = download_limiter.acquire(self.request.remote_ip, content_length)
+        except DownloadLimitError as e:
+            write_limit_error(self, e)
+            return
+
+        try:
+            if self.content_data is None:
+                await self.load_content_cache()
+
+            if self.content_data is not None:
+                content_data = self.content_data
+                if start is not None or end is not None:
+                    content_data = content_data[start or 0:end]
+                await self.write_data(content_data)
+            else:
+                start = start or 0
+                if self.can_sendfile(content_length):
+                    sent = await self.sendfile_content(start, content_length)
+                    if sent is None:
+                        return
+                    start += sent
+
+                if start < (end if end is not None else size):
+                    await self.write_content_chunks(start, end)
+        finally:
+            if self.download_slot is not None:
+                self.download_slot.release()
+
+    async def write_data(self, data):
+        """send in-memory content, in chunks within the bandwidth limits if any
+
+        Args:
+            data (bytes): content
+        """
+        chunk_size = len(data)
+        if self.download_slot is not None:
+            chunk_size = self.download_slot.get_send_chunk_size(chunk_size)
+
+        try:
+            for chunk_start in range(0, len(data), max(1, chunk_size)):
+                chunk = data[chunk_start:chunk_start + chunk_size]
+                if self.download_slot is not None:
+                    await self.download_slot.throttle(len(chunk))
+                self.write(chunk)
+                await self.flush()
+        except tornado.iostream.StreamClosedError:
+            return
+
+    async def write_content_chunks(self, start, end):
+        """send the file content through the IOStream, chunk by chunk, with the
+        file reads in the io thread pool
+
+        Args:
+            start (int): first byte
+            end (int): last byte (excluded), None for the end of the file
+        """
+        content = self.get_content(self.absolute_path, start, end)
+        if isinstance(content, bytes):
+            content = iter([content])
+
+        while True:
+            chunk = await run_in_io_executor(next, content, None)
+            if chunk is None:
+                break
+
+            try:
+                if self.download_slot is not None:
+                    await self.download_slot.throttle(len(chunk))
+                self.write(chunk)
+                await self.flush()
+            except tornado.iostream.StreamClosedError:
+                return
+
+    def can_sendfile(self, content_length):
+        """can_sendfile
+
+        Args:
+            content_length (int): number of bytes to send
+
+        Returns:
+            bool: whether the content can be sent with os.sendfile()
+        """
+        if not self.sendfile or not hasattr(os, 'sendfile'):
+            return False
+
+        if content_length < MIN_SENDFILE_SIZE:
+            return False
+
+        # the kernel can't encrypt, and output transforms (e.g. compress_response)
+        # would be bypassed
+        stream = getattr(self.request.connection, 'stream', None)
+        if stream is None or isinstance(stream, tornado.iostream.SSLIOStream):
+            return False
+
+        if not can_skip_expected_content(self.request.connection):
+            return False
+
+        return not self._transforms
+
+    async def sendfile_content(self, start, count):
+        """send the file content with os.sendfile(): the kernel copies it from the
+        page cache to the socket, without going through Python
+
+        The headers are flushed through the IOStream first, the body is then
+        written to the socket directly while the IOStream has nothing to write.
+        Under a bandwidth limit, the content is sent in throttled slices.
+
+        Args:
+            start (int): first byte
+            count (int): number of bytes
+
+        Raises:
+            HTTPError: 404 if the file was removed since it was stat-ed
+
+        Returns:
+            int: number of bytes sent, the rest is to be sent by write_content_chunks();
+                None if the connection is closed
+        """
+        connection = self.request.connection
+        stream = connection.stream
 
-class FolderHandler(tornado.web.RequestHandler):
+        # before the headers are sent, while the response can still be an error
+        try:
+            fp = await run_in_io_executor(open, self.absolute_path, 'rb')
+        except FileNotFoundError:
+            raise tornado.web.HTTPError(404)
+        except OSError as e:
+            logging.info(u'sendfile of {} not possible: {}'.format(self.absolute_path, e))
+            return 0
+
+        chunk_size = count
+        if self.download_slot is not None:
+            chunk_size = self.download_slot.get_send_chunk_size(count)
+
+        sent = 0
+        try:
+            await self.flush()
+
+            while sent < count:
+                num_bytes = min(chunk_size, count - sent)
+                if self.download_slot is not None:
+                    await self.download_slot.throttle(num_bytes)
+                    if stream.closed():
+                        return None
+
+                chunk_sent = await asyncio.get_running_loop().sock_sendfile(
+                    stream.socket, fp, start + sent, num_bytes, fallback=False)
+                sent += chunk_sent
+                if chunk_sent < num_bytes:
+                    # the file was truncated, Content-Length can't be honored
+                    break
+        except tornado.iostream.StreamClosedError:
+            return None
+        except asyncio.SendfileNotAvailableError:
+            pass
+        except OSError as e:
+            # e.g. ECONNRESET, EPIPE: the client is gone
+            logging.info(u'sendfile of {} failed: {}'.format(self.absolute_path, e))
+            stream.close()
+            return None
+        finally:
+            fp.close()
+
+        skip_expected_content(connection, sent)
+        add_sent_bytes(self.request, sent)
+
+        return sent
+
+
+@tornado.web.stream_request_body
+class FolderHandler(StreamingUploadMixin, tornado.web.RequestHandler):
     """Request Handler to list a files under a directory
     """
 
     view_mode_list = ['list', 'preview']
-
-    response_header = u'''
-    <meta http-equiv="Content-Type" content="text/html;charset=ISO-8859-1">
-    <head>
-    <style>
-        h1, h2, h3, h4 {
-        font-family: arial, sans-serif;
-        }
-        table {
-        font-family: arial, sans-serif;
-        border-collapse: collapse;
-        width: 100%;
-        }
-        td, th {
-        border: 1px solid #dddddd;
-        text-align: left;
-        padding: 8px;
-        }
-        tr:nth-child(even) {
-        background-color: #dddddd;
-        }
-    </style>
-    </head>
-    '''
-
-    response_body_beginnings = u'''
-    <body>
-    '''
-    
-    response_content_header_template = u'''
-    <header>
-    <h1>Directory: {}</h1>
-    </header>
-    '''
-
-    response_content_navi_parent_template = u'''
-    <nav>
-    <h4><a href="{}">Go to Parent Dir</a></h4>
-    </nav>   
-    '''
-    
-    response_content_view_mode_template = u'''
-    <h4>View Mode: {} mode (swith to <a href="{}">{}</a> mode)</h4>
-    '''
-
-    response_content_upload_form = u'''
-    <form method="post" enctype="multipart/form-data">
-    <div>
-        <label for="files">Choose and upload files: </label>
-        </br>
-        <input type="file" id="files" name="files" multiple>
-        </br>
-        <button>Upload</button>
-    </div>
-    </form>
-    '''
-
-    response_content_navi_prev_nohref = u'''
-    &lt;Prev
-    '''
-
-    response_content_navi_next_nohref = u'''
-    Next&gt;
-    '''
-
-    response_content_navi_prev_template = u'''
-    <a href="{}">&lt;Prev</a> 
-    '''
-
-    response_content_navi_up_template = u'''
-     <a href="{}">Up</a> 
-    '''
-
-    response_content_navi_next_template = u'''
-     <a href="{}">Next&gt;</a>
-    '''
-
-    response_content_nothing_found = u'''
-    <h4>Nothing under this directory</h4>
-    '''
-
-    response_content_table_summary_template = u'''
-    <h4>{} items in total, {} files, {} folders</h4>
-    <h4>show {} items per page, {} pages</h4>
-    '''
-
-    response_content_table_header = u'''
-    <table style="width:100%;text-align: left">
-    <tr>
-    <th>Name</th>
-    <th>Type</th>
-    <th>Modified Time</th>
-    <th>File Size</th>
-    </tr>
-    '''
-
-    response_content_table_item_template = u'''
-    <tr>
-        <td><a href="{}">{}</a></td>
-        <td>{}</td>
-        <td>{}</td>
-        <td>{}</td>
-    </tr>
-    '''
-
-    response_content_table_footer = u'''
-    </table>
-    '''
-
-    mp_response_content_table_header = u'''
-    <table style="width:100%;text-align: center">
-    '''
-
-    mp_response_content_table_image_item_template = u'''
-        <td>
-            <a href="{}"><img src="{}" width="{}"></a>
-            <a href="{}">{}</a>
-            <br/>
-            <p>
-            Type: {}<br/>
-            Modified:{}<br/>
-            Size: {}
-            </p>
-        </td>
-    '''
-
-    mp_response_content_table_audio_item_template = u'''
-        <td>
-            <audio controls>
-                <source src="{}">
-                Your browser does not support the audio tag.
-            </audio>
-            <br/>
-            <a href="{}">{}</a>
-            <p>
-            Type: {}<br/>
-            Modified:{}<br/>
-            Size: {}
-            </p>
-        </td>
-    '''
-
-    mp_response_content_table_video_item_template = u'''
-        <td>
-            <video width="{}" controls>
-                <source src="{}">
-                Your browser does not support the video tag.
-            </video>
-            <br/>
-            <a href="{}">{}</a>
-            <p>
-            Type: {}<br/>
-            Modified:{}<br/>
-            Size: {}
-            </p>
-        </td>
-    '''
-
-    mp_response_content_table_item_template = u'''
-        <td>
-            <a href="{}">{}</a><br/>
-            <p>
-            Type: {}<br/>
-            Modified:{}<br/>
-            Size: {}
-            </p>
-        </td>
-    '''
-
-    mp_response_content_table_footer = u'''
-    </table>
-    '''
-
-    response_content_footer = u'''
-    <footer>
-    <p><a href="https://github.com/walkoncross/tornado-file-server">github repo</a></p>
-    </footer>
-    '''
-
-    response_body_endings = u'''
-    </body>
-    '''
-
-    upload_response_content_header = u'''
-    <p><a href={}>Back</a></p>
-    <h4>OK</h4>
-    '''
-
-    upload_response_content_item_template = u'''
-    <p><em>{}</em> saved into: <em>{}</em></p>
-    '''
+    # order of the first click on a sort link, the newest and largest first
+    first_sort_order = {SORT_MTIME: SORT_DESC, SORT_SIZE: SORT_DESC}
+    listing_mode_list = ['lazy', 'eager']
 
     def initialize(
         self, 
@@ -383,6 +901,9 @@ class FolderHandler(tornado.web.RequestHandler):
         view_mode='list',
         items_per_row=4,
         image_width=256,
+        listing_mode='lazy',
+        max_upload_size=DEFAULT_MAX_UPLOAD_SIZE,
+        compression=True,
     ):
         """initialize
         Refer to https://www.tornadoweb.org/en/stable/web.html:
@@ -401,19 +922,27 @@ class FolderHandler(tornado.web.RequestHandler):
             view_mode (str, optional): view mode, 'list' or 'preview'. Defaults to 'list'.
             items_per_row (int, optional): _description_. Defaults to 4.
             image_width (int, optional): _description_. Defaults to 256.
+            listing_mode (str, optional): 'lazy' to only stat the items shown on the
+                requested page, 'eager' to stat all items when scanning a folder.
+                Defaults to 'lazy'.
+            max_upload_size (int, optional): max size in bytes of an upload request body.
+                Defaults to DEFAULT_MAX_UPLOAD_SIZE.
+            compression (bool, optional): gzip/brotli compress pages if the client
+                accepts it. Defaults to True.
         """
-        self.last_request_uri_path = ''
         self.uri_path = '/'
         self.parent_uri_path = '/'
+        # ETag of the listing page or listing api response, see set_listing_etag()
+        self.listing_etag = None
 
         if not root_dir:
             self.root_dir = os.getcwd()
         else:
             self.root_dir = osp.abspath(root_dir)
 
-        self.last_folder_mtime = ''
-        self.dir_list = []
-        self.dir_item_info_list = []
+        self.dir_listing = None
+        # the items of dir_listing in the requested sort order
+        self.listing_order = None
 
         self.dir_list_len = 0
         self.sub_folder_cnt = 0
@@ -427,67 +956,11 @@ class FolderHandler(tornado.web.RequestHandler):
         self.items_per_row = items_per_row
         self.image_width = image_width
 
-        self.update_dir_item_info_list()
-
-    def get_file_mtime(self, path):
-        """get_file_mtime
-
-        Args:
-            path (str): file path
-
-        Returns:
-            str: description for file modified time
-        """
-        mt = time.localtime(osp.getmtime(path))
-        tm_str = time.strftime('%y-%m-%d %H:%M:%S', mt)
-
-        return unicode(tm_str)
+        assert(listing_mode in FolderHandler.listing_mode_list)
+        self.listing_mode = listing_mode
 
-    def get_file_type(self, path):
-        """get_file_type
-
-        Args:
-            path (str): file path
-
-        Returns:
-            str: description for file type
-        """
-        ftype = 'unknown'
-        if osp.isdir(path):
-            ftype = 'DIR'
-        elif osp.isfile(path):
-            ext = osp.splitext(path)[1]
-            if ext:
-                ftype = ext
-        elif osp.islink(path):
-            ftype = 'SYMLINK'
-
-        return unicode(ftype)
-
-    def get_file_size(self, path):
-        """get_file_size
-
-        Args:
-            path (str): file path
-
-        Returns:
-            str: description for file size
-        """
-        sz_unit = ['Byte', 'KB', 'MB', 'GB']
-
-        if osp.isfile(path):
-            sz = float(osp.getsize(path))
-
-            unit_idx = 0
-            while (sz > 1024):
-                sz = sz / 1024
-                unit_idx += 1
-
-            sz_str = '%.3f %s' % (sz, sz_unit[unit_idx])
-        else:
-            sz_str = '-'
-
-        return unicode(sz_str)
+        self.max_upload_size = max_upload_size
+        self.compression = compression
 
     def update_dir_item_info_list(self):
         """update_dir_item_info_list
@@ -496,11 +969,7 @@ class FolderHandler(tornado.web.RequestHandler):
         # e.g. "%20" into " "
         self.uri_path = self.request.path
 
-        unquoted_uri_path = tornado.escape.url_unescape(self.request.path)
-
-        logging.info(
-            u'===> Update folder dir_info: {}'.format(unquoted_uri_path)
-        )
+        logging.debug(u'===> Update folder dir_info: %s', self.request.path)
         # print('===> Update folder dir_info: {}'.format(unquoted_uri_path))
         # print('type(unquoted_uri_path: {}'.format(type(self.request.path)))
 
@@ -512,236 +981,143 @@ class FolderHandler(tornado.web.RequestHandler):
             else:
                 self.parent_uri_path = osp.dirname(self.request.path)
 
-        # use unicode to deal with Chinese characters
-        full_local_path = get_full_local_path_for_url(
-            self.uri_path, self.root_dir)
-        #logging.info("===>full_local_path: {}".format(full_local_path))
-        # print('--> full_local_path: ', full_local_path)
+        # resolved by the router, use unicode to deal with Chinese characters
+        resolved = path_resolver.resolve_request(self.request, self.root_dir)
+        #logging.info("===>full_local_path: {}".format(resolved.full_local_path))
+        # print('--> full_local_path: ', resolved.full_local_path)
 
-        self.last_folder_mtime = self.get_file_mtime(full_local_path)
-
-        self.dir_list = os.listdir(full_local_path)
-        # os.listdir() returns a list in arbitray order on Linux filesystem
-
-        if sys.platform != 'win32':
-            self.dir_list = sorted(self.dir_list, key=lambda s: s.lower())
-
-        self.dir_list_len = len(self.dir_list)
-        self.dir_item_info_list = []
+        try:
+            self.dir_listing = dir_listing_cache.get_or_scan(
+                resolved.full_local_path, self.scan_dir_listing, resolved.stat)
+        except (FileNotFoundError, NotADirectoryError):
+            # removed or replaced by a file since its type was cached
+            path_resolver.invalidate(resolved.full_local_path)
+            raise tornado.web.HTTPError(404)
+
+        self.dir_list_len = len(self.dir_listing)
+        self.sub_folder_cnt = self.dir_listing.sub_folder_cnt
         self.max_page_id = 1
-        # self.last_request_uri_path = self.request.path
-        self.sub_folder_cnt = 0
 
         if self.dir_list_len > 0:
             #logging.info("===>Found {} files/folders".format(self.dir_list_len))
             self.max_page_id = int(math.ceil(
                 self.dir_list_len / float(self.items_per_page)))
 
-            for item in self.dir_list:
-                # print('--> type(item): ', type(item))
-                # print(item)
-                if not isinstance(item, unicode):
-                    raise(AssertionError(
-                        "File name must can be encoded into Unicode"))
+    def scan_dir_listing(self, full_local_path, dir_stat):
+        """scan a local folder into a DirListing
+
+        Args:
+            full_local_path (str): full local path of the folder
+            dir_stat (os.stat_result): stat of the folder
 
-                item_name_utf = item
+        Returns:
+            DirListing: listing of the folder
+        """
+        logging.info(u'===> Scan folder: %s', full_local_path)
+        items = scan_dir(full_local_path, lazy=(self.listing_mode == 'lazy'))
 
-                # if not is_python3():
-                #     item_name_utf = item.decode('utf-8') # convert to unicode
+        # the folder changed (or was never listed), its cached size is refreshed
+        # the next time a page shows it, unless the tree watcher keeps it up to date
+        folder_size_cache = get_folder_size_cache()
+        if folder_size_cache is not None:
+            folder_size_cache.expire(full_local_path)
 
-                # print('--> type(item_name_utf): ', type(item_name_utf))
-                # print(item_name_utf)
+        return DirListing(full_local_path, dir_stat, items)
 
-                item_full_path = osp.join(full_local_path, item_name_utf)
-                # logging.info(u'item local path:', item_full_path)
-                if osp.isdir(item_full_path):
-                    self.sub_folder_cnt += 1
+    def get_page_items(self, items):
+        """get the display info of the stat-ed items of a page
 
-                modify_time = self.get_file_mtime(item_full_path)
-                #logging.info(u'modify time: {}'.format(modify_time))
-                file_type = self.get_file_type(item_full_path)
-                #logging.info(u'file type: {}'.format(file_type))
-                file_size = self.get_file_size(item_full_path)
-                #logging.info(u'file size: {}'.format(file_size))
+        Args:
+            items (list): stat-ed items of the page, see ListingOrder.stat_items()
 
-                # item_name_utf = item
-                # item_name_utf = tornado.escape.to_unicode(item)
+        Returns:
+            list: (uri, html_name, html_file_type, mtime, size, media, image_src) tuples,
+                see page_templates.py
+        """
+        # url-escaped names need no html escaping, only the folder path does
+        uri_prefix = tornado.escape.xhtml_escape(self.request.path)
+        if not uri_prefix.endswith('/'):
+            uri_prefix += '/'
 
-                # print('--> type(item_name_utf): ', type(item_name_utf))
-                # print(item_name_utf)
+        page_items = []
+        for item in items:
+            file_type, mtime, size, media = get_item_cells(item)
 
-                # print('--> type(self.request.path): ', type(self.request.path))
+            uri = uri_prefix + item.escaped_name
+            if item.is_dir:
+                uri += '/'
+                size = self.get_folder_size_info(item)
 
-                item_uri_path = tornado.escape.url_escape(item_name_utf, plus=False)
-                # print('--> type(item_uri_path): ', type(item_uri_path))
-                # print(item_uri_path)
-                # item_uri_path = item
+            image_src = self.get_image_src(uri) if media == MEDIA_IMAGE else None
+            page_items.append((uri, item.html_name, file_type, mtime, size, media, image_src))
 
-                item_uri_path = osp.join(self.request.path, item_uri_path)
+        return page_items
 
-                if file_type == 'DIR':
-                    item_uri_path += '/'
+    def get_folder_size(self, item):
+        """get the cached recursive size of a folder item, never blocks
 
-                # print('--> type(item_uri_path): ', type(item_uri_path))
-                # print(item_uri_path)
+        Args:
+            item (DirItem): folder item of the listing
 
-                # logging.info(u'===> link url: {}'.format(item_uri_path))
-                #item_uri_path = self.reverse_url(item)
+        Returns:
+            FolderSize: the size, None if folder sizes are disabled or not computed yet
+        """
+        folder_size_cache = get_folder_size_cache()
+        if folder_size_cache is None:
+            return None
 
-                self.dir_item_info_list.append(
-                    (item_uri_path, item_name_utf,
-                     file_type, modify_time, file_size)
-                )
+        return folder_size_cache.get(osp.join(self.dir_listing.local_path, item.name))
 
-    def get_response_content_table_in_list_mode(self, start_idx, end_idx):
-        """get_response_content_table_in_list_mode
+    def get_folder_size_info(self, item):
+        """get_folder_size_info
 
         Args:
-            start_idx (int): _description_
-            end_idx (int): _description_
+            item (DirItem): folder item of the listing
 
         Returns:
-            str: _description_
+            str: description of the recursive size of the folder
         """
-        response_content_table = FolderHandler.response_content_table_header
-
-        for ii in range(start_idx, end_idx):
-            item_info = self.dir_item_info_list[ii]
-            # logging.info(
-            #     u'item_info: {}'.format(item_info)
-            # )
-
-            # for ii,info in enumerate(item_info):
-            #     print('item_info[{}]: ', ii)
-            #     print('type:', type(info))
-            #     print(info)
-
-            response_content_table += FolderHandler.response_content_table_item_template.format(
-                # unicode(item_info[0]),
-                # unicode(item_info[1]),
-                # unicode(item_info[2]),
-                # unicode(item_info[3]),
-                # unicode(item_info[4])
-                item_info[0],
-                item_info[1],
-                item_info[2],
-                item_info[3],
-                item_info[4]
-            )
+        if get_folder_size_cache() is None:
+            return format_file_size(None)
 
-        response_content_table += FolderHandler.response_content_table_footer
+        folder_size = self.get_folder_size(item)
+        if folder_size is None:
+            return u'computing&hellip;'
 
-        return response_content_table
+        return u'{} ({} files)'.format(
+            format_file_size(folder_size.total_size), folder_size.file_count)
 
-    def get_response_content_table_in_preview_mode(self, start_idx, end_idx):
-        """get_response_content_table_in_preview_mode
+    def get_dir_item_uri(self, item):
+        """get_dir_item_uri
 
         Args:
-            start_idx (int): _description_
-            end_idx (int): _description_
+            item (DirItem): item of the listing
 
         Returns:
-            str: _description_
+            str: uri of the item in current folder, folders end with '/'
         """
-        
-        response_content_table = FolderHandler.mp_response_content_table_header
-
-        table_row = ""
-        items_per_row = self.items_per_row
-        # print('items_per_row: ', items_per_row)
-        add_row_header = True
-        # add_row_footer = True
-
-        for ii in range(start_idx, end_idx):
-            item_info = self.dir_item_info_list[ii]
-            # logging.info(
-            #     u'item_info: {}'.format(item_info)
-            # )
-
-            # for ii,info in enumerate(item_info):
-            #     print('item_info[{}]: ', ii)
-            #     print('type:', type(info))
-            #     print(info)
-            if add_row_header:
-                table_row = "<tr>"
-                add_row_header = False
-
-            if is_an_image(item_info[0]):
-                table_row += FolderHandler.mp_response_content_table_image_item_template.format(
-                    # unicode(item_info[0]),
-                    # unicode(item_info[1]),
-                    # unicode(item_info[2]),
-                    # unicode(item_info[3]),
-                    # unicode(item_info[4])
-                    item_info[0],
-                    item_info[0],
-                    self.image_width,
-                    item_info[0],
-                    item_info[1],
-                    item_info[2],
-                    item_info[3],
-                    item_info[4]
-                )
-            elif is_supported_audio(item_info[0]):
-                table_row += FolderHandler.mp_response_content_table_audio_item_template.format(
-                    # unicode(item_info[0]),
-                    # unicode(item_info[1]),
-                    # unicode(item_info[2]),
-                    # unicode(item_info[3]),
-                    # unicode(item_info[4])
-                    item_info[0],
-                    item_info[0],
-                    item_info[1],
-                    item_info[2],
-                    item_info[3],
-                    item_info[4]
-                )
-            elif is_supported_video(item_info[0]):
-                table_row += FolderHandler.mp_response_content_table_video_item_template.format(
-                    # unicode(item_info[0]),
-                    # unicode(item_info[1]),
-                    # unicode(item_info[2]),
-                    # unicode(item_info[3]),
-                    # unicode(item_info[4])
-                    self.image_width,
-                    item_info[0],
-                    item_info[0],
-                    item_info[1],
-                    item_info[2],
-                    item_info[3],
-                    item_info[4]
-                )
-            else:
-                table_row += FolderHandler.mp_response_content_table_item_template.format(
-                    # unicode(item_info[0]),
-                    # unicode(item_info[1]),
-                    # unicode(item_info[2]),
-                    # unicode(item_info[3]),
-                    # unicode(item_info[4])
-                    item_info[0],
-                    item_info[1],
-                    item_info[2],
-                    item_info[3],
-                    item_info[4]
-                )
+        item_uri_path = osp.join(self.request.path, item.escaped_name)
 
-            if (ii - start_idx + 1) % items_per_row == 0:
-                table_row += "</tr>"
-                add_row_header = True
+        if item.is_dir:
+            item_uri_path += '/'
 
-                response_content_table += table_row
+        return item_uri_path
 
-        if ii > start_idx and (ii - start_idx + 1) % items_per_row > 0:
-            table_row += "</tr>"
-            add_row_header = True
+    def get_image_src(self, uri):
+        """get_image_src
 
-            response_content_table += table_row
+        Args:
+            uri (str): uri of an image
 
-        response_content_table += FolderHandler.mp_response_content_table_footer
+        Returns:
+            str: uri of its thumbnail, or of the image itself if thumbnails are disabled
+        """
+        if get_thumbnail_cache() is None:
+            return uri
 
-        return response_content_table
+        return u'{}?thumbnail={}'.format(uri, self.image_width)
 
-    def get(self, path):
+    async def get(self, path):
         """get method
 
         Args:
@@ -759,9 +1135,7 @@ class FolderHandler(tornado.web.RequestHandler):
         # if path == '':
         #     path = '/'
 
-        logging.info(
-            u'GET folder uri: {}'.format(self.request.uri)
-        )
+        logging.debug(u'GET folder uri: %s', self.request.uri)
 
         # print('===> request.uri: ', self.request.uri)
         # print('===> request.path: ', self.request.path)
@@ -771,184 +1145,765 @@ class FolderHandler(tornado.web.RequestHandler):
         # for kk, vv in self.request.arguments.items():
         #     print('type(kk): {}, type(vv): {}', type(kk), type(vv))
 
-        if self.request.path != self.last_request_uri_path:
-            logging.info(
-                u'===> Last request uri path: {}'.format(
-                    self.last_request_uri_path)
-            )
-            self.update_dir_item_info_list()
-        else:
-            full_local_path = get_full_local_path_for_url(
-                self.request.path, self.root_dir)
-            mtime = self.get_file_mtime(full_local_path)
+        upload_id = self.get_query_argument('upload_id', None)
+        if upload_id is not None:
+            upload = await self.get_chunked_upload(upload_id)
+            # lists the chunk marker files
+            self.write(await run_in_io_executor(upload.to_dict))
+            return
+
+        archive_format = self.get_query_argument('download', None)
+        if archive_format is not None:
+            await self.get_archive(archive_format)
+            return
 
-            if mtime != self.last_folder_mtime:
-                self.update_dir_item_info_list()
+        encoding = None
+        if self.compression:
+            encoding = choose_encoding(self.request.headers.get('Accept-Encoding'))
+            self.set_header('Vary', 'Accept-Encoding')
+
+        listing_format = self.get_query_argument('format', None)
+        if listing_format is not None:
+            await self.get_listing(listing_format, encoding)
+            return
 
         page_id = self.get_query_argument(name="page_id", default='1')
         view_mode = self.get_query_argument(name="view_mode", default=self.view_mode)
+        sort, order = self.get_sort_arguments()
 
-        if view_mode not in FolderHandler.view_mode_list:
-            view_mode = self.view_mode
+        # scanning, rendering and compression run in the io thread pool, the
+        # IOLoop thread only does socket I/O
+        await run_in_io_executor(self.update_dir_item_info_list)
+        etag = await run_in_io_executor(
+            self.get_page_etag, page_id, view_mode, sort, order, encoding)
+        if self.set_listing_etag(etag):
+            return
 
-        switch_mode = ''
-        for mode in FolderHandler.view_mode_list:
-            if mode != view_mode:
-                switch_mode = mode
-                break
+        response_body = await run_in_io_executor(
+            self.get_response_body, page_id, view_mode, sort, order, encoding)
 
-        logging.info(
-            u'page_id: {}'.format(page_id)
-        )
+        if encoding is not None:
+            self.set_header('Content-Encoding', encoding)
+
+        self.write(response_body)
+
+    def get_page_etag(self, page_id, view_mode, sort, order, encoding=None):
+        """get the ETag of an html page, runs in the io thread pool, after
+        update_dir_item_info_list()
+
+        Args:
+            page_id (str): page_id query argument
+            view_mode (str): view_mode query argument
+            sort (str): one of sort_list
+            order (str): one of sort_order_list
+            encoding (str, optional): content encoding. Defaults to None.
+
+        Returns:
+            str: ETag, see get_listing_etag()
+        """
+        self.listing_order = self.dir_listing.get_order(sort, order)
+
+        page_id = self.get_page_id(page_id)
+        start_idx = self.items_per_page * (page_id - 1)
+        end_idx = min(self.items_per_page * page_id, self.dir_list_len)
+
+        return self.get_listing_etag(
+            start_idx, end_idx, ('html', page_id, view_mode, sort, order, encoding))
+
+    def get_listing_page_etag(self, listing_format, cursor, limit, sort, order, encoding=None):
+        """get the ETag of a page of the listing api, runs in the io thread pool,
+        after update_dir_item_info_list()
+
+        Args:
+            see get_listing_body()
+
+        Raises:
+            InvalidCursorError: if the cursor is invalid
+
+        Returns:
+            str: ETag, see get_listing_etag()
+        """
+        self.listing_order = self.dir_listing.get_order(sort, order)
+        start_idx, end_idx, _ = get_listing_page(self.listing_order, cursor, limit)
+
+        return self.get_listing_etag(
+            start_idx, end_idx, (listing_format, cursor, limit, sort, order, encoding))
+
+    def get_listing_etag(self, start_idx, end_idx, response_args):
+        """get the ETag of a listing response, blocking
+
+        Made of the inode and mtime of the folder, a digest of its entry names,
+        the arguments of the response, and the metadata and folder sizes of the
+        items it shows, so it is the same in every server process and only
+        changes with what the response shows. Weak: cursors in listing api
+        responses differ between processes.
+
+        Args:
+            start_idx (int): index of the first item of the response in self.listing_order
+            end_idx (int): index after the last item
+            response_args (tuple): arguments the response depends on (format, page,
+                view mode, sort, content encoding...)
+
+        Returns:
+            str: ETag
+        """
+        page_items = self.listing_order.stat_items(start_idx, end_idx)
+
+        sha1 = hashlib.sha1(self.dir_listing.get_names_digest())
+        sha1.update(repr(response_args).encode('utf-8'))
+        for item in page_items:
+            folder_size = self.get_folder_size(item) if item.is_dir else None
+            sha1.update(repr((
+                item.name, item.file_type, item.size, item.mtime,
+                (folder_size.total_size, folder_size.file_count)
+                if folder_size is not None else None
+            )).encode('utf-8'))
+
+        return u'W/"{:x}-{:x}-{}"'.format(
+            self.dir_listing.ino, self.dir_listing.mtime_ns, sha1.hexdigest()[:16])
+
+    def set_listing_etag(self, etag):
+        """set the ETag and Last-Modified headers of a listing response, and
+        answer 304 Not Modified if the client has it already
+
+        Last-Modified is the mtime of the folder, only informative: sizes and
+        mtimes of the items can change without it, so If-Modified-Since alone
+        never gets a 304.
+
+        Args:
+            etag (str): see get_listing_etag()
+
+        Returns:
+            bool: True if the response was finished with a 304
+        """
+        self.listing_etag = etag
+
+        self.set_etag_header()
+        self.set_header('Last-Modified', tornado.httputil.format_timestamp(
+            self.dir_listing.mtime_ns / 1e9))
+        # cached, but revalidated on every visit
+        self.set_header('Cache-Control', 'no-cache')
+
+        if self.check_etag_header():
+            self.set_status(304)
+            self.finish()
+            return True
+
+        return False
+
+    def compute_etag(self):
+        """compute_etag, the listing ETag instead of a hash of the response body
+        if there is one
+
+        Returns:
+            str: Etag
+        """
+        if self.listing_etag is not None:
+            return self.listing_etag
+
+        return super(FolderHandler, self).compute_etag()
+
+    def get_page_id(self, page_id):
+        """get_page_id
+
+        Args:
+            page_id (str): page_id query argument
+
+        Returns:
+            int: page id, 1 if invalid or out of range
+        """
+        logging.debug(u'page_id: %s', page_id)
 
         try:
             page_id = int(page_id)
         except:
             page_id = 1
 
-        logging.info(
-            u'max_page_id: {}'.format(self.max_page_id)
-        )
+        logging.debug(u'max_page_id: %s', self.max_page_id)
 
-        if page_id > self.max_page_id:
+        if page_id > self.max_page_id or page_id < 1:
             page_id = 1
 
-        logging.info(
-            u'page_id after check: {}'.format(page_id)
-        )
+        logging.debug(u'page_id after check: %s', page_id)
+
+        return page_id
+
+    def get_sort_arguments(self, strict=False):
+        """get the sort and order query arguments
+
+        Args:
+            strict (bool, optional): raise a 400 error on invalid values instead
+                of using the defaults. Defaults to False.
+
+        Returns:
+            tuple: (sort, order), one of sort_list and one of sort_order_list
+        """
+        sort = self.get_query_argument('sort', SORT_NAME)
+        order = self.get_query_argument('order', SORT_ASC)
+
+        if strict and (sort not in sort_list or order not in sort_order_list):
+            raise tornado.web.HTTPError(
+                400, u'Invalid sort={}&order={}, must be one of {} and one of {}'.format(
+                    sort, order, sort_list, sort_order_list))
+
+        if sort not in sort_list:
+            sort = SORT_NAME
+        if order not in sort_order_list:
+            order = SORT_ASC
+
+        return sort, order
+
+    def get_page_uri(self, page_id, view_mode, sort, order):
+        """get_page_uri
+
+        Args:
+            page_id (int): page id
+            view_mode (str): view mode
+            sort (str): sort, left out of the uri if by name
+            order (str): sort order, left out of the uri if ascending
 
-        response_content = FolderHandler.response_body_beginnings 
-        response_content += FolderHandler.response_content_header_template.format(
-            tornado.escape.url_unescape(self.uri_path))
-        response_content += FolderHandler.response_content_navi_parent_template.format(
-            self.parent_uri_path)
-
-        switch_mode_arguments = {}
-        # switch_mode_arguments = self.request.arguments.copy()
-        switch_mode_arguments['view_mode'] = switch_mode
-        if 'page_id' in self.request.arguments:
-            switch_mode_arguments['page_id'] = int(self.request.arguments['page_id'][0])
-
-        switch_mode_url = self.request.path + '?' + urlencode(switch_mode_arguments)
-
-        response_content += FolderHandler.response_content_view_mode_template.format(
-                                view_mode,
-                                switch_mode_url,
-                                switch_mode
-                            )
-        response_content += FolderHandler.response_content_upload_form
-
-        if self.dir_list_len < 1:
-            response_content += FolderHandler.response_content_nothing_found
-            # logging.info(response_content)
+        Returns:
+            str: uri of a page of this folder
+        """
+        arguments = [('page_id', page_id), ('view_mode', view_mode)]
+        if sort != SORT_NAME:
+            arguments.append(('sort', sort))
+        if order != SORT_ASC:
+            arguments.append(('order', order))
+
+        return self.request.path + '?' + urlencode(arguments)
+
+    async def get_archive(self, archive_format):
+        """stream a zip or tar archive of the folder tree, see archives.py
+
+        tar archives have a Content-Length and support Range requests (and
+        If-Range with their ETag) to resume a download.
+
+        Args:
+            archive_format (str): one of archive_format_list
+        """
+        if archive_format not in archive_format_list:
+            raise tornado.web.HTTPError(
+                400, u'Invalid download format: {}, must be one of {}'.format(
+                    archive_format, archive_format_list))
+
+        full_local_path = path_resolver.resolve_request(
+            self.request, self.root_dir).full_local_path
+        archive_name = get_archive_name(full_local_path, archive_format)
+        base_name = osp.splitext(archive_name)[0]
+
+        self.set_header('Content-Type', archive_content_types[archive_format])
+        # ascii fallback for old clients, the utf-8 name for the others
+        ascii_name = archive_name.encode('ascii', 'replace').decode('ascii').replace('"', '_')
+        self.set_header('Content-Disposition', u"attachment; filename=\"{}\"; filename*=UTF-8''{}".format(
+            ascii_name, tornado.escape.url_escape(archive_name, plus=False)))
+        self.set_header('Cache-Control', 'no-store')
+
+        if archive_format == ARCHIVE_TAR:
+            archive = await run_in_io_executor(build_tar_archive, full_local_path, base_name)
+            request_range = self.get_archive_range(archive)
+            if request_range is None:
+                return
+            chunks = archive.iter_range(*request_range)
         else:
-            response_content += FolderHandler.response_content_table_summary_template.format(
-                self.dir_list_len,
-                self.dir_list_len - self.sub_folder_cnt,
-                self. sub_folder_cnt,
-                self.items_per_page,
-                self.max_page_id
-            )
+            # size unknown until the end, sent with chunked transfer encoding
+            chunks = iter_zip(full_local_path, base_name,
+                              deflate=archive_format == ARCHIVE_ZIP_DEFLATE)
 
-            content_navi = u''
-            prev_page_id = page_id-1
-            if prev_page_id < 1:
-                content_navi += FolderHandler.response_content_navi_prev_nohref
-            else:
-                content_navi += FolderHandler.response_content_navi_prev_template.format(
-                    self.request.path + '?page_id={}&view_mode={}'.format(prev_page_id, view_mode)
-                )
+        try:
+            # zip archives: size unknown, always a download
+            download_slot = download_limiter.acquire(
+                self.request.remote_ip,
+                request_range[1] - request_range[0] if archive_format == ARCHIVE_TAR else None)
+        except DownloadLimitError as e:
+            chunks.close()
+            write_limit_error(self, e)
+            return
+
+        logging.info(u'===> Start streaming {} of {}'.format(archive_name, full_local_path))
+
+        try:
+            while True:
+                chunk = await run_in_io_executor(next, chunks, None)
+                if chunk is None:
+                    break
+
+                if download_slot is not None:
+                    await download_slot.throttle(len(chunk))
+                # waits for the client: a slow client slows down the reads
+                self.write(chunk)
+                await self.flush()
+        except tornado.iostream.StreamClosedError:
+            logging.info(u'===> Client left while streaming {}'.format(archive_name))
+        finally:
+            # closes the file being read, if any
+            chunks.close()
+            if download_slot is not None:
+                download_slot.release()
+
+    def get_archive_range(self, archive):
+        """set the status and headers of a tar archive response from the Range header
+
+        Args:
+            archive (TarArchive): archive layout
 
-            content_navi += FolderHandler.response_content_navi_up_template.format(
-                self.parent_uri_path)
+        Returns:
+            tuple: (start, end) byte range to send, None if the range is not satisfiable
+        """
+        size = archive.size
+        start, end = 0, size
+
+        self.set_header('Accept-Ranges', 'bytes')
+        self.set_header('ETag', archive.etag)
+
+        range_header = self.request.headers.get('Range')
+        if_range = self.request.headers.get('If-Range')
+        request_range = None
+        if range_header and (if_range is None or if_range == archive.etag):
+            # as for files, an invalid Range header is ignored
+            request_range = tornado.httputil._parse_request_range(range_header)
+
+        if request_range:
+            start, end = request_range
+            if start is None:
+                start = 0
+            elif start < 0:
+                start = max(size + start, 0)
+            if end is None or end > size:
+                end = size
+
+            if start >= end:
+                self.set_status(416)  # Range Not Satisfiable
+                self.set_header('Content-Type', 'text/plain')
+                self.set_header('Content-Range', 'bytes */{}'.format(size))
+                return None
+
+            if end - start != size:
+                self.set_status(206)  # Partial Content
+                self.set_header(
+                    'Content-Range', tornado.httputil._get_content_range(start, end, size))
+
+        self.set_header('Content-Length', end - start)
+
+        return start, end
+
+    async def get_listing(self, listing_format, encoding=None):
+        """write a page of the folder listing as JSON or NDJSON, see listing_api.py
+
+        Query arguments: cursor (from the previous page), limit (max number of items).
+        The cursor of the next page is in the X-Next-Cursor header, and also in
+        the "next_cursor" field of JSON pages.
 
-            next_page_id = page_id+1
-            if next_page_id > self.max_page_id:
-                content_navi += FolderHandler.response_content_navi_next_nohref
+        Args:
+            listing_format (str): 'json' or 'ndjson'
+            encoding (str, optional): content encoding. Defaults to None.
+        """
+        if listing_format not in listing_format_list:
+            raise tornado.web.HTTPError(
+                400, u'Invalid format: {}, must be one of {}'.format(
+                    listing_format, listing_format_list))
+
+        try:
+            limit = int(self.get_query_argument('limit', DEFAULT_LISTING_LIMIT))
+        except ValueError:
+            raise tornado.web.HTTPError(400, u'Invalid limit')
+        limit = max(1, min(limit, MAX_LISTING_LIMIT))
+
+        cursor = self.get_query_argument('cursor', None)
+        sort, order = self.get_sort_arguments(strict=True)
+
+        await run_in_io_executor(self.update_dir_item_info_list)
+        try:
+            etag = await run_in_io_executor(
+                self.get_listing_page_etag, listing_format, cursor, limit, sort, order,
+                encoding)
+            if self.set_listing_etag(etag):
+                return
+
+            response_body, next_cursor = await run_in_io_executor(
+                self.get_listing_body, listing_format, cursor, limit, sort, order, encoding)
+        except InvalidCursorError as e:
+            raise tornado.web.HTTPError(400, str(e))
+
+        if listing_format == 'json':
+            self.set_header('Content-Type', 'application/json; charset=UTF-8')
+        else:
+            self.set_header('Content-Type', 'application/x-ndjson; charset=UTF-8')
+
+        if next_cursor is not None:
+            self.set_header('X-Next-Cursor', next_cursor)
+
+        if encoding is not None:
+            self.set_header('Content-Encoding', encoding)
+
+        self.write(response_body)
+
+    def get_listing_body(self, listing_format, cursor, limit, sort, order, encoding=None):
+        """get the encoded listing page, runs in the io thread pool, after
+        update_dir_item_info_list()
+
+        Args:
+            listing_format (str): 'json' or 'ndjson'
+            cursor (str): cursor of the page, None for the first one
+            limit (int): max number of items
+            sort (str): one of sort_list
+            order (str): one of sort_order_list
+            encoding (str, optional): content encoding. Defaults to None.
+
+        Returns:
+            tuple: (response_body, next_cursor)
+        """
+        self.listing_order = self.dir_listing.get_order(sort, order)
+
+        start_idx, end_idx, next_cursor = get_listing_page(self.listing_order, cursor, limit)
+        page_items = self.listing_order.stat_items(start_idx, end_idx)
+        items = [
+            get_item_dict(item, self.get_dir_item_uri(item),
+                          self.get_folder_size(item) if item.is_dir else None)
+            for item in page_items
+        ]
+
+        if listing_format == 'json':
+            response_content = json.dumps({
+                'path': tornado.escape.url_unescape(self.uri_path),
+                'generation': self.dir_listing.generation,
+                'sort': sort,
+                'order': order,
+                'total': self.dir_list_len,
+                'sub_folder_cnt': self.sub_folder_cnt,
+                'items': items,
+                'next_cursor': next_cursor,
+            })
+        else:
+            response_content = ''.join(json.dumps(item) + '\n' for item in items)
+
+        response_body = tornado.escape.utf8(response_content)
+
+        if encoding is not None:
+            response_body = compress(response_body, encoding)
+
+        return response_body, next_cursor
+
+    def get_response_body(self, page_id, view_mode, sort, order, encoding=None):
+        """get the encoded html page, runs in the io thread pool, after
+        update_dir_item_info_list()
+
+        Args:
+            page_id (str): page_id query argument
+            view_mode (str): view_mode query argument
+            sort (str): one of sort_list
+            order (str): one of sort_order_list
+            encoding (str, optional): content encoding, ENCODING_BROTLI or ENCODING_GZIP.
+                Defaults to None (no compression).
+
+        Returns:
+            bytes: response body
+        """
+        response_body = self.get_response_content(page_id, view_mode, sort, order)
+
+        if encoding is not None:
+            response_body = compress(response_body, encoding)
+
+        return response_body
+
+    def get_response_content(self, page_id, view_mode, sort=SORT_NAME, order=SORT_ASC):
+        """get_response_content, runs in the io thread pool, after
+        update_dir_item_info_list()
+
+        Args:
+            page_id (str): page_id query argument
+            view_mode (str): view_mode query argument
+            sort (str, optional): one of sort_list. Defaults to SORT_NAME.
+            order (str, optional): one of sort_order_list. Defaults to SORT_ASC.
+
+        Returns:
+            bytes: utf-8 encoded html page of the requested page
+        """
+        self.listing_order = self.dir_listing.get_order(sort, order)
+
+        if view_mode not in FolderHandler.view_mode_list:
+            view_mode = self.view_mode
+
+        switch_mode = ''
+        for mode in FolderHandler.view_mode_list:
+            if mode != view_mode:
+                switch_mode = mode
+                break
+
+        page_id = self.get_page_id(page_id)
+
+        switch_mode_uri = self.get_page_uri(page_id, switch_mode, sort, order)
+
+        prev_uri = None
+        if page_id > 1:
+            prev_uri = self.get_page_uri(page_id - 1, view_mode, sort, order)
+
+        next_uri = None
+        if page_id < self.max_page_id:
+            next_uri = self.get_page_uri(page_id + 1, view_mode, sort, order)
+
+        # uris of the sort links, clicking the current sort reverses it
+        sort_uris = {}
+        for link_sort in sort_list:
+            if link_sort == sort:
+                link_order = SORT_DESC if order == SORT_ASC else SORT_ASC
             else:
-                content_navi += FolderHandler.response_content_navi_next_template.format(
-                    self.request.path + '?page_id={}&view_mode={}'.format(next_page_id, view_mode)
-                )
+                link_order = FolderHandler.first_sort_order.get(link_sort, SORT_ASC)
+            sort_uris[link_sort] = self.get_page_uri(1, view_mode, link_sort, link_order)
 
-            response_content += content_navi
-            #logging.info(u"===>Found {} files/folders".format(self.dir_list_len))
- 
+        items = []
+        if self.dir_list_len > 0:
             start_idx = self.items_per_page * (page_id-1)
             end_idx = min(self.items_per_page * page_id, self.dir_list_len)
 
-            if view_mode == 'preview':
-                response_content_table = self.get_response_content_table_in_preview_mode(start_idx, end_idx)            
-            else:
-                response_content_table = self.get_response_content_table_in_list_mode(start_idx, end_idx)
-            response_content += response_content_table
+            # stats the items not stat-ed yet, and the ones stat-ed too long ago
+            items = self.get_page_items(self.listing_order.stat_items(start_idx, end_idx))
+
+        dir_path = tornado.escape.url_unescape(self.uri_path)
+
+        return render_page(
+            'folder.html',
+            dir_path=dir_path,
+            parent_uri=self.parent_uri_path,
+            folder_uri=self.request.path,
+            view_mode=view_mode,
+            switch_mode=switch_mode,
+            switch_mode_uri=switch_mode_uri,
+            sort=sort,
+            order=order,
+            sort_uris=sort_uris,
+            sort_columns=sort_columns,
+            search_path=SEARCH_PATH if get_search_index() is not None else None,
+            search_query=u'',
+            search_mode=search_mode_list[0],
+            search_modes=search_mode_list,
+            search_scope=dir_path,
+            total_cnt=self.dir_list_len,
+            sub_folder_cnt=self.sub_folder_cnt,
+            items_per_page=self.items_per_page,
+            max_page_id=self.max_page_id,
+            prev_uri=prev_uri,
+            next_uri=next_uri,
+            items=items,
+            items_per_row=self.items_per_row,
+            image_width=self.image_width,
+        )
 
-            # response_content += FolderHandler.response_content_upload_form
-            if end_idx - start_idx >= 10:
-                response_content += content_navi
+    async def prepare(self):
+        """prepare, set up the streaming of the request body for uploads
+        """
+        self.init_upload_state()
+        self.upload_parser = None
+        self.uploaded_files = []
+        self.upload_body = None
+
+        if self.request.method not in ('POST', 'PUT'):
+            return
+
+        self.upload_save_dir = path_resolver.resolve_request(
+            self.request, self.root_dir).full_local_path
+        upload_id = self.get_query_argument('upload_id', None)
+
+        if self.request.method == 'PUT':
+            # one chunk of a chunked upload
+            if upload_id is None:
+                raise tornado.web.HTTPError(400, u'upload_id is required')
+
+            upload = await self.get_chunked_upload(upload_id)
+            try:
+                index = int(self.get_query_argument('chunk'))
+                writer = ChunkWriter(upload, index)
+                offset = self.get_query_argument('offset', None)
+                if offset is not None and int(offset) != writer.offset:
+                    raise ChunkedUploadError(u'Chunk {} starts at offset {}'.format(
+                        index, writer.offset))
+            except (tornado.web.MissingArgumentError, ValueError) as e:
+                raise tornado.web.HTTPError(400, u'{}'.format(e))
+
+            self.request.connection.set_max_body_size(writer.length)
+            await self.open_upload_writer(writer)
+
+        elif upload_id is not None or self.get_query_argument('upload', None) is not None:
+            # create/finalize a chunked upload, small json body
+            self.request.connection.set_max_body_size(MAX_CHUNKED_UPLOAD_REQUEST_SIZE)
+            self.upload_body = b''
+
+        else:
+            self.request.connection.set_max_body_size(self.max_upload_size)
+
+            boundary = get_multipart_boundary(self.request.headers.get('Content-Type'))
+            if boundary is not None:
+                self.upload_parser = StreamingMultipartParser(boundary)
+
+    async def receive_upload_chunk(self, chunk):
+        """parse a chunk of the multipart body and write file parts to disk,
+        or write a chunk of a chunked upload in place
+
+        Args:
+            chunk (bytes): next chunk of the request body
+        """
+        if self.request.method == 'PUT':
+            await self.write_upload(chunk)
+            return
+
+        if self.upload_body is not None:
+            self.upload_body += chunk
+            return
+
+        if self.upload_parser is None:
+            return
+
+        for event, value in self.upload_parser.feed(chunk):
+            if event == PART_START:
+                # parts with an empty filename are plain form fields or
+                # file inputs with no file selected
+                if value.filename:
+                    await self.open_upload_writer(
+                        UploadFileWriter(self.upload_save_dir, value.filename))
+            elif event == PART_DATA:
+                await self.write_upload(value)
+            elif event == PART_END:
+                if self.upload_writer is not None:
+                    writer = await self.commit_upload()
+                    logging.info(
+                        u'Upload "{}" {} bytes, saved into: {}'.format(
+                            writer.filename, writer.bytes_written, writer.save_filename)
+                    )
+                    self.uploaded_files.append(
+                        (writer.filename, writer.save_filename))
+
+    async def get_chunked_upload(self, upload_id):
+        """get a chunked upload session of the current folder
+
+        Args:
+            upload_id (str): session id
 
-        response_content += FolderHandler.response_content_footer
-        response_content += FolderHandler.response_body_endings
+        Returns:
+            ChunkedUpload: the session, raises 404 if not found
+        """
+        save_dir = path_resolver.resolve_request(self.request, self.root_dir).full_local_path
+        upload = await run_in_io_executor(
+            chunked_upload_store.get, save_dir, upload_id)
 
-        self.last_request_uri_path = self.request.path
+        if upload is None:
+            raise tornado.web.HTTPError(404, u'No such upload: {}'.format(upload_id))
 
-        self.write(FolderHandler.response_header + response_content)
+        return upload
 
-    def post(self, path):
-        """post method
+    async def put(self, path):
+        """put method, one chunk of a chunked upload, already written in
+        place by data_received()
 
         Args:
             path (str): _description_
         """
-        # logging.info(u'===> self.path_args: {}'.format(self.path_args))
-        # logging.info(u'===> self.path_kwargs: {}'.format(self.path_kwargs))
+        self.check_upload_error()
 
-        # logging.info(u'===> self.request.uri: {}'.format(self.request.uri))
-        # logging.info(u'===> self.request.path: {}'.format(self.request.path))
-        # logging.info(u'===> self.request.query: {}'.format(self.request.query))
-        # logging.info(u'===> self.request.headers: {}'.format(self.request.headers))
-        # logging.info(u'===> self.request.body: {}'.format(self.request.body))
-        logging.info(
-            'POST : {}'.format(self.request.uri)
-        )
+        try:
+            writer = await self.commit_upload()
+        except ValueError as e:
+            raise tornado.web.HTTPError(400, u'{}'.format(e))
 
-        # print('path: ', path)
+        self.write(await run_in_io_executor(writer.upload.to_dict))
 
-        response_content = FolderHandler.upload_response_content_header.format(
-            self.request.path)
-        full_local_path = get_full_local_path_for_url(
-            self.request.path, self.root_dir)
+    async def delete(self, path):
+        """delete method, abort a chunked upload
 
-        for field_name, files in self.request.files.items():
-            for info in files:
-                filename, content_type = info["filename"], info["content_type"]
+        Args:
+            path (str): _description_
+        """
+        upload_id = self.get_query_argument('upload_id')
+        upload = await self.get_chunked_upload(upload_id)
 
-                if not is_python3():
-                    filename = filename.decode('utf-8')
+        await run_in_io_executor(upload.abort)
+        chunked_upload_store.remove(upload_id)
 
-                body = info["body"]
-                logging.info(
-                    'POST "%s" "%s" %d bytes', filename, content_type, len(
-                        body)
-                )
+        logging.info(u'Chunked upload {} aborted'.format(upload_id))
+        self.write({'upload_id': upload_id, 'aborted': True})
+
+    async def post_chunked_upload(self):
+        """create or finalize a chunked upload
+        """
+        upload_id = self.get_query_argument('upload_id', None)
+
+        if upload_id is None:
+            try:
+                args = json.loads(self.upload_body)
+                filename = args['filename']
+                size = int(args['size'])
+                chunk_size = int(args.get('chunk_size', DEFAULT_CHUNK_SIZE))
+            except (ValueError, KeyError, TypeError) as e:
+                raise tornado.web.HTTPError(400, u'Invalid request: {}'.format(e))
+
+            if size > self.max_upload_size:
+                raise tornado.web.HTTPError(
+                    413, u'Upload of {} bytes, max {}'.format(size, self.max_upload_size))
+
+            try:
+                upload = await run_in_io_executor(
+                    chunked_upload_store.create, osp.normpath(self.upload_save_dir),
+                    filename, size, chunk_size)
+            except ChunkedUploadError as e:
+                raise tornado.web.HTTPError(400, u'{}'.format(e))
+            except OSError as e:
+                # the part file is preallocated, e.g. no space left for it
+                logging.warning(u'Chunked upload to {} failed: {}'.format(self.request.path, e))
+                raise tornado.web.HTTPError(507, u'Can not create the upload: {}'.format(e))
+
+            logging.info(
+                u'Chunked upload {} created: "{}" {} bytes'.format(
+                    upload.upload_id, upload.filename, upload.size)
+            )
+            self.set_status(201)
+            self.write(await run_in_io_executor(upload.to_dict))
+            return
 
-                save_filename = osp.join(
-                    full_local_path, osp.basename(filename))
-                if osp.isfile(save_filename):
-                    i = 0
-                    fn, ext = osp.splitext(save_filename)
+        if self.get_query_argument('action', None) != 'finalize':
+            raise tornado.web.HTTPError(400, u'Unknown action')
 
-                    while osp.isfile(save_filename):
-                        i += 1
-                        save_filename = fn + '.{:03d}'.format(i) + ext
+        upload = await self.get_chunked_upload(upload_id)
+        try:
+            save_filename = await run_in_io_executor(upload.finalize)
+        except ChunkedUploadError as e:
+            raise tornado.web.HTTPError(409, u'{}'.format(e))
+        chunked_upload_store.remove(upload_id)
+        path_resolver.invalidate(save_filename)
+
+        logging.info(
+            u'Chunked upload {} finalized, saved into: {}'.format(upload_id, save_filename)
+        )
+        self.write({
+            'filename': upload.filename,
+            'saved_into': save_filename,
+            'size': upload.size,
+        })
+
+    async def post(self, path):
+        """post method, the multipart body is already parsed and saved by
+        data_received()
+
+        Args:
+            path (str): _description_
+        """
+        # logging.info(u'===> self.request.uri: {}'.format(self.request.uri))
+        # logging.info(u'===> self.request.headers: {}'.format(self.request.headers))
+        logging.debug(u'POST : %s', self.request.uri)
 
-                fp = open(save_filename, 'wb')
-                fp.write(body)
-                fp.close()
+        self.check_upload_error()
 
-                response_content += FolderHandler.upload_response_content_item_template.format(
-                    filename, save_filename)
+        if self.upload_body is not None:
+            await self.post_chunked_upload()
+            return
 
-        self.write(response_content)
+        if self.upload_parser is not None and not self.upload_parser.is_done:
+            self.set_upload_error(u'truncated multipart body')
+        self.check_upload_error()
+
+        self.write(render_page(
+            'upload_done.html',
+            folder_uri=self.request.path,
+            uploaded_files=self.uploaded_files,
+        ))
 
 
 # class POSTHandler(tornado.web.RequestHandler):
@@ -971,20 +1926,73 @@ class FolderHandler(tornado.web.RequestHandler):
 #         self.write("OK")
 
 
-# @tornado.web.stream_request_body
-# class PUTHandler(tornado.web.RequestHandler):
-#     def initialize(self):
-#         self.bytes_read = 0
+@tornado.web.stream_request_body
+class PUTHandler(StreamingUploadMixin, tornado.web.RequestHandler):
+    """Request Handler to upload a single file with a raw PUT body,
+    e.g. curl -T file.bin http://host:port/folder/file.bin
 
-#     def data_received(self, chunk):
-#         self.bytes_read += len(chunk)
+    Existing files are never overwritten, the upload is saved as
+    "name.001.ext" etc. instead, same as uploads through the form.
+    """
 
-#     def put(self, filename):
-#         filename = unquote(filename)
-#         mtype = self.request.headers.get("Content-Type")
-#         logging.info(u'PUT "%s" "%s" %d bytes',
-#                      filename, mtype, self.bytes_read)
-#         self.write("OK")
+    def initialize(self, root_dir=None, max_upload_size=DEFAULT_MAX_UPLOAD_SIZE):
+        """initialize
+
+        Args:
+            root_dir (str, optional): local root dir. Defaults to None.
+            max_upload_size (int, optional): max size in bytes of the request body.
+                Defaults to DEFAULT_MAX_UPLOAD_SIZE.
+        """
+        if not root_dir:
+            self.root_dir = os.getcwd()
+        else:
+            self.root_dir = osp.abspath(root_dir)
+
+        self.max_upload_size = max_upload_size
+
+    async def prepare(self):
+        """prepare, open the temp file the body is streamed into
+        """
+        self.init_upload_state()
+        self.request.connection.set_max_body_size(self.max_upload_size)
+
+        resolved = path_resolver.resolve_request(self.request, self.root_dir)
+        if resolved.path_type == PATH_FORBIDDEN:
+            raise tornado.web.HTTPError(403)
+
+        full_local_path = resolved.full_local_path
+
+        save_dir, filename = osp.split(full_local_path)
+        if not filename:
+            raise tornado.web.HTTPError(400, u'No file name')
+
+        await self.open_upload_writer(UploadFileWriter(save_dir, filename))
+
+    async def receive_upload_chunk(self, chunk):
+        await self.write_upload(chunk)
+
+    async def put(self, path):
+        """put method, the body is already written to the temp file by data_received()
+
+        Args:
+            path (str): url path
+        """
+        logging.debug(u'PUT : %s', self.request.uri)
+
+        self.check_upload_error()
+
+        writer = await self.commit_upload()
+        logging.info(
+            u'Upload "{}" {} bytes, saved into: {}'.format(
+                writer.filename, writer.bytes_written, writer.save_filename)
+        )
+
+        self.set_status(201)
+        self.write({
+            'filename': writer.filename,
+            'saved_into': writer.save_filename,
+            'bytes': writer.bytes_written,
+        })
 
 
 # def mkapp(prefix=''):
@@ -1007,46 +2015,288 @@ class FolderHandler(tornado.web.RequestHandler):
 #    tornado.ioloop.IOLoop.instance().start()
 
 
-def start_server(
-    root_dir, 
-    port=8900, 
+def get_cache_stats():
+    """get the statistics of the caches of this server process
+
+    Returns:
+        dict: cache name -> statistics
+    """
+    stats = {
+        'dir_listing': dir_listing_cache.stats(),
+        'path_resolver': path_resolver.stats(),
+        'file_content': file_content_cache.stats(),
+        'compressed_content': compressed_content_cache.stats(),
+    }
+
+    thumbnail_cache = get_thumbnail_cache()
+    if thumbnail_cache is not None:
+        stats['thumbnail'] = thumbnail_cache.stats()
+
+    search_index = get_search_index()
+    if search_index is not None:
+        stats['search_index'] = search_index.stats()
+
+    folder_size_cache = get_folder_size_cache()
+    if folder_size_cache is not None:
+        stats['folder_sizes'] = folder_size_cache.stats()
+
+    stats['logging'] = get_logging_stats()
+    stats['download_limits'] = download_limiter.stats()
+
+    return stats
+
+
+class StatsHandler(tornado.web.RequestHandler):
+    """Cache statistics (hit ratios, sizes) of the server process handling
+    the request, as JSON
+    """
+
+    def get(self):
+        self.set_header('Content-Type', 'application/json; charset=utf-8')
+        self.set_header('Cache-Control', 'no-store')
+        self.finish(json.dumps(get_cache_stats()))
+
+
+# the caches of get_cache_stats() exported as tfs_cache_* metrics
+METRIC_CACHE_NAMES = ['dir_listing', 'path_resolver', 'file_content', 'compressed_content',
+                      'thumbnail']
+
+
+def _get_cache_samples(key):
+    return [(cache_name, key, (cache_name,)) for cache_name in METRIC_CACHE_NAMES]
+
+# metrics made of get_cache_stats(), as
+# (name, type, help, label names, [(stats name, statistic, label values)])
+STATS_METRICS = [
+    ('tfs_cache_entries', 'gauge', 'Entries in the cache.',
+     ('cache',), _get_cache_samples('entries')),
+    ('tfs_cache_max_entries', 'gauge', 'Max number of entries in the cache.',
+     ('cache',), _get_cache_samples('max_entries')),
+    ('tfs_cache_bytes', 'gauge', 'Estimated size of the cache entries.',
+     ('cache',), _get_cache_samples('bytes')),
+    ('tfs_cache_max_bytes', 'gauge', 'Max size of the cache entries.',
+     ('cache',), _get_cache_samples('max_bytes')),
+    ('tfs_cache_hits_total', 'counter', 'Cache lookups which found an entry.',
+     ('cache',), _get_cache_samples('hits')),
+    ('tfs_cache_misses_total', 'counter', 'Cache lookups which found no entry.',
+     ('cache',), _get_cache_samples('misses')),
+    ('tfs_cache_evictions_total', 'counter', 'Entries evicted to stay within the cache bounds.',
+     ('cache',), _get_cache_samples('evictions')),
+    ('tfs_thumbnail_errors_total', 'counter', 'Thumbnails which could not be generated.',
+     (), [('thumbnail', 'errors', ())]),
+    ('tfs_folder_sizes_folders', 'gauge', 'Folders whose recursive size is known.',
+     (), [('folder_sizes', 'folders', ())]),
+    ('tfs_folder_sizes_pending', 'gauge', 'Folders whose recursive size is being computed.',
+     (), [('folder_sizes', 'pending', ())]),
+    ('tfs_folder_sizes_computed_total', 'counter', 'Recursive folder sizes computed.',
+     (), [('folder_sizes', 'computed', ())]),
+    ('tfs_folder_sizes_scanned_folders_total', 'counter',
+     'Folders scanned to compute recursive sizes.',
+     (), [('folder_sizes', 'scanned_folders', ())]),
+    ('tfs_search_index_ready', 'gauge', '1 once the search index is built.',
+     (), [('search_index', 'ready', ())]),
+    ('tfs_search_index_paths', 'gauge', 'Paths in the search index.',
+     (), [('search_index', 'paths', ())]),
+    ('tfs_search_index_bytes', 'gauge', 'Size of the paths in the search index.',
+     (), [('search_index', 'bytes', ())]),
+    ('tfs_search_index_build_seconds', 'gauge', 'Duration of the last build of the search index.',
+     (), [('search_index', 'build_seconds', ())]),
+    ('tfs_search_queries_total', 'counter', 'Search queries answered.',
+     (), [('search_index', 'queries', ())]),
+    ('tfs_log_queued_records', 'gauge', 'Log records waiting to be written.',
+     (), [('logging', 'queued', ())]),
+    ('tfs_log_max_queued_records', 'gauge', 'Max number of log records waiting to be written.',
+     (), [('logging', 'max_queued', ())]),
+    ('tfs_log_dropped_records_total', 'counter', 'Log records dropped, the queue being full.',
+     (), [('logging', 'dropped', ())]),
+    ('tfs_access_log_records_total', 'counter', 'Requests written to the access log.',
+     (), [('logging', 'logged', ())]),
+    ('tfs_access_log_sampled_out_total', 'counter',
+     'Successful requests left out of the access log by sampling.',
+     (), [('logging', 'sampled_out', ())]),
+    ('tfs_downloads', 'gauge', 'Downloads being sent, see the download limits.',
+     (), [('download_limits', 'downloads', ())]),
+    ('tfs_downloads_rejected_total', 'counter', 'Downloads rejected by a limit, by status code.',
+     ('code',), [('download_limits', 'rejected_429', ('429',)),
+                 ('download_limits', 'rejected_503', ('503',))]),
+    ('tfs_download_throttled_seconds_total', 'counter',
+     'Time downloads waited for bandwidth under the rate limits.',
+     (), [('download_limits', 'throttled_seconds', ())]),
+    ('tfs_download_bytes_total', 'counter', 'Bytes of downloads sent.',
+     (), [('download_limits', 'bytes_sent', ())]),
+]
+
+
+def get_cache_metrics():
+    """get the cache, search index, logging and download limit statistics in
+    Prometheus text format, see STATS_METRICS
+
+    Returns:
+        str: the metrics
+    """
+    stats = get_cache_stats()
+
+    lines = []
+    for name, metric_type, documentation, label_names, sources in STATS_METRICS:
+        samples = []
+        for stats_name, key, label_values in sources:
+            value = stats.get(stats_name, {}).get(key)
+            if value is not None:
+                # bool is an int, e.g. 'ready' of the search index
+                samples.append(u'{}{} {}'.format(
+                    name, format_labels(label_names, label_values), format_value(value + 0)))
+
+        if samples:
+            lines.append(u'# HELP {} {}'.format(name, documentation))
+            lines.append(u'# TYPE {} {}'.format(name, metric_type))
+            lines.extend(samples)
+
+    return u'\n'.join(lines) + u'\n'
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    """Request, filesystem, IOLoop and cache metrics of the server process
+    handling the request, in Prometheus text format, see metrics.py
+    """
+
+    def get(self):
+        self.set_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.set_header('Cache-Control', 'no-store')
+        self.finish(metrics_registry.render() + get_cache_metrics())
+
+
+class SearchHandler(tornado.web.RequestHandler):
+    """Search files and folders by name in the search index, see search_index.py
+
+    Query arguments:
+        q: the search query
+        mode: one of search_mode_list. Default: substring
+        in: only search below this folder (a url path). Default: everywhere
+        limit: max number of results
+        format: 'json' for a JSON response, html otherwise
+    """
+
+    @staticmethod
+    def get_result_uri(index_path, is_dir):
+        uri = u'/'.join(
+            tornado.escape.url_escape(part, plus=False) for part in index_path.split(u'/'))
+
+        return uri + u'/' if is_dir else uri
+
+    async def get(self):
+        search_index = get_search_index()
+        if search_index is None:
+            raise tornado.web.HTTPError(404, u'Search is disabled')
+
+        query = self.get_query_argument('q', u'')
+        mode = self.get_query_argument('mode', search_mode_list[0])
+        scope = self.get_query_argument('in', u'/')
+        response_format = self.get_query_argument('format', 'html')
+
+        if not query:
+            raise tornado.web.HTTPError(400, u'q is required')
+
+        if mode not in search_mode_list:
+            raise tornado.web.HTTPError(
+                400, u'Invalid mode: {}, must be one of {}'.format(mode, search_mode_list))
+
+        try:
+            limit = int(self.get_query_argument('limit', DEFAULT_SEARCH_LIMIT))
+        except ValueError:
+            raise tornado.web.HTTPError(400, u'Invalid limit')
+        limit = max(1, min(limit, MAX_SEARCH_LIMIT))
+
+        try:
+            results, truncated = await run_in_io_executor(
+                search_index.search, query, mode, limit, scope.rstrip(u'/'))
+        except IndexNotReadyError as e:
+            self.set_header('Retry-After', 5)
+            raise tornado.web.HTTPError(503, str(e))
+
+        self.set_header('Cache-Control', 'no-store')
+
+        if response_format == 'json':
+            self.set_header('Content-Type', 'application/json; charset=UTF-8')
+            self.write(json.dumps({
+                'query': query,
+                'mode': mode,
+                'in': scope,
+                'truncated': truncated,
+                'results': [
+                    {
+                        'path': index_path,
+                        'type': 'dir' if is_dir else 'file',
+                        'uri': self.get_result_uri(index_path, is_dir),
+                    }
+                    for index_path, is_dir in results
+                ],
+            }))
+            return
+
+        self.write(render_page(
+            'search.html',
+            search_path=SEARCH_PATH,
+            search_query=query,
+            search_mode=mode,
+            search_modes=search_mode_list,
+            search_scope=scope,
+            scope_uri=self.get_result_uri(scope.rstrip(u'/'), True),
+            truncated=truncated,
+            results=[
+                (self.get_result_uri(index_path, is_dir), index_path + (u'/' if is_dir else u''))
+                for index_path, is_dir in results
+            ],
+        ))
+
+
+def make_router(
+    root_dir,
     items_per_page=50,
     view_mode='list',
     items_per_row=4,
-    image_width=256
+    image_width=256,
+    listing_mode='lazy',
+    debug=False,
+    max_upload_size=DEFAULT_MAX_UPLOAD_SIZE,
+    compression=True,
+    sendfile=True
 ):
-    """start_server
+    """make the router dispatching requests to the upload/file/folder/error apps
 
     Args:
-        root_dir (str): root dir to start serving
-        port (int, optional): Defaults to 8900.
-        items_per_page (int, optional): Defaults to 50.
-        view_mode (str): view mode, ['list', 'preview']. Default: 'list'".
-        items_per_row (int, optional): Defaults to 4.
-        image_width (int, optional): Defaults to 256.
-    """
-
-    if not isinstance(root_dir, unicode):
-        raise(AssertionError("In start_server: root_dir must be of type Unicode"))
+        see start_server(), max_upload_size is in bytes
 
-    ip = get_ip()
-    server_url = u"{}:{}".format(ip, port)
-    # print(u'===>start tornado file server at url: {} or localhost:{}'.format(server_url, port))
+    Returns:
+        MetricsRouter: router to serve
+    """
+    path = '/(.*)'
 
-    logging.info(
-        u'===> start tornado file server at url: {} or localhost:{}'.format(server_url, port)
+    upload_app = MeteredApplication(
+        [
+            (path, PUTHandler, {
+                "root_dir": root_dir,
+                "max_upload_size": max_upload_size
+            }),
+        ],
+        debug=debug,
+        log_function=log_access,
+        metrics_route=ROUTE_UPLOAD
     )
 
-    path = '/(.*)'
-
-    file_app = tornado.web.Application(
+    file_app = MeteredApplication(
         [
-            (path, FileHandler, {'path': root_dir}),
+            (path, FileHandler, {
+                'path': root_dir,
+                'compression': compression,
+                'sendfile': sendfile
+            }),
         ],
-        debug=True
+        debug=debug,
+        log_function=log_access,
+        metrics_route=ROUTE_FILE
     )
 
-    folder_app = tornado.web.Application(
+    folder_app = MeteredApplication(
         [
             (
                 path, FolderHandler,  {
@@ -1054,19 +2304,37 @@ def start_server(
                     "root_dir": root_dir,
                     "view_mode": view_mode,
                     "items_per_row": items_per_row,
-                    "image_width": image_width
+                    "image_width": image_width,
+                    "listing_mode": listing_mode,
+                    "max_upload_size": max_upload_size,
+                    "compression": compression
                 }
             ),
         ],
-        debug=True
+        debug=debug,
+        log_function=log_access,
+        metrics_route=ROUTE_FOLDER
     )
 
 
-    error_app = tornado.web.Application(
+    service_app = MeteredApplication(
+        [
+            (STATS_PATH, StatsHandler),
+            (SEARCH_PATH, SearchHandler),
+            (METRICS_PATH, MetricsHandler),
+        ],
+        debug=debug,
+        log_function=log_access,
+        metrics_route=ROUTE_SERVICE
+    )
+
+    error_app = MeteredApplication(
         [
             (path, tornado.web.ErrorHandler, {"status_code": 404}),
         ],
-        debug=True
+        debug=debug,
+        log_function=log_access,
+        metrics_route=ROUTE_NOT_FOUND
     )
     # post_app = tornado.web.Application(
     #     [
@@ -1075,15 +2343,21 @@ def start_server(
     #     ]
     # )
 
-    router = tornado.routing.RuleRouter(
+    # MetricsRouter and MeteredApplication record the requests by app, see metrics.py
+    router = PathResolvingRouter(
         [
+            tornado.routing.Rule(
+                tornado.routing.PathMatches('({}|{}|{})'.format(STATS_PATH, SEARCH_PATH, METRICS_PATH)),
+                service_app),
+            tornado.routing.Rule(TypeMatchesUpload(root_dir=root_dir), upload_app),
             tornado.routing.Rule(TypeMatchesFile(root_dir=root_dir), file_app),
             tornado.routing.Rule(TypeMatchesFolder(
                 root_dir=root_dir), folder_app),
             tornado.routing.Rule(tornado.routing.AnyMatches(), error_app),
             # tornado.routing.Rule(tornado.routing.PathMatches(r"/post"), post_app)
             # tornado.routing.Rule(tornado.routing.PathMatches(path + r"/post"), post_app)
-        ]
+        ],
+        root_dir
     )
 
 #    router = tornado.routing.RuleRouter(
@@ -1093,6 +2367,257 @@ def start_server(
 #       ]
 #    )
 
+    return router
+
+
+def run_http_server(router, sockets, shutdown_timeout=SHUTDOWN_TIMEOUT):
+    """serve on already bound sockets until SIGTERM/SIGINT
+
+    On SIGTERM/SIGINT the server stops accepting new connections, and the
+    IOLoop is stopped once the requests in flight are finished and the open
+    connections closed, or after shutdown_timeout seconds.
+
+    Args:
+        router (tornado.routing.Router): router to serve
+        sockets (list): listening sockets
+        shutdown_timeout (float, optional): max seconds to wait for open connections.
+            Defaults to SHUTDOWN_TIMEOUT.
+    """
+    io_loop = tornado.ioloop.IOLoop.current()
+
     server = tornado.httpserver.HTTPServer(router)
-    server.listen(port)
-    tornado.ioloop.IOLoop.current().start()
+    server.add_sockets(sockets)
+
+    async def shutdown():
+        server.stop()
+
+        # requests in flight are finished first, close_all_connections()
+        # would cut them, then the idle keep-alive connections are closed
+        deadline = io_loop.time() + shutdown_timeout
+        while requests_in_flight.get() > 0 and io_loop.time() < deadline:
+            await tornado.gen.sleep(0.1)
+
+        try:
+            await tornado.gen.with_timeout(deadline, server.close_all_connections())
+        except tornado.gen.TimeoutError:
+            logging.warning(u'===> connections still open after {}s, stopping anyway'.format(
+                shutdown_timeout))
+
+        io_loop.stop()
+
+    def handle_stop_signal(signum):
+        logging.info(u'===> got signal {}, shutting down'.format(signum))
+        io_loop.add_callback(shutdown)
+
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        try:
+            io_loop.asyncio_loop.add_signal_handler(signum, handle_stop_signal, signum)
+        except NotImplementedError:
+            # no asyncio signal handlers on Windows
+            signal.signal(signum, lambda signum, frame: handle_stop_signal(signum))
+
+    IOLoopLagMonitor().start()
+    io_loop.start()
+
+
+def start_server(
+    root_dir, 
+    port=8900, 
+    items_per_page=50,
+    view_mode='list',
+    items_per_row=4,
+    image_width=256,
+    listing_cache_entries=256,
+    listing_cache_size_mb=64,
+    io_threads=16,
+    listing_mode='lazy',
+    fs_watch_mode='off',
+    fs_poll_interval=2.0,
+    debug=False,
+    max_upload_size_gb=100,
+    chunked_upload_ttl_hours=24,
+    workers=1,
+    thumbnail_processes=DEFAULT_THUMBNAIL_PROCESSES,
+    thumbnail_cache_dir=DEFAULT_THUMBNAIL_CACHE_DIR,
+    thumbnail_cache_size_mb=512,
+    compression=True,
+    compression_cache_size_mb=64,
+    file_cache_size_mb=64,
+    file_cache_max_file_size_kb=256,
+    path_cache_ttl=1.0,
+    path_cache_negative_ttl=5.0,
+    item_stat_ttl=2.0,
+    sendfile=True,
+    search=False,
+    search_walk_threads=DEFAULT_WALK_THREADS,
+    tree_watch_mode='auto',
+    folder_sizes=False,
+    access_log_sample_rate=1.0,
+    client_rate_limit_mb=0,
+    global_rate_limit_mb=0,
+    max_client_downloads=0,
+    max_downloads=0
+):
+    """start_server
+
+    Args:
+        root_dir (str): root dir to start serving
+        port (int, optional): Defaults to 8900.
+        items_per_page (int, optional): Defaults to 50.
+        view_mode (str): view mode, ['list', 'preview']. Default: 'list'".
+        items_per_row (int, optional): Defaults to 4.
+        image_width (int, optional): Defaults to 256.
+        listing_cache_entries (int, optional): max number of cached folder listings. Defaults to 256.
+        listing_cache_size_mb (int, optional): max memory of cached folder listings in MB. Defaults to 64.
+        io_threads (int, optional): size of the thread pool for filesystem work. Defaults to 16.
+        listing_mode (str, optional): folder listing mode, ['lazy', 'eager']. Defaults to 'lazy'.
+        fs_watch_mode (str, optional): invalidate cached listings by watching the filesystem,
+            ['off', 'auto', 'inotify', 'poll']. Defaults to 'off'.
+        fs_poll_interval (float, optional): seconds between two polls in 'poll' mode. Defaults to 2.0.
+        debug (bool, optional): tornado debug mode (autoreload, tracebacks in error pages).
+            Defaults to False.
+        max_upload_size_gb (float, optional): max size of an upload in GB. Defaults to 100.
+        chunked_upload_ttl_hours (float, optional): hours after which a chunked upload
+            which received no chunk is abandoned and its files removed. Defaults to 24.
+        workers (int, optional): number of server processes, 0 for one per CPU core.
+            Defaults to 1.
+        thumbnail_processes (int, optional): number of processes generating thumbnails
+            for the preview mode, 0 to disable thumbnails. Defaults to DEFAULT_THUMBNAIL_PROCESSES.
+        thumbnail_cache_dir (str, optional): folder of the thumbnail cache.
+            Defaults to DEFAULT_THUMBNAIL_CACHE_DIR.
+        thumbnail_cache_size_mb (int, optional): max size of the thumbnail cache in MB.
+            Defaults to 512.
+        compression (bool, optional): gzip/brotli compress folder pages and text files
+            if the client accepts it. Defaults to True.
+        compression_cache_size_mb (int, optional): max memory of the cached compressed
+            variants of files in MB. Defaults to 64.
+        file_cache_size_mb (int, optional): max memory of the cached contents of small
+            files in MB, 0 to disable the cache. Defaults to 64.
+        file_cache_max_file_size_kb (int, optional): max size of a file in the cache in KB.
+            Defaults to 256.
+        path_cache_ttl (float, optional): seconds the type (file/folder) of a requested
+            path is cached. Defaults to 1.0.
+        path_cache_negative_ttl (float, optional): seconds a missing path is cached.
+            Defaults to 5.0.
+        item_stat_ttl (float, optional): seconds the type/size/mtime of the items of
+            a folder not watched by fs_watch_mode are shown before being stat-ed
+            again. Defaults to 2.0.
+        sendfile (bool, optional): send file contents with os.sendfile() when possible.
+            Defaults to True.
+        search (bool, optional): enable the filename search, built at startup by walking
+            the whole tree, by each worker. Defaults to False.
+        search_walk_threads (int, optional): number of threads walking the tree to build
+            the search index, 0 to disable the search. Defaults to DEFAULT_WALK_THREADS.
+        tree_watch_mode (str, optional): how the search index and the folder sizes
+            watch the whole tree for changes, see fs_watch_mode. Defaults to 'auto'.
+        folder_sizes (bool, optional): show the recursive sizes of folders, computed
+            in the background, by each worker. Defaults to False.
+        access_log_sample_rate (float, optional): share of the successful requests
+            written to the access log, errors are always logged. Defaults to 1.0.
+        client_rate_limit_mb (float, optional): max download bandwidth of each client
+            in MB/s, 0 for no limit. Defaults to 0.
+        global_rate_limit_mb (float, optional): max download bandwidth of all clients
+            in MB/s, 0 for no limit. Defaults to 0.
+        max_client_downloads (int, optional): max concurrent downloads of each client,
+            more are answered with 429, 0 for no limit. Defaults to 0.
+        max_downloads (int, optional): max concurrent downloads of all clients,
+            more are answered with 503, 0 for no limit. Defaults to 0.
+    """
+
+    if not isinstance(root_dir, unicode):
+        raise(AssertionError("In start_server: root_dir must be of type Unicode"))
+
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+
+    if workers > 1 and not hasattr(os, 'fork'):
+        raise RuntimeError(u'multiple workers are not supported on this platform')
+
+    if workers > 1 and debug:
+        # autoreload restarts a single process, it can't work with forked workers
+        raise ValueError(u'debug mode can not be used with multiple workers')
+
+    if not search:
+        search_walk_threads = 0
+    elif workers > 1 and search_walk_threads > 0:
+        logging.warning(
+            u'===> each of the %d workers walks and watches the whole tree for the search',
+            workers)
+
+    ip = get_ip()
+    server_url = u"{}:{}".format(ip, port)
+    # print(u'===>start tornado file server at url: {} or localhost:{}'.format(server_url, port))
+
+    logging.info(
+        u'===> start tornado file server at url: {} or localhost:{}'.format(server_url, port)
+    )
+
+    def serve(sockets):
+        # threads, the IOLoop and the fs watcher do not survive fork(),
+        # so everything is set up in the serving process
+        log_queue.start()
+        access_log.configure(sample_rate=access_log_sample_rate)
+        download_limiter.configure(
+            client_rate=client_rate_limit_mb * 1024 * 1024,
+            global_rate=global_rate_limit_mb * 1024 * 1024,
+            max_client_downloads=max_client_downloads,
+            max_downloads=max_downloads
+        )
+        dir_listing_cache.configure(
+            max_entries=listing_cache_entries,
+            max_bytes=listing_cache_size_mb * 1024 * 1024,
+            item_max_age=item_stat_ttl
+        )
+        configure_io_executor(io_threads)
+        chunked_upload_store.configure(max_age=chunked_upload_ttl_hours * 3600)
+        chunked_upload_store.start()
+        path_resolver.configure(ttl=path_cache_ttl, negative_ttl=path_cache_negative_ttl)
+
+        fs_watcher = create_fs_watcher(fs_watch_mode, fs_poll_interval)
+        dir_listing_cache.set_watcher(fs_watcher)
+        path_resolver.set_watcher(fs_watcher)
+        file_content_cache.set_watcher(fs_watcher)
+        configure_thumbnails(
+            cache_dir=thumbnail_cache_dir,
+            max_bytes=thumbnail_cache_size_mb * 1024 * 1024,
+            processes=thumbnail_processes
+        )
+        # one watcher of the whole tree for the search index and the folder sizes
+        tree_watcher = None
+        if search_walk_threads > 0 or folder_sizes:
+            tree_watcher = create_fs_watcher(tree_watch_mode, fs_poll_interval)
+        configure_search_index(
+            root_dir,
+            walk_threads=search_walk_threads,
+            watcher=tree_watcher
+        )
+        configure_folder_sizes(root_dir, enabled=folder_sizes, watcher=tree_watcher)
+        compressed_content_cache.configure(
+            max_bytes=compression_cache_size_mb * 1024 * 1024)
+        file_content_cache.configure(
+            max_bytes=file_cache_size_mb * 1024 * 1024,
+            max_file_size=file_cache_max_file_size_kb * 1024
+        )
+
+        router = make_router(
+            root_dir,
+            items_per_page=items_per_page,
+            view_mode=view_mode,
+            items_per_row=items_per_row,
+            image_width=image_width,
+            listing_mode=listing_mode,
+            debug=debug,
+            max_upload_size=int(max_upload_size_gb * 1024 * 1024 * 1024),
+            compression=compression,
+            sendfile=sendfile
+        )
+
+        try:
+            run_http_server(router, sockets)
+        finally:
+            log_queue.stop()
+
+    if workers == 1:
+        serve(bind_server_sockets(port))
+    else:
+        WorkerSupervisor(workers, port, serve).run()
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+write uploaded files to disk
+
+An upload is written into a hidden temp file in the target folder, chunk by
+chunk, and renamed to its final name once complete, so a half-uploaded file
+is never visible under its real name. All methods of UploadFileWriter are
+blocking and meant to be run in the io thread pool.
+
+author: zhaoyafei0210@gmail.com
+github: https://github.com/walkoncross/tornado-file-server
+"""
+
+import os
+import os.path as osp
+import uuid
+
+
+def iter_save_filenames(save_dir, filename):
+    """iter_save_filenames
+
+    Args:
+        save_dir (str): local folder to save into
+        filename (str): file name sent by the client
+
+    Yields:
+        str: full local paths to try to save into: "name.ext", "name.001.ext", ...
+    """
+    save_filename = osp.join(save_dir, osp.basename(filename))
+    yield save_filename
+
+    fn, ext = osp.splitext(save_filename)
+    i = 0
+    while True:
+        i += 1
+        yield fn + '.{:03d}'.format(i) + ext
+
+
+def move_to_unique_filename(src_path, save_dir, filename):
+    """move a complete file to a path under save_dir which does not clash
+    with an existing file
+
+    The free name is taken atomically, with a hard link (or an exclusive
+    create on filesystems without hard links), so concurrent uploads of the
+    same name never overwrite each other.
+
+    Args:
+        src_path (str): full local path of the file, in save_dir
+        save_dir (str): local folder to save into
+        filename (str): file name sent by the client
+
+    Returns:
+        str: full local path the file is saved into, e.g. "name.001.ext" if
+            "name.ext" exists
+    """
+    use_link = hasattr(os, 'link')
+
+    for save_filename in iter_save_filenames(save_dir, filename):
+        if use_link:
+            try:
+                os.link(src_path, save_filename)
+            except FileExistsError:
+                continue
+            except OSError:
+                # no hard links on this filesystem
+                use_link = False
+            else:
+                os.unlink(src_path)
+                return save_filename
+
+        try:
+            fd = os.open(save_filename, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+        except FileExistsError:
+            continue
+        os.close(fd)
+        os.replace(src_path, save_filename)
+
+        return save_filename
+
+
+class UploadFileWriter(object):
+    """Write one uploaded file through a temp file in the target folder
+    """
+
+    def __init__(self, save_dir, filename):
+        """__init__
+
+        Args:
+            save_dir (str): local folder to save into
+            filename (str): file name sent by the client
+        """
+        self.save_dir = save_dir
+        self.filename = osp.basename(filename)
+        self.temp_path = None
+        self.save_filename = None
+        self.bytes_written = 0
+        self._fd = None
+
+    def open(self):
+        """create the temp file, with the permissions of a new file under the
+        current umask, which it keeps once renamed
+        """
+        while True:
+            temp_path = osp.join(self.save_dir, '.{}.{}.part'.format(
+                self.filename, uuid.uuid4().hex[:8]))
+            try:
+                self._fd = os.open(
+                    temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0),
+                    0o666)
+            except FileExistsError:
+                continue
+            self.temp_path = temp_path
+            break
+
+    def write(self, data):
+        """append data to the temp file
+
+        Args:
+            data (bytes): next chunk of the file
+        """
+        view = memoryview(data)
+        while view:
+            n = os.write(self._fd, view)
+            view = view[n:]
+
+        self.bytes_written += len(data)
+
+    def commit(self):
+        """close the temp file and rename it to its final name
+
+        Returns:
+            str: full local path the file is saved into
+        """
+        self._close()
+
+        self.save_filename = move_to_unique_filename(
+            self.temp_path, self.save_dir, self.filename)
+        self.temp_path = None
+
+        return self.save_filename
+
+    def abort(self):
+        """close and remove the temp file
+        """
+        self._close()
+
+        if self.temp_path is not None:
+            try:
+                os.unlink(self.temp_path)
+            except OSError:
+                pass
+            self.temp_path = None
+
+    def _close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+multi-process serving
+
+The parent process binds the listening port, forks the worker processes and
+supervises them: crashed workers are restarted, and SIGTERM/SIGINT shut all
+of them down cleanly. Where SO_REUSEPORT is available every worker binds its
+own socket and the kernel balances connections between them; otherwise the
+workers share the sockets bound by the parent.
+
+Log records of all processes are sent through a queue to the parent, which
+is the only process writing the log file.
+
+author: zhaoyafei0210@gmail.com
+github: https://github.com/walkoncross/tornado-file-server
+"""
+
+import logging
+import logging.handlers
+import multiprocessing
+import multiprocessing.connection
+import signal
+import socket
+import time
+
+import tornado.netutil
+
+
+# a worker exiting sooner than this after its start counts as a fast failure
+MIN_WORKER_UPTIME = 5.0
+MAX_FAST_FAILURES = 5
+# seconds a worker waits for its open connections on shutdown
+SHUTDOWN_TIMEOUT = 10.0
+# seconds after which the supervisor kills workers still running
+KILL_TIMEOUT = SHUTDOWN_TIMEOUT + 5.0
+
+
+def supports_reuse_port():
+    """supports_reuse_port
+
+    Returns:
+        bool: whether SO_REUSEPORT is available
+    """
+    return hasattr(socket, 'SO_REUSEPORT')
+
+
+def bind_server_sockets(port, reuse_port=False):
+    """bind_server_sockets
+
+    Args:
+        port (int): port to listen on
+        reuse_port (bool, optional): set SO_REUSEPORT. Defaults to False.
+
+    Returns:
+        list: listening sockets
+    """
+    return tornado.netutil.bind_sockets(port, reuse_port=reuse_port)
+
+
+def setup_multiprocess_logging(mp_context):
+    """send log records of all processes through a queue to the handlers
+    of the root logger, which then only run in this (parent) process
+
+    Args:
+        mp_context (multiprocessing.context.BaseContext): multiprocessing context
+
+    Returns:
+        logging.handlers.QueueListener: started listener, stop() it on exit
+    """
+    root_logger = logging.getLogger()
+    handlers = root_logger.handlers[:]
+    for handler in handlers:
+        root_logger.removeHandler(handler)
+
+    queue = mp_context.Queue(-1)
+    root_logger.addHandler(logging.handlers.QueueHandler(queue))
+
+    listener = logging.handlers.QueueListener(
+        queue, *handlers, respect_handler_level=True)
+    listener.start()
+
+    return listener
+
+
+def _worker_main(worker_id, port, sockets, reuse_port, serve_func):
+    """entry point of a worker process
+
+    Args:
+        worker_id (int): worker index
+        port (int): port to listen on
+        sockets (list): sockets bound by the parent, None with reuse_port
+        reuse_port (bool): bind own sockets with SO_REUSEPORT
+        serve_func (callable): serve_func(sockets) runs the server until shutdown
+    """
+    # the parent's handlers are inherited through fork
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+    if reuse_port:
+        sockets = bind_server_sockets(port, reuse_port=True)
+
+    logging.info(u'===> worker {} started'.format(worker_id))
+    serve_func(sockets)
+    logging.info(u'===> worker {} stopped'.format(worker_id))
+
+
+class WorkerSupervisor(object):
+    """Fork, restart and stop worker processes
+    """
+
+    def __init__(self, num_workers, port, serve_func, reuse_port=None):
+        """__init__
+
+        Args:
+            num_workers (int): number of worker processes
+            port (int): port to listen on
+            serve_func (callable): serve_func(sockets) runs the server until
+                SIGTERM/SIGINT, in each worker
+            reuse_port (bool, optional): let each worker bind its own socket with
+                SO_REUSEPORT. Defaults to None, i.e. when available.
+        """
+        if reuse_port is None:
+            reuse_port = supports_reuse_port()
+
+        self.num_workers = num_workers
+        self.port = port
+        self.serve_func = serve_func
+        self.reuse_port = reuse_port
+
+        self._mp_context = multiprocessing.get_context('fork')
+        self._sockets = None
+        self._processes = {}
+        self._start_times = {}
+        self._fast_failures = 0
+        self._stopping = False
+        self._stop_time = None
+
+    def run(self):
+        """start the workers and supervise them until they are all stopped
+        """
+        if self.reuse_port:
+            # fail fast if the port is taken, then let each worker bind its own
+            # socket: a listening socket kept open here would get connections
+            # nobody accepts
+            for sock in bind_server_sockets(self.port, reuse_port=True):
+                sock.close()
+        else:
+            self._sockets = bind_server_sockets(self.port)
+
+        log_listener = setup_multiprocess_logging(self._mp_context)
+
+        signal.signal(signal.SIGTERM, self._handle_stop_signal)
+        signal.signal(signal.SIGINT, self._handle_stop_signal)
+
+        logging.info(
+            u'===> starting {} workers on port {} (SO_REUSEPORT: {})'.format(
+                self.num_workers, self.port, self.reuse_port)
+        )
+
+        try:
+            for worker_id in range(self.num_workers):
+                self._start_worker(worker_id)
+
+            self._supervise()
+        finally:
+            if self._sockets:
+                for sock in self._sockets:
+                    sock.close()
+            logging.info(u'===> all workers stopped')
+            log_listener.stop()
+
+    def _start_worker(self, worker_id):
+        process = self._mp_context.Process(
+            target=_worker_main,
+            args=(worker_id, self.port, self._sockets, self.reuse_port, self.serve_func),
+            name='tfs-worker-{}'.format(worker_id)
+        )
+        process.daemon = False
+        process.start()
+
+        self._processes[worker_id] = process
+        self._start_times[worker_id] = time.time()
+
+    def _supervise(self):
+        while self._processes:
+            sentinels = dict(
+                (process.sentinel, worker_id) for worker_id, process in self._processes.items())
+            ready = multiprocessing.connection.wait(list(sentinels), timeout=1.0)
+
+            for sentinel in ready:
+                worker_id = sentinels[sentinel]
+                process = self._processes.pop(worker_id)
+                process.join()
+
+                if self._stopping:
+                    continue
+
+                logging.warning(
+                    u'===> worker {} (pid {}) exited with code {}, restarting'.format(
+                        worker_id, process.pid, process.exitcode)
+                )
+
+                if time.time() - self._start_times[worker_id] < MIN_WORKER_UPTIME:
+                    self._fast_failures += 1
+                    if self._fast_failures > MAX_FAST_FAILURES:
+                        logging.error(u'===> workers keep crashing, shutting down')
+                        self.stop()
+                        continue
+                    # back off instead of fork-bombing on a persistent error
+                    time.sleep(min(self._fast_failures, MIN_WORKER_UPTIME))
+                else:
+                    self._fast_failures = 0
+
+                self._start_worker(worker_id)
+
+            if (self._stopping and self._processes and
+                    time.time() - self._stop_time > KILL_TIMEOUT):
+                for process in self._processes.values():
+                    logging.warning(u'===> killing worker pid {}'.format(process.pid))
+                    process.kill()
+
+    def _handle_stop_signal(self, signum, frame):
+        logging.info(u'===> got signal {}, stopping workers'.format(signum))
+        self.stop()
+
+    def stop(self):
+        """ask all workers to shut down (SIGTERM)
+        """
+        if self._stopping:
+            return
+
+        self._stopping = True
+        self._stop_time = time.time()
+        for process in self._processes.values():
+            process.terminate()